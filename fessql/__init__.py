@@ -11,6 +11,8 @@ from .utils import *
 from .sql import *
 from ._cachelru import *
 from .tinymysql import *
+from ._router import *
+from ._shard_table import *
 
 __all__ = (
     "gen_class_name", "Cached",
@@ -25,6 +27,9 @@ __all__ = (
 
     "TinyMysql",
 
+    "ShardRouter", "ShardTarget", "SHARD_MODULO", "SHARD_CONSISTENT", "TimePartitionRouter", "PARTITION_DAY",
+    "PARTITION_MONTH", "PARTITION_YEAR", "ShardModel", "ShardTable",
+
     "__version__",
 )
 
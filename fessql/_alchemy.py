@@ -8,12 +8,15 @@
 """
 
 import uuid
-from typing import ClassVar, Dict, MutableMapping, Optional, Sequence
+from typing import ClassVar, Dict, Iterable, List, MutableMapping, Optional, Sequence
 
+import aelog
 import sqlalchemy as sa
 from sqlalchemy.ext.declarative import DeclarativeMeta, declarative_base
-from sqlalchemy.orm.attributes import InstrumentedAttribute
 
+from ._model_cache import ShardModelCache
+from ._model_meta import ModelRegistry, model_registry
+from ._shard_table import ShardModel
 from .err import ConfigError
 from .utils import gen_class_name
 
@@ -26,6 +29,10 @@ class AlchemyMixIn(object):
     """
 
     Model: ClassVar[DeclarativeMeta] = declarative_base()
+    #: model的字段元数据注册表,可以通过model_registry.stats()查看命中情况
+    model_registry: ClassVar[ModelRegistry] = model_registry
+    #: gen_model生成的分表model的LRU缓存,可以通过model_cache.resize()更改最大个数,model_cache.stats()查看命中情况
+    model_cache: ClassVar[ShardModelCache] = ShardModelCache()
 
     # noinspection PyUnresolvedReferences
     def verify_binds(self, ):
@@ -58,12 +65,13 @@ class AlchemyMixIn(object):
         用于根据现有的model生成新的model类
 
         1.主要用于分表的查询和插入生成新的model,这时候生成的model和原有的model一致,主要是类名和表明不同.
+        生成的model按照所有参数缓存在model_cache中,超过最大个数时按照LRU淘汰并从Model.metadata中删除.
         2.映射字段主要用来处理同一个字段在不同的库中有不同的名称的情况
         3.生成新的model类时的字段多少,如果字段比model_cls类中的多,则按照model_cls中的字段为准,
         如果字段比model_cls类中的少,则以fields中的为准
         Args:
             model_cls: 要生成分表的model类
-            class_suffix: 新的model类名的后缀,生成新的类时需要使用
+            class_suffix: 新的model类名的后缀,生成新的类时需要使用,为空时使用table_suffix
             table_suffix: 新的table名的后缀,生成新的表名时需要使用
             table_name: 如果指定了table name则使用,否则使用model_cls的table name
             field_mapping: 字段映射,字段别名,如果有字段别名则生成的别名按照映射中的别名来,
@@ -76,6 +84,18 @@ class AlchemyMixIn(object):
         if not issubclass(model_cls, self.Model):
             raise ValueError("model_cls must be db.Model type.")
 
+        # 类名后缀为空时使用表名后缀,按照实际的类名后缀缓存,否则相同的model会生成两次
+        class_suffix = class_suffix or table_suffix
+        key = self.model_cache.gen_key(model_cls, class_suffix, table_suffix, table_name, field_mapping, fields)
+        return self.model_cache.get(key, lambda: self._create_model(
+            model_cls, class_suffix, table_suffix, table_name, field_mapping, fields))
+
+    def _create_model(self, model_cls: DeclarativeMeta, class_suffix: str, table_suffix: str,
+                      table_name: Optional[str], field_mapping: Optional[Dict[str, str]],
+                      fields: Optional[Sequence[str]]) -> DeclarativeMeta:
+        """
+        生成新的model类,参数和gen_model一致
+        """
         if table_name is None:
             table_name = f"{getattr(model_cls, '__tablename__', model_cls.__name__.rstrip('Model'))}"
         if class_suffix:
@@ -84,41 +104,81 @@ class AlchemyMixIn(object):
             class_name = f"{gen_class_name(table_name)}Model"
         if table_suffix:
             table_name = f"{table_name}_{table_suffix}"
+        # 字段不同的model类名相同时增加类名的后缀,否则declarative的类注册表中会被替换
+        if class_name in getattr(self.Model, "_decl_class_registry", {}):
+            class_name = f"{class_name[:-len('Model')]}{uuid.uuid4().hex[:8]}Model"
+
+        # column mapping
+        model_fields = {}
+        field_mapping = {} if not isinstance(field_mapping, MutableMapping) else field_mapping
+        fields = tuple() if not isinstance(fields, Sequence) else (*fields, *field_mapping.keys())
+        for attr_name, field in self.model_registry.get(model_cls).columns.items():
+            if fields and attr_name not in fields:
+                continue
+            model_fields[attr_name] = sa.Column(
+                name=field_mapping.get(attr_name, field.name),
+                type_=field.type, primary_key=field.primary_key, index=field.index,
+                nullable=field.nullable, default=field.default, onupdate=field.onupdate,
+                unique=field.unique, autoincrement=field.autoincrement, doc=field.doc)
+        # __table_args__
+        table_args = getattr(model_cls, "__table_args__",
+                             {'mysql_engine': 'InnoDB', 'mysql_charset': 'utf8mb4'})
+        # 同一个表已经在Model.metadata中时,比如原表或者字段不同的同一个分表,表注册到单独的metadata中,
+        # 表名保持不变,查询时仍然访问实际的表
+        schema = table_args.get("schema")
+        if (f"{schema}.{table_name}" if schema else table_name) in self.Model.metadata.tables:
+            model_fields["metadata"] = sa.MetaData()
+        return type(class_name, (self.Model,), {
+            "__doc__": model_cls.__doc__,
+            "__table_args__ ": table_args,
+            "__tablename__": table_name,
+            "__module__": model_cls.__module__,
+            **model_fields})
+
+    def shard_model(self, model_cls: DeclarativeMeta, table_suffix: str, table_name: Optional[str] = None
+                    ) -> ShardModel:
+        """
+        生成轻量的分表model
 
-        if getattr(model_cls, "_cache_class", None) is None:
-            setattr(model_cls, "_cache_class", {})
-
-        model_cls_ = getattr(model_cls, "_cache_class").get(class_name, None)
-        if model_cls_ is None:
-            # column mapping
-            model_fields = {}
-            field_mapping = {} if not isinstance(field_mapping, MutableMapping) else field_mapping
-            fields = tuple() if not isinstance(fields, Sequence) else (*fields, *field_mapping.keys())
-            for attr_name, field in model_cls.__dict__.items():
-                if isinstance(field, InstrumentedAttribute) and not attr_name.startswith("_"):
-                    if fields and attr_name not in fields:
-                        continue
-                    model_fields[attr_name] = sa.Column(
-                        name=field_mapping.get(attr_name, field.name),
-                        type_=field.type, primary_key=field.primary_key, index=field.index,
-                        nullable=field.nullable, default=field.default, onupdate=field.onupdate,
-                        unique=field.unique, autoincrement=field.autoincrement, doc=field.doc)
-            # __table_args__
-            table_args = getattr(model_cls, "__table_args__",
-                                 {'mysql_engine': 'InnoDB', 'mysql_charset': 'utf8mb4'})
-            # 如果schema参数不为空,证明已经指明了分库,这里就不做处理了
-            # 这里只处理不分库但是table_name重复的情况,自动增加表明的后缀
-            table_suffix_ = None
-            if table_args.get("schema") is None and table_name in self.Model.metadata.tables:
-                table_suffix_ = f"_{uuid.uuid4().hex}"
-                table_name = f"{table_name}{table_suffix_}"
-            model_cls_ = type(class_name, (self.Model,), {
-                "__doc__": model_cls.__doc__,
-                "__table_args__ ": table_args,
-                "__tablename__": table_name,
-                "__table_suffix__": table_suffix_,
-                "__module__": model_cls.__module__,
-                **model_fields})
-            getattr(model_cls, "_cache_class")[class_name] = model_cls_
-
-        return model_cls_
+        和gen_model生成的分表model相比,只生成原表的别名,字段为原表字段的代理,不生成declarative类、mapper,
+        也不注册到Model.metadata中,适合分表数量很多的情况;可以用于Query.model()、FesMgrSession.query()
+        以及scatter_all等分表查询,不能用于建表以及ORM的对象操作.和gen_model共用model_cache.
+        eg: order = db.shard_model(Order, "01")
+            query = db.query.model(order).where(order.uid == 1)
+        Args:
+            model_cls: 原model类
+            table_suffix: 表名的后缀
+            table_name: 如果指定了table name则使用,否则使用model_cls的table name
+        Returns:
+            ShardModel
+        """
+        if not issubclass(model_cls, self.Model):
+            raise ValueError("model_cls must be db.Model type.")
+
+        key = (*self.model_cache.gen_key(model_cls, "", table_suffix, table_name, None, None), ShardModel)
+        return self.model_cache.get(key, lambda: ShardModel(
+            model_cls, f"{table_name or model_cls.__tablename__}_{table_suffix}"))
+
+    def warm_models(self, model_cls: DeclarativeMeta, suffixes: Iterable[str], *, table_name: Optional[str] = None,
+                    field_mapping: Optional[Dict[str, str]] = None, fields: Optional[Sequence[str]] = None
+                    ) -> List[DeclarativeMeta]:
+        """
+        启动时批量生成分表model,避免在请求中逐个生成
+
+        每个后缀同时作为类名后缀和表名后缀,和ShardRouter、TimePartitionRouter生成的分表model一致.
+        eg: db.warm_models(Order, [f"{index:02d}" for index in range(64)])
+        Args:
+            model_cls: 要生成分表的model类
+            suffixes: 分表的后缀
+            table_name: 如果指定了table name则使用,否则使用model_cls的table name
+            field_mapping: 字段映射,和gen_model一致
+            fields: 生成新的model类时的字段,和gen_model一致
+        Returns:
+            按照suffixes顺序的分表model
+        """
+        models = [self.gen_model(model_cls, class_suffix=suffix, table_suffix=suffix, table_name=table_name,
+                                 field_mapping=field_mapping, fields=fields) for suffix in suffixes]
+        if len(models) > self.model_cache.max_size:
+            aelog.warning(f"warm {len(models)} models of {model_cls.__name__} exceeds the model cache max size "
+                          f"{self.model_cache.max_size}, the earlier models have been evicted.")
+        return models
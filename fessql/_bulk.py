@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午6:20
+
+批量更新和批量upsert
+
+多行不同值的更新合并为分块的单条语句,每个分块只需要一次语句解析和一次按照主键的IN查找:
+UPDATE t SET col = CASE pk WHEN :k1 THEN :v1 WHEN :k2 THEN :v2 ELSE col END WHERE pk IN (:k1, :k2)
+
+插入或更新合并为分块的多行 INSERT ... ON DUPLICATE KEY UPDATE,不再先插入、捕获重复键后再查询和更新.
+
+大量数据的删除或者更新按照主键分批执行,每批只锁定少量的行,批次之间可以暂停和限速,减少锁等待和主从延迟.
+"""
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import Column, bindparam, case, delete, select, tuple_, update
+from sqlalchemy.dialects.mysql import Insert as MySQLInsert, insert as mysql_insert
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.sql import ClauseElement, Delete, Select, Update
+
+from ._keyset import KeysetOrder
+from ._model_meta import model_registry
+from .err import FuncArgsError
+
+__all__ = ("DEFAULT_BULK_CHUNK_SIZE", "MAX_BIND_PARAMS", "gen_case_updates", "UPSERT_VALUES", "UPSERT_INCREMENT",
+           "UPSERT_KEEP", "gen_upserts", "gen_upsert_sql", "parse_upsert_result", "BatchWriter")
+
+#: 批量更新时每个分块的默认行数
+DEFAULT_BULK_CHUNK_SIZE: int = 1000
+#: MySQL单条预处理语句的最大参数个数
+MAX_BIND_PARAMS: int = 65535
+
+
+def gen_case_updates(model: DeclarativeMeta, rows: Sequence[Mapping[str, Any]], key: str = "id",
+                     chunk_size: int = DEFAULT_BULK_CHUNK_SIZE, whereclause: Sequence[ClauseElement] = (),
+                     onupdate_value: Optional[Dict[str, Any]] = None) -> Iterator[Update]:
+    """
+    把多行的更新数据合并为分块的CASE更新语句
+
+    数据按照key排序后分块,所有的事务都按照相同的顺序加锁,减少并发更新时的死锁.
+    key相同的多行数据合并为一行,后面的值覆盖前面的值;某一行中没有的字段保持原值不变.
+    Args:
+        model: model类
+        rows: 更新的数据,每行都需要包含key字段,eg: [{"id": 1, "price": 10}, {"id": 2, "price": 12}]
+        key: 定位行的字段名,一般为主键或者唯一键
+        chunk_size: 每个分块的最大行数,参数个数超过MAX_BIND_PARAMS时自动减小
+        whereclause: 附加的查询条件
+        onupdate_value: 数据中没有时更新的值,比如update默认值
+    Returns:
+        分块的update语句
+    """
+    if chunk_size < 1:
+        raise FuncArgsError("chunk_size value error!")
+    columns: Dict[str, Column] = model_registry.get(model).columns
+    if key not in columns:
+        raise FuncArgsError(f"bulk update key {key} is not a column of {model.__name__}!")
+    key_column = columns[key]
+
+    merged_rows: Dict[Any, Dict[str, Any]] = {}
+    update_columns: Dict[str, Column] = {}
+    for one_row in rows:
+        if key not in one_row:
+            raise FuncArgsError(f"bulk update row must contain the key {key}!")
+        for name in one_row:
+            if name not in columns:
+                raise FuncArgsError(f"bulk update column {name} is not a column of {model.__name__}!")
+            if name != key:
+                update_columns[name] = columns[name]
+        merged_rows.setdefault(one_row[key], {}).update(one_row)
+    if not update_columns:
+        return
+    onupdate_value = {name: value for name, value in (onupdate_value or {}).items() if name not in update_columns}
+
+    # 每行最多占用 2 * 字段数 + 1 个参数
+    chunk_size = min(chunk_size, (MAX_BIND_PARAMS - len(onupdate_value)) // (2 * len(update_columns) + 1))
+    sorted_keys: List[Any] = sorted(merged_rows)
+    for start in range(0, len(sorted_keys), chunk_size):
+        chunk_keys = sorted_keys[start: start + chunk_size]
+        values: Dict[Column, Any] = {}
+        for name, column in update_columns.items():
+            whens = [(bindparam(None, one_key, type_=key_column.type),
+                      bindparam(None, merged_rows[one_key][name], type_=column.type))
+                     for one_key in chunk_keys if name in merged_rows[one_key]]
+            if whens:
+                values[column] = case(whens, value=key_column, else_=column)
+        for name, value in onupdate_value.items():
+            values[columns[name]] = value
+
+        query = update(model).values(values).where(
+            key_column.in_([bindparam(None, one_key, type_=key_column.type) for one_key in chunk_keys]))
+        for one_clause in whereclause:
+            query = query.where(one_clause)
+        yield query
+
+
+#: 重复时更新为插入的值,col = VALUES(col)
+UPSERT_VALUES: str = "values"
+#: 重复时累加插入的值,col = col + VALUES(col)
+UPSERT_INCREMENT: str = "increment"
+#: 重复时保持原值
+UPSERT_KEEP: str = "keep"
+#: 多行INSERT的info,eg: Records: 3  Duplicates: 1  Warnings: 0
+_DUPLICATES_RE = re.compile(rb"Duplicates:\s*(\d+)")
+
+
+def _verify_upsert_columns(update_columns: Union[Sequence[str], Mapping[str, str], None],
+                           insert_columns: Sequence[str], exclude_columns: Sequence[str] = ()) -> Dict[str, str]:
+    """
+    校验重复时更新的字段
+    Args:
+        update_columns: 字段名列表时都使用UPSERT_VALUES,字典时为{字段名: 更新方式},为None时更新插入的所有字段
+        insert_columns: 插入的字段名
+        exclude_columns: update_columns为None时不更新的字段,比如主键
+    Returns:
+        {字段名: 更新方式},不包含保持原值的字段
+    """
+    if update_columns is None:
+        return {name: UPSERT_VALUES for name in insert_columns if name not in exclude_columns}
+    if not isinstance(update_columns, Mapping):
+        update_columns = {name: UPSERT_VALUES for name in update_columns}
+    for name, mode in update_columns.items():
+        if name not in insert_columns:
+            raise FuncArgsError(f"upsert update column {name} must be in the insert columns!")
+        if mode not in (UPSERT_VALUES, UPSERT_INCREMENT, UPSERT_KEEP):
+            raise FuncArgsError(f"upsert mode must be one of {UPSERT_VALUES}, {UPSERT_INCREMENT}, {UPSERT_KEEP}.")
+    return {name: mode for name, mode in update_columns.items() if mode != UPSERT_KEEP}
+
+
+def _chunk_rows(rows: Iterable[Mapping[str, Any]], chunk_size: int, max_chunk_size: int
+                ) -> Iterator[List[Mapping[str, Any]]]:
+    """
+    数据分块
+    """
+    if chunk_size < 1:
+        raise FuncArgsError("chunk_size value error!")
+    chunk_size = min(chunk_size, max_chunk_size)
+    chunk: List[Mapping[str, Any]] = []
+    for one_row in rows:
+        chunk.append(one_row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def gen_upserts(model: DeclarativeMeta, rows: Sequence[Mapping[str, Any]],
+                update_columns: Union[Sequence[str], Mapping[str, str], None] = None,
+                chunk_size: int = DEFAULT_BULK_CHUNK_SIZE, onupdate_value: Optional[Dict[str, Any]] = None
+                ) -> Iterator[Tuple[int, MySQLInsert]]:
+    """
+    把多行数据生成分块的 INSERT ... ON DUPLICATE KEY UPDATE 语句
+
+    每行数据都会补充model的insert默认值,补充后所有行的字段必须相同.
+    Args:
+        model: model类
+        rows: 插入的数据
+        update_columns: 重复时更新的字段,字段名列表时更新为插入的值;字典时为{字段名: 更新方式},
+            更新方式为UPSERT_VALUES、UPSERT_INCREMENT或者UPSERT_KEEP;为None时更新数据中除主键外的所有字段
+        chunk_size: 每个分块的最大行数,参数个数超过MAX_BIND_PARAMS时自动减小
+        onupdate_value: 重复时额外更新的值,比如update默认值
+    Returns:
+        (分块的行数, 分块的语句)
+    """
+    if not rows:
+        return
+    model_meta = model_registry.get(model)
+    columns: Dict[str, Column] = model_meta.columns
+    for name in rows[0]:
+        if name not in columns:
+            raise FuncArgsError(f"upsert column {name} is not a column of {model.__name__}!")
+    modes = _verify_upsert_columns(update_columns, list(rows[0]), model_meta.primary_keys)
+    onupdate_value = {name: value for name, value in (onupdate_value or {}).items() if name not in modes}
+
+    insert_rows = [{**model_meta.gen_default_value(), **one_row} for one_row in rows]
+    insert_names = set(insert_rows[0])
+    for one_row in insert_rows:
+        if one_row.keys() != insert_names:
+            raise FuncArgsError("upsert rows must have the same columns!")
+
+    for chunk in _chunk_rows(insert_rows, chunk_size, MAX_BIND_PARAMS // len(insert_names)):
+        query = mysql_insert(model).values(chunk)
+        set_values: Dict[str, Any] = {}
+        for name, mode in modes.items():
+            column = columns[name]
+            inserted_value = query.inserted[column.name]
+            set_values[column.name] = inserted_value if mode == UPSERT_VALUES else column + inserted_value
+        if set_values:
+            for name, value in onupdate_value.items():
+                set_values[columns[name].name] = value
+        else:
+            # 所有字段都保持原值时,更新主键为原值,重复的行不会变化也不会有警告
+            key_column = columns[model_meta.primary_keys[0]] if model_meta.primary_keys else query.table.c[0]
+            set_values[key_column.name] = key_column
+        yield len(chunk), query.on_duplicate_key_update(set_values)
+
+
+def _quote_name(name: str) -> str:
+    """
+    转义MySQL的标识符
+    """
+    return ".".join(f"`{one_name.replace('`', '``')}`" for one_name in name.split("."))
+
+
+def gen_upsert_sql(table_name: str, rows: Sequence[Mapping[str, Any]],
+                   update_columns: Union[Sequence[str], Mapping[str, str], None] = None,
+                   chunk_size: int = DEFAULT_BULK_CHUNK_SIZE) -> Iterator[Tuple[int, str, List[Any]]]:
+    """
+    把多行数据生成分块的 INSERT ... ON DUPLICATE KEY UPDATE SQL,使用%s占位符
+    Args:
+        table_name: 表名,可以为 库名.表名
+        rows: 插入的数据,所有行的字段必须相同
+        update_columns: 重复时更新的字段,和gen_upserts相同,为None时更新所有字段
+        chunk_size: 每个分块的最大行数
+    Returns:
+        (分块的行数, SQL, 参数)
+    """
+    if not rows:
+        return
+    insert_names = list(rows[0])
+    if not insert_names:
+        raise FuncArgsError("upsert rows can not be empty!")
+    modes = _verify_upsert_columns(update_columns, insert_names)
+    set_sql = [f"{_quote_name(name)} = VALUES({_quote_name(name)})" if mode == UPSERT_VALUES else
+               f"{_quote_name(name)} = {_quote_name(name)} + VALUES({_quote_name(name)})"
+               for name, mode in modes.items()] or [f"{_quote_name(insert_names[0])} = {_quote_name(insert_names[0])}"]
+    insert_sql = f"INSERT INTO {_quote_name(table_name)} ({', '.join(_quote_name(name) for name in insert_names)})"
+    row_sql = f"({', '.join(['%s'] * len(insert_names))})"
+
+    for chunk in _chunk_rows(rows, chunk_size, MAX_BIND_PARAMS // len(insert_names)):
+        args: List[Any] = []
+        for one_row in chunk:
+            if len(one_row) != len(insert_names):
+                raise FuncArgsError("upsert rows must have the same columns!")
+            try:
+                args.extend(one_row[name] for name in insert_names)
+            except KeyError:
+                raise FuncArgsError("upsert rows must have the same columns!")
+        sql = f"{insert_sql} VALUES {', '.join([row_sql] * len(chunk))} ON DUPLICATE KEY UPDATE {', '.join(set_sql)}"
+        yield len(chunk), sql, args
+
+
+def parse_upsert_result(row_count: int, affected_rows: int, info: Union[bytes, str, None] = None) -> Tuple[int, int]:
+    """
+    解析 INSERT ... ON DUPLICATE KEY UPDATE 的插入和更新条数
+
+    多行INSERT时服务端返回的info中有Duplicates,即重复键的行数(包括值没有变化的行);
+    单行INSERT没有info,影响行数为1时是插入,为2(更新)或者0(值没有变化)时是重复.
+    Args:
+        row_count: 插入的行数
+        affected_rows: 影响的行数
+        info: 服务端返回的info
+    Returns:
+        (插入的条数, 重复后更新的条数)
+    """
+    if isinstance(info, str):
+        info = info.encode()
+    matched = _DUPLICATES_RE.search(info) if info else None
+    if matched:
+        updated = int(matched.group(1))
+    elif row_count == 1:
+        updated = 0 if affected_rows == 1 else 1
+    else:
+        # 没有info时按照插入为1、更新为2估算,值没有变化的行会被算作插入
+        updated = min(max(affected_rows - row_count, 0), row_count)
+    return row_count - updated, updated
+
+
+class BatchWriter(object):
+    """
+    分批删除或者更新
+
+    每批先按照主键顺序查询下一批的主键 SELECT pk FROM t WHERE ... AND pk > :last ORDER BY pk LIMIT n,
+    再按照主键删除或者更新 DELETE FROM t WHERE pk IN (...) AND ...,直到没有匹配的行.
+    按照主键定位下一批,更新后仍然匹配条件的行不会被重复更新,删除时也不会重复扫描已经删除的行.
+    """
+
+    def __init__(self, model: DeclarativeMeta, whereclause: Sequence[ClauseElement] = (),
+                 values: Optional[Mapping[Any, Any]] = None, batch_size: int = DEFAULT_BULK_CHUNK_SIZE,
+                 pause: float = 0, max_rows_per_second: float = 0,
+                 progress: Optional[Callable[[int, int], Any]] = None):
+        """
+            分批删除或者更新
+        Args:
+            model: model类
+            whereclause: 删除或者更新的条件
+            values: 更新的值,为None时删除
+            batch_size: 每批的最大行数
+            pause: 每批之间暂停的秒数
+            max_rows_per_second: 每秒最多删除或者更新的行数,默认0不限制
+            progress: 每批执行后的回调,参数为(累计影响的行数, 本批影响的行数)
+        """
+        if batch_size < 1:
+            raise FuncArgsError("batch_size value error!")
+        if pause < 0 or max_rows_per_second < 0:
+            raise FuncArgsError("pause or max_rows_per_second value error!")
+        model_meta = model_registry.get(model)
+        if not model_meta.primary_keys:
+            raise FuncArgsError(f"batch write model {model.__name__} must have primary key!")
+        self.model: DeclarativeMeta = model
+        self.whereclause: List[ClauseElement] = list(whereclause)
+        self.values: Optional[Mapping[Any, Any]] = values
+        self.batch_size: int = batch_size
+        self.pause: float = pause
+        self.max_rows_per_second: float = max_rows_per_second
+        self.progress: Optional[Callable[[int, int], Any]] = progress
+        self.rowcount: int = 0
+        self._keys: List[Column] = [model_meta.columns[name] for name in model_meta.primary_keys]
+        self._keyset: KeysetOrder = KeysetOrder((), self._keys)
+        self._last_key: Optional[Sequence[Any]] = None
+
+    def select_query(self, ) -> Select:
+        """
+        查询下一批主键的语句
+        """
+        query = select(self._keys).order_by(*self._keyset.order_by()).limit(self.batch_size)
+        for one_clause in self.whereclause:
+            query = query.where(one_clause)
+        if self._last_key is not None:
+            query = query.where(self._keyset.where(self._last_key))
+        return query
+
+    def write_query(self, rows: Sequence[Any]) -> Union[Delete, Update]:
+        """
+        按照主键删除或者更新这一批数据的语句,同时记录最后一个主键用于查询下一批
+        Args:
+            rows: select_query查询的结果
+        Returns:
+
+        """
+        keys = [tuple(one_row[column] for column in self._keys) for one_row in rows]
+        self._last_key = keys[-1]
+        if len(self._keys) == 1:
+            key_clause = self._keys[0].in_([one_key[0] for one_key in keys])
+        else:
+            key_clause = tuple_(*self._keys).in_([tuple_(*one_key) for one_key in keys])
+        query = delete(self.model) if self.values is None else update(self.model).values(self.values)
+        query = query.where(key_clause)
+        # 查询主键和删除之间数据可能已经变化,删除或者更新时再次校验条件
+        for one_clause in self.whereclause:
+            query = query.where(one_clause)
+        return query
+
+    def finish_batch(self, rowcount: int, elapsed: float) -> Tuple[Any, float]:
+        """
+        记录这一批的结果,调用进度回调并计算暂停的时间
+        Args:
+            rowcount: 这一批影响的行数
+            elapsed: 这一批执行的秒数
+        Returns:
+            (进度回调的返回值, 下一批之前需要暂停的秒数)
+        """
+        self.rowcount += rowcount
+        progress_result = self.progress(self.rowcount, rowcount) if self.progress is not None else None
+        delay = self.pause
+        if self.max_rows_per_second:
+            delay = max(delay, rowcount / self.max_rows_per_second - elapsed)
+        return progress_result, delay
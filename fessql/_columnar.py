@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午9:10
+
+按列返回的查询结果
+
+分批读取驱动返回的原始行,直接按列填充,不再为每一行生成RowProxy.
+整数和浮点数的字段使用array.array存储,安装了numpy时转换为numpy数组,其他字段为列表.
+"""
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+try:
+    # noinspection PyUnresolvedReferences
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ("COLUMNAR_BATCH_SIZE", "ColumnarBuilder", "fetch_columnar")
+
+#: 按列读取时每批读取的行数
+COLUMNAR_BATCH_SIZE: int = 1000
+
+
+def _typecode(values: Sequence[Any]) -> Optional[str]:
+    """
+    数值的array类型,全部是整数时为q,整数和浮点数时为d,其他为None
+    """
+    value_types = set(map(type, values))
+    if value_types == {int}:
+        return "q"
+    if value_types <= {int, float}:
+        return "d"
+    return None
+
+
+def _extend_column(column: Union[array, List[Any]], values: Sequence[Any]) -> Union[array, List[Any]]:
+    """
+    向字段中追加一批数据
+
+    第一批数据都是数值时使用array,之后有不同类型的数据或者整数溢出时转换为列表,整数的array中有浮点数时转换为浮点数的array
+    Args:
+        column: 已有的字段数据
+        values: 这一批的数据
+    Returns:
+        追加后的字段数据
+    """
+    typecode = _typecode(values)
+    if isinstance(column, array):
+        if typecode is not None:
+            if column.typecode == "d":
+                typecode = "d"
+            elif typecode == "d":
+                column = array("d", column)
+            try:
+                column.extend(array(typecode, values))
+                return column
+            except OverflowError:
+                pass
+        column = column.tolist()
+    elif not column and typecode is not None:
+        try:
+            return array(typecode, values)
+        except OverflowError:
+            pass
+    column.extend(values)
+    return column
+
+
+class ColumnarBuilder(object):
+    """
+    按列收集查询结果
+    """
+
+    __slots__ = ("keys", "processors", "_columns")
+
+    def __init__(self, keys: Sequence[str], processors: Optional[Sequence[Optional[Callable]]] = None):
+        """
+            按列收集查询结果
+        Args:
+            keys: 字段名
+            processors: 每个字段的结果处理函数,和RowProxy中的一致,为None时不处理
+        """
+        self.keys: List[str] = list(keys)
+        self.processors: List[Optional[Callable]] = list(processors) if processors else [None] * len(self.keys)
+        self._columns: List[Union[array, List[Any]]] = [[] for _ in self.keys]
+
+    def append(self, rows: Sequence[Sequence[Any]]) -> None:
+        """
+        追加驱动返回的一批原始行
+        Args:
+            rows: 原始的行数据
+        Returns:
+
+        """
+        if not rows:
+            return
+        for index, (processor, values) in enumerate(zip(self.processors, zip(*rows))):
+            if processor is not None:
+                values = [processor(value) for value in values]
+            self._columns[index] = _extend_column(self._columns[index], values)
+
+    def build(self, ) -> Dict[str, Any]:
+        """
+        生成{字段名: 字段数据},安装了numpy时数值字段为numpy数组
+        Returns:
+
+        """
+        result: Dict[str, Any] = {}
+        for key, column in zip(self.keys, self._columns):
+            if numpy is not None and isinstance(column, array):
+                column = numpy.frombuffer(column, dtype=numpy.int64 if column.typecode == "q" else numpy.float64)
+            result[key] = column
+        return result
+
+
+def fetch_columnar(result: Any, batch_size: int = COLUMNAR_BATCH_SIZE, size: Optional[int] = None
+                   ) -> Dict[str, Any]:
+    """
+    按列读取sqlalchemy ResultProxy的结果,读取完成后关闭结果
+    Args:
+        result: sqlalchemy ResultProxy
+        batch_size: 每批读取的行数
+        size: 最多读取的行数,为None时读取所有
+    Returns:
+        {字段名: 字段数据}
+    """
+    if not result.returns_rows:
+        return {}
+    builder = ColumnarBuilder(result.keys(), result._metadata._processors)
+    remaining = size
+    while remaining is None or remaining > 0:
+        rows = result._fetchmany_impl(batch_size if remaining is None else min(batch_size, remaining))
+        if not rows:
+            break
+        builder.append(rows)
+        if remaining is not None:
+            remaining -= len(rows)
+    result.close()
+    return builder.build()
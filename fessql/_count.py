@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午5:30
+
+分页总数的统计策略
+
+大表的精确count(*)需要扫描整个索引,分页时可以选择使用估算的总数:
+1.没有查询条件时使用information_schema.TABLES中的TABLE_ROWS
+2.有查询条件时使用EXPLAIN中的rows估算
+
+翻页时同一个查询条件的总数可以通过CountCache缓存,写入对应的表后缓存失效.
+"""
+import re
+import time
+from threading import RLock
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy.sql import ClauseElement, Select
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.schema import Table
+
+from ._cachelru import LRU
+from ._shard_table import ShardTable
+from .err import FuncArgsError
+
+__all__ = ("COUNT_EXACT", "COUNT_ESTIMATE", "COUNT_AUTO", "DEFAULT_COUNT_THRESHOLD", "verify_count_strategy",
+           "is_estimable", "gen_table_rows_sql", "parse_table_rows", "parse_explain_rows", "CountCache")
+
+#: 精确统计,执行count(*)
+COUNT_EXACT: str = "exact"
+#: 估算总数,无法估算时精确统计
+COUNT_ESTIMATE: str = "estimate"
+#: 估算的总数小于阈值时精确统计,否则使用估算的总数
+COUNT_AUTO: str = "auto"
+#: auto策略时的默认阈值
+DEFAULT_COUNT_THRESHOLD: int = 100000
+
+
+def verify_count_strategy(count_strategy: str) -> None:
+    """
+    校验统计策略
+    Args:
+        count_strategy: 统计策略
+    Returns:
+
+    """
+    if count_strategy not in (COUNT_EXACT, COUNT_ESTIMATE, COUNT_AUTO):
+        raise FuncArgsError(f"count_strategy must be one of {COUNT_EXACT}, {COUNT_ESTIMATE}, {COUNT_AUTO}.")
+
+
+def is_estimable(query: Select) -> Tuple[bool, Optional[Table]]:
+    """
+    判断查询是否可以估算总数
+
+    有GROUP BY或者DISTINCT时查询的是分组或者去重后的条数,估算不准确
+    Args:
+        query: 查询的select语句
+    Returns:
+        (是否可以估算, 没有查询条件的单表查询时返回表,否则为None)
+    """
+    if query._group_by_clause.clauses or query._distinct:
+        return False, None
+    froms = query.froms
+    if query._whereclause is None and len(froms) == 1 and isinstance(froms[0], Table):
+        return True, froms[0]
+    return True, None
+
+
+def gen_table_rows_sql(table: Table) -> Tuple[str, Dict[str, str]]:
+    """
+    生成从information_schema.TABLES中获取表的估算行数的SQL
+    Args:
+        table: 表
+    Returns:
+        (sql, params)
+    """
+    if table.schema:
+        sql = "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = %(schema)s " \
+              "AND TABLE_NAME = %(table_name)s"
+        return sql, {"schema": table.schema, "table_name": table.name}
+    sql = "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() " \
+          "AND TABLE_NAME = %(table_name)s"
+    return sql, {"table_name": table.name}
+
+
+def parse_table_rows(rows: List[Dict[str, Any]]) -> Optional[int]:
+    """
+    解析information_schema.TABLES的结果
+    Args:
+        rows: 查询结果
+    Returns:
+        估算的行数,无法获取时为None
+    """
+    if not rows or rows[0].get("TABLE_ROWS") is None:
+        return None
+    return int(rows[0]["TABLE_ROWS"])
+
+
+def parse_explain_rows(rows: List[Dict[str, Any]]) -> Optional[int]:
+    """
+    解析EXPLAIN的结果,按照驱动表的rows和filtered估算匹配的行数
+    Args:
+        rows: EXPLAIN的结果
+    Returns:
+        估算的行数,无法获取时为None,比如"Select tables optimized away"
+    """
+    if not rows or rows[0].get("rows") is None:
+        return None
+    filtered = rows[0].get("filtered")
+    estimate = float(rows[0]["rows"]) * (float(filtered) / 100 if filtered is not None else 1)
+    return int(round(estimate))
+
+
+def _find_table_names(statement: ClauseElement) -> Iterable[str]:
+    """
+    语句中的表名,ShardTable使用分表的表名,不遍历其中的原表
+    """
+    stack = [statement]
+    while stack:
+        element = stack.pop()
+        if isinstance(element, (Table, ShardTable)):
+            yield element.name
+        if not isinstance(element, ShardTable):
+            stack.extend(element.get_children())
+
+
+#: 从SQL字符串中获取写入的表名
+_WRITE_TABLE_RE = re.compile(
+    r"^\s*(?:INSERT(?:\s+(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY|IGNORE))*(?:\s+INTO)?"
+    r"|REPLACE(?:\s+(?:LOW_PRIORITY|DELAYED))*(?:\s+INTO)?"
+    r"|UPDATE(?:\s+(?:LOW_PRIORITY|IGNORE))*"
+    r"|DELETE(?:\s+(?:LOW_PRIORITY|QUICK|IGNORE))*\s+FROM"
+    r"|LOAD\s+DATA(?:\s+(?:LOW_PRIORITY|CONCURRENT))?(?:\s+LOCAL)?\s+INFILE\s+'(?:[^'\\]|\\.|'')*'"
+    r"(?:\s+(?:REPLACE|IGNORE))?\s+INTO\s+TABLE)"
+    r"\s+(?:`?\w+`?\.)?`?(\w+)`?", re.IGNORECASE)
+
+
+class CountCache(object):
+    """
+    分页总数的缓存
+
+    key为查询数量的SQL和参数,即model以及WHERE、GROUP BY条件的指纹,缓存有过期时间.
+    每个表有一个版本号,写入表后版本号增加,缓存中记录的版本号和当前的不一致时缓存失效,不需要遍历缓存删除.
+    """
+
+    def __init__(self, ttl: float = 0, max_size: int = 1024, invalidate_on_write: bool = True):
+        """
+            分页总数的缓存
+        Args:
+            ttl: 缓存的过期时间,单位秒,为0时不缓存
+            max_size: 缓存的最大条数
+            invalidate_on_write: 写入表后是否使对应表的缓存失效
+        """
+        self.ttl: float = ttl
+        self.invalidate_on_write: bool = invalidate_on_write
+        self._cache: LRU = LRU(max_size=max_size)
+        # {(bind, 表名): 版本号}, 表名为None时为整个bind的版本号
+        self._versions: Dict[Tuple[Optional[str], Optional[str]], int] = {}
+        self._lock = RLock()
+        self.hit_count: int = 0
+        self.miss_count: int = 0
+        self.invalidate_count: int = 0
+
+    @property
+    def enabled(self, ) -> bool:
+        return self.ttl > 0
+
+    @property
+    def max_size(self, ) -> int:
+        return self._cache.max_size
+
+    @staticmethod
+    def gen_key(sql: str, params: Optional[Dict[str, Any]], *options: Any) -> str:
+        """
+        生成缓存的key
+        Args:
+            sql: 查询数量的SQL
+            params: SQL的参数
+            options: 其他影响总数的选项,比如统计策略
+        Returns:
+
+        """
+        return f"{sql}\x00{sorted((params or {}).items())!r}\x00{options!r}"
+
+    @staticmethod
+    def statement_tables(statement: ClauseElement) -> List[str]:
+        """
+        获取查询语句中的表名
+        Args:
+            statement: sqlalchemy表达式
+        Returns:
+
+        """
+        return sorted(set(_find_table_names(statement)))
+
+    @staticmethod
+    def write_tables(query: Union[ClauseElement, str, bytes, None]) -> Optional[List[str]]:
+        """
+        获取写入语句中的表名
+        Args:
+            query: sqlalchemy表达式或者SQL字符串,为None时表示未知的写入
+        Returns:
+            表名列表,无法获取时为None
+        """
+        if isinstance(query, UpdateBase):
+            return sorted(set(_find_table_names(query.table)))
+        if isinstance(query, TextClause):
+            query = query.text
+        if isinstance(query, bytes):
+            query = query[:512].decode(errors="ignore")
+        if isinstance(query, str):
+            matched = _WRITE_TABLE_RE.match(query)
+            if matched:
+                return [matched.group(1)]
+        return None
+
+    def versions(self, bind: Optional[str], tables: Sequence[str]) -> Tuple[int, ...]:
+        """
+        当前bind和表的版本号,需要在查询总数之前获取,查询期间的写入会使缓存的总数失效
+        Args:
+            bind: bind key
+            tables: 查询中的表名
+        Returns:
+
+        """
+        with self._lock:
+            return (self._versions.get((bind, None), 0),
+                    *[self._versions.get((bind, table), 0) for table in tables])
+
+    def get(self, bind: Optional[str], key: str, versions: Tuple[int, ...]) -> Optional[Tuple[int, bool]]:
+        """
+        获取缓存的总数
+        Args:
+            bind: bind key
+            key: gen_key生成的key
+            versions: versions获取的当前版本号
+        Returns:
+            (总数, 是否为估算的总数),没有缓存或者缓存失效时为None
+        """
+        entry = self._cache.get((bind, key))
+        if entry is not None:
+            expire_at, entry_versions, total = entry
+            if expire_at >= time.monotonic() and entry_versions == versions:
+                self.hit_count += 1
+                return total
+            self._cache.pop((bind, key), None)
+        self.miss_count += 1
+        return None
+
+    def set(self, bind: Optional[str], key: str, versions: Tuple[int, ...], total: Tuple[int, bool]) -> None:
+        """
+        缓存总数
+        Args:
+            bind: bind key
+            key: gen_key生成的key
+            versions: 查询总数之前获取的版本号,查询期间有写入时缓存的总数不会命中
+            total: (总数, 是否为估算的总数)
+        Returns:
+
+        """
+        self._cache[(bind, key)] = (time.monotonic() + self.ttl, versions, total)
+
+    def invalidate(self, bind: Optional[str], tables: Optional[Sequence[str]] = None) -> None:
+        """
+        使表的缓存失效
+        Args:
+            bind: bind key
+            tables: 表名列表,为None时整个bind的缓存失效
+        Returns:
+
+        """
+        with self._lock:
+            for table in (tables if tables is not None else (None,)):
+                self._versions[(bind, table)] = self._versions.get((bind, table), 0) + 1
+            self.invalidate_count += 1
+
+    def invalidate_write(self, bind: Optional[str], query: Union[ClauseElement, str, bytes, None] = None, *,
+                         tables: Optional[Sequence[str]] = None) -> None:
+        """
+        写入后使写入表的缓存失效,无法获取写入的表时整个bind的缓存失效
+        Args:
+            bind: bind key
+            query: 写入的sqlalchemy表达式或者SQL字符串,为None并且没有tables时整个bind的缓存失效
+            tables: 写入的表名列表,写入的表已知时使用,不再从query中获取
+        Returns:
+
+        """
+        if self.enabled and self.invalidate_on_write:
+            self.invalidate(bind, tables if tables is not None else self.write_tables(query))
+
+    def clear(self, ) -> None:
+        """
+        清空缓存和统计
+        """
+        with self._lock:
+            self._cache.clear()
+            self._versions.clear()
+            self.hit_count = self.miss_count = self.invalidate_count = 0
+
+    def stats(self, ) -> Dict[str, int]:
+        """
+        缓存的统计信息
+        Returns:
+            {"hit_count": 命中次数, "miss_count": 未命中次数, "invalidate_count": 失效的次数,
+             "size": 当前缓存条数, "max_size": 最大缓存条数}
+        """
+        return {"hit_count": self.hit_count, "miss_count": self.miss_count,
+                "invalidate_count": self.invalidate_count, "size": len(self._cache),
+                "max_size": self.max_size}
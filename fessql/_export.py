@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午11:20
+
+查询结果导出为CSV或者NDJSON
+
+查询结果通过服务端游标分批读取,每批编码后写入文件或者类文件对象,内存中最多只有两批数据.
+"""
+import base64
+import csv
+import io
+import json
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, IO, List, Optional, Sequence, Union
+
+from .err import FuncArgsError
+
+__all__ = ("EXPORT_CSV", "EXPORT_NDJSON", "verify_export_format", "ExportWriter")
+
+#: 导出为CSV
+EXPORT_CSV: str = "csv"
+#: 导出为NDJSON,每行一个json对象
+EXPORT_NDJSON: str = "ndjson"
+
+
+def verify_export_format(export_format: str) -> None:
+    """
+    校验导出格式
+    Args:
+        export_format: 导出格式
+    Returns:
+
+    """
+    if export_format not in (EXPORT_CSV, EXPORT_NDJSON):
+        raise FuncArgsError(f"export_format must be one of {EXPORT_CSV}, {EXPORT_NDJSON}.")
+
+
+def _json_default(value: Any) -> Any:
+    """
+    json不支持的字段类型的转换
+    """
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, timedelta)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+class ExportWriter(object):
+    """
+    把查询结果分批编码后写入文件或者类文件对象
+
+    write_rows没有IO以外的共享状态,异步导出时在线程池中执行,不阻塞事件循环.
+    """
+
+    def __init__(self, sink: Union[str, IO], export_format: str = EXPORT_CSV, *, header: bool = True,
+                 encoding: str = "utf-8", row_values: Callable[[Any], Sequence[Any]] = tuple,
+                 csv_options: Optional[Dict[str, Any]] = None,
+                 progress: Optional[Callable[[Dict[str, float]], Any]] = None):
+        """
+            把查询结果分批编码后写入文件或者类文件对象
+        Args:
+            sink: 文件路径或者有write方法的类文件对象,文本文件写入str,其他写入bytes
+            export_format: 导出格式,csv或者ndjson
+            header: CSV是否写入表头
+            encoding: 编码
+            row_values: 从行中获取字段值的函数
+            csv_options: csv.writer的参数,比如delimiter、quoting
+            progress: 每批写入后的回调,参数为当前的统计信息stats()
+        """
+        verify_export_format(export_format)
+        if isinstance(sink, str):
+            self._sink: IO = open(sink, "wb")
+            self._owns_sink = True
+        elif callable(getattr(sink, "write", None)):
+            self._sink = sink
+            self._owns_sink = False
+        else:
+            raise FuncArgsError("export sink must be a file path or a file-like object!")
+        self._binary: bool = not isinstance(self._sink, io.TextIOBase)
+        self.export_format: str = export_format
+        self.header: bool = header
+        self.encoding: str = encoding
+        self.row_values: Callable[[Any], Sequence[Any]] = row_values
+        self.csv_options: Dict[str, Any] = csv_options or {}
+        self.progress: Optional[Callable[[Dict[str, float]], Any]] = progress
+        self.keys: Optional[List[str]] = None
+        self.rows: int = 0
+        self.bytes: int = 0
+        self._start_time: float = time.monotonic()
+        self._elapsed: Optional[float] = None
+
+    def _encode(self, rows: Sequence[Any]) -> str:
+        """
+        编码一批数据
+        """
+        buffer = io.StringIO()
+        if self.export_format == EXPORT_CSV:
+            writer = csv.writer(buffer, **self.csv_options)
+            if self.header and self.rows == 0:
+                writer.writerow(self.keys)
+            writer.writerows(map(self.row_values, rows))
+        else:
+            keys = self.keys
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(keys, self.row_values(row))), ensure_ascii=False,
+                                        default=_json_default))
+                buffer.write("\n")
+        return buffer.getvalue()
+
+    def write_rows(self, rows: Sequence[Any]) -> Any:
+        """
+        编码并写入一批数据
+        Args:
+            rows: 一批数据,行需要有keys()方法,第一批数据的字段名作为表头
+        Returns:
+            进度回调的返回值
+        """
+        if not rows:
+            return None
+        if self.keys is None:
+            self.keys = list(rows[0].keys())
+        text = self._encode(rows)
+        data = text.encode(self.encoding)
+        self._sink.write(data if self._binary else text)
+        self.rows += len(rows)
+        self.bytes += len(data)
+        return self.progress(self.stats()) if self.progress is not None else None
+
+    def close(self, ) -> Dict[str, float]:
+        """
+        结束导出,关闭通过路径打开的文件
+        Returns:
+            统计信息stats()
+        """
+        if self._elapsed is None:
+            self._elapsed = time.monotonic() - self._start_time
+            if self._owns_sink:
+                self._sink.close()
+            elif callable(getattr(self._sink, "flush", None)):
+                self._sink.flush()
+        return self.stats()
+
+    def stats(self, ) -> Dict[str, float]:
+        """
+        导出的统计信息
+        Returns:
+            {"rows": 行数, "bytes": 字节数, "elapsed": 耗时秒数, "rows_per_second": 每秒行数,
+             "bytes_per_second": 每秒字节数}
+        """
+        elapsed = self._elapsed if self._elapsed is not None else time.monotonic() - self._start_time
+        return {"rows": self.rows, "bytes": self.bytes, "elapsed": elapsed,
+                "rows_per_second": self.rows / elapsed if elapsed > 0 else 0.0,
+                "bytes_per_second": self.bytes / elapsed if elapsed > 0 else 0.0}
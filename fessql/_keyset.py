@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午4:20
+
+keyset(seek)分页
+
+按照排序字段最后一行的值定位下一页,生成 WHERE (k1, k2) > (:a, :b) ORDER BY k1, k2 LIMIT n,
+不再使用OFFSET扫描并丢弃前面的数据,深度分页的耗时和第一页相同.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.sql import and_, bindparam, operators, or_, tuple_
+from sqlalchemy.sql.elements import ColumnElement, UnaryExpression
+
+from .err import FuncArgsError
+
+__all__ = ("KeysetOrder",)
+
+#: 非json类型的值编码时的类型标记
+_ENCODERS: Tuple[Tuple[type, str, Callable[[Any], Any]], ...] = (
+    (datetime, "dt", lambda val: [val.year, val.month, val.day, val.hour, val.minute, val.second, val.microsecond]),
+    (date, "d", lambda val: [val.year, val.month, val.day]),
+    (time, "t", lambda val: [val.hour, val.minute, val.second, val.microsecond]),
+    (timedelta, "td", lambda val: val.total_seconds()),
+    (Decimal, "dec", str),
+    (bytes, "b", lambda val: base64.b64encode(val).decode()),
+)
+_DECODERS = {
+    "dt": lambda val: datetime(*val), "d": lambda val: date(*val), "t": lambda val: time(*val),
+    "td": lambda val: timedelta(seconds=val), "dec": Decimal, "b": base64.b64decode,
+}
+
+
+def _encode_value(value: Any) -> Any:
+    """
+    把排序字段的值转换为json可以序列化的值
+    Args:
+        value: 排序字段的值
+    Returns:
+
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    for value_type, tag, encoder in _ENCODERS:
+        if isinstance(value, value_type):
+            return [tag, encoder(value)]
+    raise FuncArgsError(f"keyset cursor value type {type(value).__name__} is not supported!")
+
+
+def _decode_value(value: Any) -> Any:
+    """
+    还原_encode_value转换的值
+    Args:
+        value: 编码后的值
+    Returns:
+
+    """
+    if isinstance(value, list):
+        return _DECODERS[value[0]](value[1])
+    return value
+
+
+class KeysetOrder(object):
+    """
+    keyset分页的排序字段
+
+    排序字段中没有主键时自动追加主键,保证排序是唯一的,否则排序值相同的行在翻页时会丢失或重复.
+    排序字段的值不能为NULL,NULL值的行不会出现在翻页的结果中.
+    """
+
+    __slots__ = ("columns", "descs", "names")
+
+    def __init__(self, order_by: Sequence[Any], primary_keys: Sequence[ColumnElement] = ()):
+        """
+            keyset分页的排序字段
+        Args:
+            order_by: 原始的排序,只支持字段以及字段的asc()、desc()
+            primary_keys: 主键字段
+        """
+        self.columns: List[ColumnElement] = []
+        self.descs: List[bool] = []
+        for clause in order_by:
+            clause = clause.__clause_element__() if hasattr(clause, "__clause_element__") else clause
+            desc = False
+            if isinstance(clause, UnaryExpression) and clause.modifier in (operators.asc_op, operators.desc_op):
+                clause, desc = clause.element, clause.modifier is operators.desc_op
+            if not isinstance(clause, ColumnElement) or getattr(clause, "name", None) is None:
+                raise FuncArgsError("keyset paginate order by only supports columns and column.asc()/desc()!")
+            self.columns.append(clause)
+            self.descs.append(desc)
+
+        order_keys = {self._column_key(column) for column in self.columns}
+        for column in primary_keys:
+            column = column.__clause_element__() if hasattr(column, "__clause_element__") else column
+            if self._column_key(column) not in order_keys:
+                self.columns.append(column)
+                self.descs.append(self.descs[-1] if self.descs else False)
+        if not self.columns:
+            raise FuncArgsError("keyset paginate needs order by columns or primary key!")
+        self.names: List[str] = [column.name for column in self.columns]
+
+    @staticmethod
+    def _column_key(column: ColumnElement) -> Tuple[Optional[str], str]:
+        """
+        用于判断是否为同一个字段
+        """
+        table = getattr(column, "table", None)
+        return getattr(table, "name", None), column.name
+
+    def order_by(self, backward: bool = False) -> List[UnaryExpression]:
+        """
+        生成排序语句,向前翻页时排序反转
+        Args:
+            backward: 是否为向前翻页
+        Returns:
+
+        """
+        return [column.desc() if desc is not backward else column.asc()
+                for column, desc in zip(self.columns, self.descs)]
+
+    def where(self, values: Sequence[Any], backward: bool = False) -> ColumnElement:
+        """
+        生成定位的条件
+
+        所有字段的排序方向相同时生成 (k1, k2) > (:a, :b),方向不同时展开为
+        k1 > :a OR (k1 = :a AND k2 < :b)
+        Args:
+            values: 定位行的排序字段值
+            backward: 是否为向前翻页
+        Returns:
+
+        """
+        binds = [bindparam(None, value, type_=column.type) for column, value in zip(self.columns, values)]
+        # 降序和向前翻页的比较方向都是小于
+        less = [desc is not backward for desc in self.descs]
+        if len(self.columns) == 1:
+            return self.columns[0] < binds[0] if less[0] else self.columns[0] > binds[0]
+        if all(less) or not any(less):
+            return tuple_(*self.columns) < tuple_(*binds) if less[0] else tuple_(*self.columns) > tuple_(*binds)
+
+        clauses = []
+        for index, (column, bind) in enumerate(zip(self.columns, binds)):
+            compare = column < bind if less[index] else column > bind
+            clauses.append(and_(*[self.columns[i] == binds[i] for i in range(index)], compare))
+        return or_(*clauses)
+
+    def encode_cursor(self, row: Any, backward: bool = False, getter: Optional[Callable[[Any, ColumnElement], Any]]
+                      = None) -> str:
+        """
+        按照行数据生成不透明的游标
+        Args:
+            row: 定位的行
+            backward: 是否为向前翻页的游标
+            getter: 从行中获取字段值的函数,默认row[column]
+        Returns:
+            游标字符串
+        """
+        try:
+            values = [getter(row, column) if getter else row[column] for column in self.columns]
+        except (KeyError, AttributeError):
+            raise FuncArgsError("keyset paginate order by columns must be in the select columns!")
+        payload = {"k": self.names, "v": [_encode_value(value) for value in values], "b": int(backward)}
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+    def decode_cursor(self, cursor: str) -> Tuple[List[Any], bool]:
+        """
+        解析游标
+        Args:
+            cursor: encode_cursor生成的游标
+        Returns:
+            (排序字段值, 是否为向前翻页)
+        """
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [_decode_value(value) for value in payload["v"]]
+            backward, names = bool(payload["b"]), payload["k"]
+        except (binascii.Error, ValueError, TypeError, KeyError, IndexError, AttributeError, ArithmeticError):
+            raise FuncArgsError("keyset paginate cursor error!")
+        if names != self.names or len(values) != len(self.names):
+            raise FuncArgsError("keyset paginate cursor does not match the order by columns!")
+        return values, backward
+
+    def split_page(self, rows: List[Any], per_page: int, backward: bool, has_cursor: bool,
+                   getter: Optional[Callable[[Any, ColumnElement], Any]] = None
+                   ) -> Tuple[List[Any], Optional[str], Optional[str]]:
+        """
+        处理查询的结果,查询时多取一行用来判断翻页方向上是否还有数据
+        Args:
+            rows: 按照LIMIT per_page + 1查询的结果
+            per_page: 每页的条数
+            backward: 是否为向前翻页
+            has_cursor: 是否通过游标查询,第一页没有游标
+            getter: 从行中获取字段值的函数,默认row[column]
+        Returns:
+            (当前页的数据, 上一页的游标, 下一页的游标)
+        """
+        has_more = len(rows) > per_page
+        items = rows[:per_page]
+        if backward:
+            items.reverse()
+            has_prev, has_next = has_more, has_cursor
+        else:
+            has_prev, has_next = has_cursor, has_more
+        if not items:
+            return items, None, None
+        prev_cursor = self.encode_cursor(items[0], True, getter) if has_prev else None
+        next_cursor = self.encode_cursor(items[-1], False, getter) if has_next else None
+        return items, prev_cursor, next_cursor
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午11:50
+
+LOAD DATA LOCAL INFILE 批量导入
+
+数据行在后台线程中编码后写入命名管道(FIFO),驱动把管道当作本地文件读取并发送给服务端,不再写入临时文件,
+内存中只有一个编码块.已经存在的文件直接导入.
+客户端或者服务端不允许LOCAL INFILE时,改为在同一个事务中分块执行多行的 INSERT IGNORE ... VALUES,
+和LOCAL导入时一样忽略重复键的行.
+"""
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from itertools import chain
+from operator import itemgetter
+from typing import Any, Callable, IO, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+from pymysql.constants import CLIENT
+from pymysql.converters import escape_string
+
+from ._bulk import DEFAULT_BULK_CHUNK_SIZE, MAX_BIND_PARAMS, _chunk_rows, _quote_name
+from .err import FuncArgsError
+
+__all__ = ("LOCAL_INFILE_REJECTED_CODES", "is_local_infile_rejected", "LoadDataFormat", "RowPipe", "BulkLoader")
+
+#: 不允许LOCAL INFILE时的错误码,1148为服务端不支持,3948为服务端关闭了local_infile,2068为客户端拒绝
+LOCAL_INFILE_REJECTED_CODES: frozenset = frozenset((1148, 3948, 2068))
+#: 每个编码块的字符数
+_CHUNK_CHARS: int = 64 * 1024
+#: 转义字符后的字符的含义
+_UNESCAPES = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+
+
+def is_local_infile_rejected(error: Exception) -> bool:
+    """
+    是否为不允许LOCAL INFILE的错误
+    Args:
+        error: 驱动抛出的异常
+    Returns:
+
+    """
+    return bool(error.args) and error.args[0] in LOCAL_INFILE_REJECTED_CODES
+
+
+class LoadDataFormat(object):
+    """
+    LOAD DATA的文件格式,编码和解析都使用相同的格式
+    """
+
+    __slots__ = ("fields_terminated", "lines_terminated", "escaped_by", "_escapes", "_special_re")
+
+    def __init__(self, fields_terminated: str = "\t", lines_terminated: str = "\n", escaped_by: str = "\\"):
+        """
+            LOAD DATA的文件格式
+        Args:
+            fields_terminated: 字段分隔符
+            lines_terminated: 行分隔符
+            escaped_by: 转义字符,只能是一个字符
+        """
+        if not fields_terminated or not lines_terminated or fields_terminated == lines_terminated:
+            raise FuncArgsError("fields_terminated and lines_terminated must be different non-empty strings!")
+        if len(escaped_by) != 1 or escaped_by in (fields_terminated[0], lines_terminated[0]):
+            raise FuncArgsError("escaped_by must be a single character different from the terminators!")
+        self.fields_terminated: str = fields_terminated
+        self.lines_terminated: str = lines_terminated
+        self.escaped_by: str = escaped_by
+        # 和 SELECT ... INTO OUTFILE 一样转义 转义字符、分隔符的第一个字符和\0
+        self._escapes = str.maketrans({escaped_by: escaped_by * 2, "\0": escaped_by + "0",
+                                       fields_terminated[0]: escaped_by + fields_terminated[0],
+                                       lines_terminated[0]: escaped_by + lines_terminated[0]})
+        specials = sorted({fields_terminated, lines_terminated}, key=len, reverse=True)
+        self._special_re = re.compile("|".join(map(re.escape, [escaped_by, *specials])))
+
+    def sql(self, ) -> str:
+        """
+        LOAD DATA语句中的格式子句
+        """
+        return (f"FIELDS TERMINATED BY '{escape_string(self.fields_terminated)}' "
+                f"ESCAPED BY '{escape_string(self.escaped_by)}' "
+                f"LINES TERMINATED BY '{escape_string(self.lines_terminated)}'")
+
+    def _encode_value(self, value: Any) -> str:
+        """
+        编码单个字段值,None为NULL
+        """
+        if value is None:
+            return self.escaped_by + "N"
+        if isinstance(value, bool):
+            return "1" if value else "0"
+        if isinstance(value, (bytes, bytearray)):
+            # 二进制数据编码时原样还原
+            value = bytes(value).decode("utf-8", "surrogateescape")
+        return str(value).translate(self._escapes)
+
+    def encode_rows(self, rows: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+        """
+        把数据行编码为utf-8的分块
+        Args:
+            rows: 字段值的序列
+        Returns:
+            编码后的分块
+        """
+        fields_terminated, lines_terminated, encode_value = self.fields_terminated, self.lines_terminated, \
+            self._encode_value
+        lines: List[str] = []
+        size = 0
+        for row in rows:
+            line = fields_terminated.join(map(encode_value, row)) + lines_terminated
+            lines.append(line)
+            size += len(line)
+            if size >= _CHUNK_CHARS:
+                yield "".join(lines).encode("utf-8", "surrogateescape")
+                lines, size = [], 0
+        if lines:
+            yield "".join(lines).encode("utf-8", "surrogateescape")
+
+    def parse(self, file: IO[str]) -> Iterator[List[Optional[str]]]:
+        """
+        按照格式解析文件中的数据行,字段值为\\N时为None
+        Args:
+            file: 文本文件对象
+        Returns:
+            字段值的列表
+        """
+        escaped_by, fields_terminated = self.escaped_by, self.fields_terminated
+        keep = max(len(self.fields_terminated), len(self.lines_terminated), 2)
+        row: List[Optional[str]] = []
+        field: List[str] = []
+        null = False
+        buffer, pos, eof = "", 0, False
+
+        def field_value() -> Optional[str]:
+            value = "".join(field)
+            if null:
+                return "N" + value if value else None
+            return value
+
+        while True:
+            matched = self._special_re.search(buffer, pos)
+            # 分隔符或者转义可能被分块截断,离末尾太近时先读取下一块
+            if not eof and (matched is None or matched.start() + keep > len(buffer)):
+                data = file.read(_CHUNK_CHARS)
+                eof = not data
+                buffer, pos = buffer[pos:] + data, 0
+                continue
+            if matched is None:
+                field.append(buffer[pos:])
+                break
+            start, token = matched.start(), matched.group()
+            field.append(buffer[pos:start])
+            if token == escaped_by:
+                if start + 1 >= len(buffer):
+                    field.append(escaped_by)
+                    pos = start + 1
+                    continue
+                next_char = buffer[start + 1]
+                if next_char == "N" and not null and not any(field):
+                    null = True
+                elif null and not any(field):
+                    field.append("N" + _UNESCAPES.get(next_char, next_char))
+                    null = False
+                else:
+                    field.append(_UNESCAPES.get(next_char, next_char))
+                pos = start + 2
+            elif token == fields_terminated:
+                row.append(field_value())
+                field, null, pos = [], False, start + len(token)
+            else:
+                row.append(field_value())
+                yield row
+                row, field, null, pos = [], [], False, start + len(token)
+        if row or any(field) or null:
+            row.append(field_value())
+            yield row
+
+
+class RowPipe(object):
+    """
+    把编码后的数据写入命名管道
+
+    写入线程打开管道时会阻塞到驱动打开管道读取,驱动没有读取就关闭时数据行不会被消费,可以改为INSERT导入.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        """
+            把编码后的数据写入命名管道
+        Args:
+            chunks: 编码后的分块
+        """
+        self._chunks: Iterator[bytes] = chunks
+        self._dir: str = tempfile.mkdtemp(prefix="fessql_")
+        self.path: str = os.path.join(self._dir, "rows.fifo")
+        os.mkfifo(self.path, 0o600)
+        self.error: Optional[BaseException] = None
+        self._cancelled: bool = False
+        self._thread: threading.Thread = threading.Thread(target=self._write, name="fessql-load-data", daemon=True)
+        self._thread.start()
+
+    def _write(self, ) -> None:
+        """
+        写入线程
+        """
+        try:
+            with open(self.path, "wb") as pipe:
+                if self._cancelled:
+                    return
+                for chunk in self._chunks:
+                    pipe.write(chunk)
+        except Exception as e:
+            self.error = e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        # 数据行迭代或者编码失败时服务端只收到了部分数据,需要回滚
+        if exc_type is None and self.error is not None:
+            raise self.error
+
+    def close(self, ) -> None:
+        """
+        结束写入线程并删除管道
+        """
+        if self._thread.is_alive():
+            self._cancelled = True
+            # 驱动没有打开管道时打开读端,使写入线程从open返回
+            try:
+                fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                pass
+            else:
+                self._thread.join(0.1)
+                os.close(fd)
+            self._thread.join()
+        try:
+            os.unlink(self.path)
+            os.rmdir(self._dir)
+        except OSError:
+            pass
+
+
+def _row_values(keys: Sequence[Any]) -> Callable[[Any], Sequence[Any]]:
+    """
+    按照keys获取行中字段值的函数
+    """
+    getter = itemgetter(*keys)
+    single = len(keys) == 1
+
+    def row_values(row: Any) -> Sequence[Any]:
+        try:
+            values = getter(row)
+        except (KeyError, IndexError, TypeError):
+            raise FuncArgsError("load data rows must have the same columns!")
+        return (values,) if single else values
+
+    return row_values
+
+
+class BulkLoader(object):
+    """
+    批量导入的数据源,生成LOAD DATA语句和降级时的INSERT语句
+    """
+
+    def __init__(self, table_name: str, source: Union[str, os.PathLike, Iterable[Any]],
+                 columns: Union[Sequence[str], Mapping[Any, str], None] = None,
+                 data_format: Optional[LoadDataFormat] = None, chunk_size: int = DEFAULT_BULK_CHUNK_SIZE):
+        """
+            批量导入的数据源
+        Args:
+            table_name: 表名,可以为 库名.表名
+            source: 已经存在的文件路径,或者数据行的可迭代对象,行为字典或者字段值的序列
+            columns: 导入的字段,字段名列表时和数据行的字段名或者位置对应;字典时为{行中的字段名或者下标: 表的字段名},
+                文件导入时使用字典的值;为None时字典行使用第一行的字段名,序列行和文件按位置导入表的所有字段
+            data_format: 文件格式
+            chunk_size: 降级为INSERT时每个分块的最大行数
+        """
+        if chunk_size < 1:
+            raise FuncArgsError("chunk_size value error!")
+        self.table_name: str = table_name
+        self.data_format: LoadDataFormat = data_format or LoadDataFormat()
+        self.chunk_size: int = chunk_size
+        self.path: Optional[str] = None
+        self.rows: Iterator[Sequence[Any]] = iter(())
+        self.columns: Optional[List[str]] = None
+        #: 没有需要导入的数据行
+        self.empty: bool = False
+
+        if isinstance(source, (str, os.PathLike)):
+            self.path = os.fspath(source)
+            if not os.path.isfile(self.path):
+                raise FuncArgsError(f"load data file {self.path} does not exist!")
+            if columns is not None:
+                self.columns = list(columns.values() if isinstance(columns, Mapping) else columns)
+        else:
+            rows = iter(source)
+            first_row = next(rows, None)
+            if first_row is None:
+                self.empty = True
+                return
+            rows = chain([first_row], rows)
+            if columns is None and isinstance(first_row, Mapping):
+                columns = list(first_row.keys())
+            if columns is None:
+                self.rows = rows
+            elif isinstance(columns, Mapping):
+                self.columns = list(columns.values())
+                self.rows = map(_row_values(list(columns.keys())), rows)
+            else:
+                self.columns = list(columns)
+                self.rows = map(_row_values(self.columns), rows) if isinstance(first_row, Mapping) else rows
+        if self.columns is not None and not self.columns:
+            raise FuncArgsError("load data columns can not be empty!")
+
+    def can_load_local(self, raw_conn: Any) -> bool:
+        """
+        是否可以使用LOAD DATA LOCAL INFILE,连接需要开启local_infile,导入数据行时系统需要支持命名管道
+        Args:
+            raw_conn: pymysql或者aiomysql的连接
+        Returns:
+
+        """
+        return bool(getattr(raw_conn, "client_flag", 0) & CLIENT.LOCAL_FILES) and (
+            self.path is not None or hasattr(os, "mkfifo"))
+
+    @contextmanager
+    def local_file(self, ) -> Iterator[str]:
+        """
+        LOAD DATA读取的文件路径,导入数据行时为写入数据的命名管道
+        """
+        if self.path is not None:
+            yield self.path
+        else:
+            with RowPipe(self.data_format.encode_rows(self.rows)) as pipe:
+                yield pipe.path
+
+    def load_sql(self, path: str) -> str:
+        """
+        LOAD DATA LOCAL INFILE 语句
+        Args:
+            path: 文件路径
+        Returns:
+
+        """
+        sql = (f"LOAD DATA LOCAL INFILE '{escape_string(path)}' INTO TABLE {_quote_name(self.table_name)} "
+               f"CHARACTER SET utf8mb4 {self.data_format.sql()}")
+        if self.columns:
+            sql = f"{sql} ({', '.join(_quote_name(name) for name in self.columns)})"
+        return sql
+
+    def _fallback_rows(self, ) -> Iterator[Sequence[Any]]:
+        """
+        降级为INSERT时的数据行,文件按照相同的格式解析,需要是utf-8编码
+        """
+        if self.path is None:
+            yield from self.rows
+        else:
+            with open(self.path, "r", encoding="utf-8", newline="") as file:
+                yield from self.data_format.parse(file)
+
+    def insert_sql(self, ) -> Iterator[Tuple[int, str, List[Any]]]:
+        """
+        降级为分块的多行 INSERT IGNORE ... VALUES,使用%s占位符
+        Returns:
+            (分块的行数, SQL, 参数)
+        """
+        rows = self._fallback_rows()
+        first_row = next(rows, None)
+        if first_row is None:
+            return
+        width = len(self.columns) if self.columns else len(first_row)
+        insert_sql = f"INSERT IGNORE INTO {_quote_name(self.table_name)}"
+        if self.columns:
+            insert_sql = f"{insert_sql} ({', '.join(_quote_name(name) for name in self.columns)})"
+        row_sql = f"({', '.join(['%s'] * width)})"
+
+        for chunk in _chunk_rows(chain([first_row], rows), self.chunk_size, MAX_BIND_PARAMS // width):
+            args: List[Any] = []
+            for one_row in chunk:
+                if len(one_row) != width:
+                    raise FuncArgsError("load data rows must have the same columns!")
+                args.extend(one_row)
+            yield len(chunk), f"{insert_sql} VALUES {', '.join([row_sql] * len(chunk))}", args
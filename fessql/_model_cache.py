@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/17 下午2:10
+
+gen_model生成的分表model的缓存
+
+key为生成model的所有参数,不同的字段、字段映射生成不同的model.后缀来自日期或者租户ID时分表model会不断增加,
+缓存按照LRU淘汰,淘汰的model同时从Model.metadata和declarative的类注册表中删除,不再被引用后即可回收.
+"""
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Callable, Dict, Hashable, Iterable, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy.ext.declarative import DeclarativeMeta
+
+from .err import FuncArgsError
+
+__all__ = ("DEFAULT_MODEL_CACHE_SIZE", "ShardModelCache", "drop_model")
+
+#: 分表model缓存的默认最大个数
+DEFAULT_MODEL_CACHE_SIZE: int = 4096
+
+
+def drop_model(model: DeclarativeMeta) -> None:
+    """
+    从Model.metadata和declarative的类注册表中删除model,只影响建表等metadata操作,已经生成的查询不受影响
+    Args:
+        model: gen_model生成的model类
+    Returns:
+
+    """
+    if not isinstance(model, DeclarativeMeta):
+        # ShardModel没有注册到metadata中
+        return
+    table = getattr(model, "__table__", None)
+    if table is not None and table.metadata.tables.get(table.key) is table:
+        table.metadata.remove(table)
+    class_registry = getattr(model, "_decl_class_registry", None)
+    if class_registry is not None and class_registry.get(model.__name__) is model:
+        del class_registry[model.__name__]
+
+
+class ShardModelCache(object):
+    """
+    分表model的LRU缓存
+
+    eg: db.model_cache.resize(10000)
+        db.model_cache.stats()
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MODEL_CACHE_SIZE,
+                 on_evict: Optional[Callable[[DeclarativeMeta], Any]] = drop_model):
+        """
+            分表model的LRU缓存
+        Args:
+            max_size: 缓存的最大个数
+            on_evict: model被淘汰时的回调,默认从metadata中删除
+        """
+        if max_size < 1:
+            raise FuncArgsError("model cache max_size value error!")
+        self.max_size: int = max_size
+        self.on_evict: Optional[Callable[[DeclarativeMeta], Any]] = on_evict
+        self._cache: 'OrderedDict[Hashable, DeclarativeMeta]' = OrderedDict()
+        self._lock = RLock()
+        self.hit_count: int = 0
+        self.miss_count: int = 0
+        self.evict_count: int = 0
+
+    @staticmethod
+    def gen_key(model_cls: DeclarativeMeta, class_suffix: str, table_suffix: str, table_name: Optional[str],
+                field_mapping: Optional[Mapping[str, str]], fields: Optional[Sequence[str]]
+                ) -> Tuple[Hashable, ...]:
+        """
+        生成model的所有参数组成的key
+        Args:
+            model_cls: 原model类
+            class_suffix: 类名后缀
+            table_suffix: 表名后缀
+            table_name: 表名
+            field_mapping: 字段映射
+            fields: 字段
+        Returns:
+
+        """
+        return (model_cls, class_suffix, table_suffix, table_name,
+                tuple(sorted(field_mapping.items())) if field_mapping else (),
+                tuple(fields) if fields else ())
+
+    def get(self, key: Hashable, create: Optional[Callable[[], DeclarativeMeta]] = None
+            ) -> Optional[DeclarativeMeta]:
+        """
+        获取缓存的model,命中后移动到最近使用,不存在时调用create生成并缓存
+        Args:
+            key: gen_key生成的key
+            create: 生成model的函数,为None时不生成
+        Returns:
+            不存在并且没有create时为None
+        """
+        with self._lock:
+            model = self._cache.get(key)
+            if model is not None:
+                self._cache.move_to_end(key)
+                self.hit_count += 1
+                return model
+            self.miss_count += 1
+            if create is not None:
+                model = create()
+                self.put(key, model)
+            return model
+
+    def put(self, key: Hashable, model: DeclarativeMeta) -> None:
+        """
+        缓存model,超过最大个数时淘汰最久未使用的model
+        Args:
+            key: gen_key生成的key
+            model: 生成的model类
+        Returns:
+
+        """
+        with self._lock:
+            self._cache[key] = model
+            self._cache.move_to_end(key)
+            self._evict(self.max_size)
+
+    def _evict(self, max_size: int) -> None:
+        """
+        淘汰model直到个数不超过max_size
+        """
+        while len(self._cache) > max_size:
+            _, model = self._cache.popitem(last=False)
+            self.evict_count += 1
+            if self.on_evict is not None:
+                self.on_evict(model)
+
+    def resize(self, max_size: int) -> None:
+        """
+        更改缓存的最大个数,超过的部分按照LRU淘汰
+        Args:
+            max_size: 缓存的最大个数
+        Returns:
+
+        """
+        if max_size < 1:
+            raise FuncArgsError("model cache max_size value error!")
+        with self._lock:
+            self.max_size = max_size
+            self._evict(max_size)
+
+    def discard(self, model_cls: DeclarativeMeta) -> None:
+        """
+        删除原model生成的所有分表model
+        Args:
+            model_cls: 原model类
+        Returns:
+
+        """
+        with self._lock:
+            for key in [key for key in self._cache if key[0] is model_cls]:
+                model = self._cache.pop(key)
+                if self.on_evict is not None:
+                    self.on_evict(model)
+
+    def clear(self, ) -> None:
+        """
+        清空缓存和统计,缓存的model都会被淘汰
+        Args:
+
+        Returns:
+
+        """
+        with self._lock:
+            self._evict(0)
+            self.hit_count = self.miss_count = self.evict_count = 0
+
+    def models(self, ) -> Iterable[DeclarativeMeta]:
+        """
+        缓存的model,从最久未使用开始
+        """
+        with self._lock:
+            return list(self._cache.values())
+
+    def __len__(self, ) -> int:
+        return len(self._cache)
+
+    def stats(self, ) -> Dict[str, int]:
+        """
+        缓存的统计信息
+        Returns:
+            {"hit_count": 命中次数, "miss_count": 生成model的次数, "evict_count": 淘汰次数,
+             "size": 当前缓存个数, "max_size": 最大缓存个数}
+        """
+        return {"hit_count": self.hit_count, "miss_count": self.miss_count, "evict_count": self.evict_count,
+                "size": len(self._cache), "max_size": self.max_size}
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午3:10
+
+model的字段元数据注册表
+
+insert、update时的默认值以及gen_model生成分表model都需要扫描model类中的字段,
+这里每个model类只扫描一次,之后都从注册表中读取.
+"""
+import weakref
+from threading import RLock
+from typing import Any, Callable, Dict, List, Tuple
+
+from sqlalchemy import Column, UniqueConstraint
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.orm import ColumnProperty
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+__all__ = ("ModelMeta", "ModelRegistry", "model_registry")
+
+
+class ModelMeta(object):
+    """
+    单个model类的字段元数据
+    """
+
+    __slots__ = ("columns", "default_items", "onupdate_items", "primary_keys", "indexed_columns")
+
+    def __init__(self, model: DeclarativeMeta):
+        """
+            单个model类的字段元数据
+        Args:
+            model: model类
+        """
+        #: {属性名: Column},按照类中定义的顺序,只包含类中直接定义的字段
+        self.columns: Dict[str, Column] = {}
+        #: insert默认值 [(属性名, 默认值或者默认值函数, 是否为函数)]
+        self.default_items: Tuple[Tuple[str, Any, bool], ...]
+        #: update默认值 [(属性名, 默认值函数)]
+        self.onupdate_items: Tuple[Tuple[str, Callable[[], Any]], ...]
+        #: 主键的属性名
+        self.primary_keys: Tuple[str, ...]
+        #: 有索引的属性名,包括主键、唯一键和普通索引
+        self.indexed_columns: Tuple[str, ...]
+
+        for attr_name, field in model.__dict__.items():
+            if (not attr_name.startswith("_") and isinstance(field, InstrumentedAttribute) and
+                    isinstance(field.property, ColumnProperty)):
+                self.columns[attr_name] = field.property.columns[0]
+
+        default_items: List[Tuple[str, Any, bool]] = []
+        onupdate_items: List[Tuple[str, Callable[[], Any]]] = []
+        for attr_name, column in self.columns.items():
+            if column.default:
+                if column.default.is_callable:
+                    default_items.append((attr_name, column.default.arg.__wrapped__, True))
+                else:
+                    default_items.append((attr_name, column.default.arg, False))
+            if column.onupdate and column.onupdate.is_callable:
+                onupdate_items.append((attr_name, column.onupdate.arg.__wrapped__))
+        self.default_items = tuple(default_items)
+        self.onupdate_items = tuple(onupdate_items)
+
+        # 联合索引和唯一约束中的字段也算作有索引的字段
+        table = getattr(model, "__table__", None)
+        index_columns = set()
+        if table is not None:
+            for index in table.indexes:
+                index_columns.update(index.columns)
+            for constraint in table.constraints:
+                if isinstance(constraint, UniqueConstraint):
+                    index_columns.update(constraint.columns)
+        self.primary_keys = tuple(attr_name for attr_name, column in self.columns.items() if column.primary_key)
+        self.indexed_columns = tuple(
+            attr_name for attr_name, column in self.columns.items()
+            if column.primary_key or column.index or column.unique or column in index_columns)
+
+    def with_columns(self, columns: Dict[str, Column]) -> 'ModelMeta':
+        """
+        字段替换为分表上的字段,其他元数据共用
+        Args:
+            columns: {属性名: 分表上的字段}
+        Returns:
+            新的ModelMeta
+        """
+        model_meta = ModelMeta.__new__(ModelMeta)
+        for name in self.__slots__:
+            setattr(model_meta, name, getattr(self, name))
+        model_meta.columns = columns
+        return model_meta
+
+    def gen_default_value(self, ) -> Dict[str, Any]:
+        """
+        生成一行的insert默认值
+        Args:
+
+        Returns:
+
+        """
+        return {key: arg() if is_callable else arg for key, arg, is_callable in self.default_items}
+
+    def gen_onupdate_value(self, ) -> Dict[str, Any]:
+        """
+        生成一行的update默认值
+        Args:
+
+        Returns:
+
+        """
+        return {key: arg() for key, arg in self.onupdate_items}
+
+
+class ModelRegistry(object):
+    """
+    model的字段元数据注册表
+
+    model类作为弱引用的key,gen_model生成的model类被回收后注册表中的元数据也会随之删除.
+    ShardModel的元数据由原model的元数据替换字段后得到.
+    """
+
+    def __init__(self, ):
+        """
+            model的字段元数据注册表
+        Args:
+
+        """
+        self._registry: 'weakref.WeakKeyDictionary[DeclarativeMeta, ModelMeta]' = weakref.WeakKeyDictionary()
+        self._lock = RLock()
+        self.hit_count: int = 0
+        self.miss_count: int = 0
+
+    def get(self, model: DeclarativeMeta) -> ModelMeta:
+        """
+        获取model的字段元数据,不存在时扫描一次model并注册
+        Args:
+            model: model类或者ShardModel
+        Returns:
+            ModelMeta
+        """
+        try:
+            model_meta = self._registry[model]
+        except KeyError:
+            with self._lock:
+                model_meta = self._registry.get(model)
+                if model_meta is None:
+                    if isinstance(model, DeclarativeMeta):
+                        model_meta = ModelMeta(model)
+                    else:
+                        # ShardModel和原model共用元数据,只有字段为分表上的字段
+                        model_meta = self.get(model.base_model).with_columns(model.shard_columns())
+                    self._registry[model] = model_meta
+                    self.miss_count += 1
+                    return model_meta
+        self.hit_count += 1
+        return model_meta
+
+    def discard(self, model: DeclarativeMeta) -> None:
+        """
+        删除model的字段元数据,model字段变化后需要重新扫描时使用
+        Args:
+            model: model类
+        Returns:
+
+        """
+        with self._lock:
+            self._registry.pop(model, None)
+
+    def clear(self, ) -> None:
+        """
+        清空注册表和统计
+        Args:
+
+        Returns:
+
+        """
+        with self._lock:
+            self._registry.clear()
+            self.hit_count = self.miss_count = 0
+
+    def stats(self, ) -> Dict[str, int]:
+        """
+        注册表的统计信息
+        Args:
+
+        Returns:
+            {"hit_count": 命中次数, "miss_count": 扫描model的次数, "size": 注册的model数}
+        """
+        return {"hit_count": self.hit_count, "miss_count": self.miss_count, "size": len(self._registry)}
+
+
+#: model的字段元数据注册表,所有的Query和gen_model共用
+model_registry: ModelRegistry = ModelRegistry()
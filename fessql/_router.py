@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/17 上午10:30
+
+按照分片键路由到分表和bind
+
+分片键的值计算出分片的下标,下标对应表名后缀和bind,分表model由gen_model生成后缓存在路由中.
+取模时分片数不能变化;一致性哈希时每个分片在哈希环上有多个虚拟节点,增加分片后只有少量的键会迁移.
+字符串等非整数的值使用crc32或者md5计算哈希,不使用python的hash,多个进程中的路由结果相同.
+
+按时间分表时,从查询条件中分区字段的范围得到重叠的分区,只查询这些分区;
+已经存在的分表列表缓存一段时间,不存在的分区直接跳过.
+"""
+import bisect
+import hashlib
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from threading import RLock
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.sql import ClauseElement, operators, text
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList, ClauseList, TextClause
+
+from .err import FuncArgsError
+
+__all__ = ("SHARD_MODULO", "SHARD_CONSISTENT", "verify_shard_strategy", "ShardTarget", "ShardRouter", "PARTITION_DAY",
+           "PARTITION_MONTH", "PARTITION_YEAR", "verify_partition_granularity", "TimePartitionRouter")
+
+#: 取模路由
+SHARD_MODULO: str = "modulo"
+#: 一致性哈希路由
+SHARD_CONSISTENT: str = "consistent"
+
+
+def verify_shard_strategy(strategy: str) -> None:
+    """
+    校验路由方式
+    Args:
+        strategy: 路由方式
+    Returns:
+
+    """
+    if strategy not in (SHARD_MODULO, SHARD_CONSISTENT):
+        raise FuncArgsError(f"shard strategy must be one of {SHARD_MODULO}, {SHARD_CONSISTENT}.")
+
+
+def _key_bytes(value: Any) -> bytes:
+    """
+    分片键的值转换为bytes
+    """
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+def _md5_int(data: bytes) -> int:
+    """
+    md5的前8个字节作为哈希值
+    """
+    return int.from_bytes(hashlib.md5(data).digest()[:8], "big")
+
+
+class ShardTarget(NamedTuple):
+    """
+    分片
+    """
+    #: 分片的下标
+    index: int
+    #: 表名后缀
+    table_suffix: str
+    #: bind,None为默认的bind
+    bind: Optional[str]
+    #: 分表model
+    model: DeclarativeMeta
+
+
+class ShardRouter(object):
+    """
+    按照分片键路由到分表和bind
+
+    eg: router = ShardRouter(db, Order, "uid", 64, binds=lambda index: f"order_db{index // 16}")
+        target = router.route(uid)
+        session = db.gen_session(target.bind)  # DBAlchemy
+        session = await router.session(target)  # SanicMySQL
+        for target, uids in router.group(uids).items():
+            query = db.query.model(target.model).where(router.key_in(target, uids))
+    """
+
+    def __init__(self, db: Any, model_cls: DeclarativeMeta, shard_key: str, shard_count: int, *,
+                 strategy: str = SHARD_MODULO,
+                 table_suffix: Union[str, Sequence[str], Callable[[int], str]] = "{:02d}",
+                 binds: Union[None, str, Sequence[Optional[str]], Callable[[int], Optional[str]]] = None,
+                 virtual_nodes: int = 160):
+        """
+            按照分片键路由到分表和bind
+        Args:
+            db: SanicMySQL或者DBAlchemy实例
+            model_cls: 原model类
+            shard_key: 分片键的属性名
+            shard_count: 分片数
+            strategy: 路由方式,modulo取模;consistent一致性哈希
+            table_suffix: 表名后缀,格式化字符串时用下标格式化;序列时为每个分片的后缀;函数时参数为下标
+            binds: 每个分片的bind,None为默认的bind;字符串时所有分片在同一个bind;序列时为每个分片的bind;
+                函数时参数为下标
+            virtual_nodes: 一致性哈希时每个分片的虚拟节点数
+        """
+        verify_shard_strategy(strategy)
+        if shard_count < 1 or virtual_nodes < 1:
+            raise FuncArgsError("shard_count or virtual_nodes value error!")
+        if not hasattr(model_cls, shard_key):
+            raise FuncArgsError(f"shard key {shard_key} is not a column of {model_cls.__name__}!")
+        for mapping in (table_suffix, binds):
+            if isinstance(mapping, Sequence) and not isinstance(mapping, str) and len(mapping) != shard_count:
+                raise FuncArgsError("table_suffix or binds length must be equal to shard_count!")
+        self.db: Any = db
+        self.model_cls: DeclarativeMeta = model_cls
+        self.shard_key: str = shard_key
+        self.shard_count: int = shard_count
+        self.strategy: str = strategy
+        self.table_suffix: Union[str, Sequence[str], Callable[[int], str]] = table_suffix
+        self.binds: Union[None, str, Sequence[Optional[str]], Callable[[int], Optional[str]]] = binds
+        self._targets: Dict[int, ShardTarget] = {}
+        self._lock = RLock()
+        self._ring: List[int] = []
+        self._ring_nodes: List[int] = []
+        if strategy == SHARD_CONSISTENT:
+            ring = sorted((_md5_int(f"{index}-{node}".encode()), index)
+                          for index in range(shard_count) for node in range(virtual_nodes))
+            self._ring = [point for point, _ in ring]
+            self._ring_nodes = [index for _, index in ring]
+
+    def shard_index(self, value: Any) -> int:
+        """
+        分片键的值对应的分片下标
+        Args:
+            value: 分片键的值
+        Returns:
+
+        """
+        if value is None:
+            raise FuncArgsError(f"shard key {self.shard_key} value can not be None!")
+        if self.strategy == SHARD_MODULO:
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value % self.shard_count
+            return zlib.crc32(_key_bytes(value)) % self.shard_count
+        position = bisect.bisect(self._ring, _md5_int(_key_bytes(value)))
+        return self._ring_nodes[position % len(self._ring)]
+
+    def _gen_suffix(self, index: int) -> str:
+        """
+        分片的表名后缀
+        """
+        if isinstance(self.table_suffix, str):
+            return self.table_suffix.format(index)
+        if callable(self.table_suffix):
+            return self.table_suffix(index)
+        return self.table_suffix[index]
+
+    def _gen_bind(self, index: int) -> Optional[str]:
+        """
+        分片的bind
+        """
+        if self.binds is None or isinstance(self.binds, str):
+            return self.binds
+        if callable(self.binds):
+            return self.binds(index)
+        return self.binds[index]
+
+    def target(self, index: int) -> ShardTarget:
+        """
+        分片下标对应的分片,分表model生成后缓存
+        Args:
+            index: 分片的下标
+        Returns:
+
+        """
+        target = self._targets.get(index)
+        if target is None:
+            if not 0 <= index < self.shard_count:
+                raise FuncArgsError("shard index value error!")
+            with self._lock:
+                target = self._targets.get(index)
+                if target is None:
+                    suffix = self._gen_suffix(index)
+                    model = self.db.gen_model(self.model_cls, class_suffix=suffix, table_suffix=suffix)
+                    target = ShardTarget(index, suffix, self._gen_bind(index), model)
+                    self._targets[index] = target
+        return target
+
+    def targets(self, ) -> List[ShardTarget]:
+        """
+        所有的分片,按照下标排序
+        """
+        return [self.target(index) for index in range(self.shard_count)]
+
+    def route(self, value: Any) -> ShardTarget:
+        """
+        分片键的值对应的分片
+        Args:
+            value: 分片键的值
+        Returns:
+
+        """
+        return self.target(self.shard_index(value))
+
+    def route_row(self, row: Any) -> ShardTarget:
+        """
+        一行数据对应的分片
+        Args:
+            row: 字典或者有分片键属性的对象
+        Returns:
+
+        """
+        return self.route(row[self.shard_key] if isinstance(row, dict) else getattr(row, self.shard_key))
+
+    def group(self, values: Iterable[Any]) -> Dict[ShardTarget, List[Any]]:
+        """
+        按照分片分组,多个键的查询可以在每个分片上只执行一次
+        Args:
+            values: 分片键的值
+        Returns:
+            {分片: 分片键的值},按照分片下标排序,每组中的值保持原顺序并且去重
+        """
+        groups: Dict[int, Dict[Any, None]] = {}
+        for value in values:
+            groups.setdefault(self.shard_index(value), {})[value] = None
+        return {self.target(index): list(groups[index]) for index in sorted(groups)}
+
+    def group_rows(self, rows: Iterable[Any]) -> Dict[ShardTarget, List[Any]]:
+        """
+        数据行按照分片分组,多行的插入可以在每个分片上只执行一次
+        Args:
+            rows: 字典或者有分片键属性的对象
+        Returns:
+            {分片: 数据行},按照分片下标排序
+        """
+        groups: Dict[int, List[Any]] = {}
+        for row in rows:
+            groups.setdefault(self.route_row(row).index, []).append(row)
+        return {self.target(index): groups[index] for index in sorted(groups)}
+
+    def key_in(self, target: ShardTarget, values: Sequence[Any]) -> ClauseElement:
+        """
+        分表上分片键的IN条件
+        Args:
+            target: 分片
+            values: 分片键的值
+        Returns:
+
+        """
+        return getattr(target.model, self.shard_key).in_(values)
+
+    def session(self, target: ShardTarget) -> Any:
+        """
+        分片所在bind的session
+        Args:
+            target: 分片
+        Returns:
+            DBAlchemy时为FesMgrSession;SanicMySQL时需要await后得到Session
+        """
+        # noinspection PyProtectedMember
+        return self.db._shard_session(target.bind)
+
+
+#: 按天分区
+PARTITION_DAY: str = "day"
+#: 按月分区
+PARTITION_MONTH: str = "month"
+#: 按年分区
+PARTITION_YEAR: str = "year"
+
+
+def verify_partition_granularity(granularity: str) -> None:
+    """
+    校验分区粒度
+    Args:
+        granularity: 分区粒度
+    Returns:
+
+    """
+    if granularity not in (PARTITION_DAY, PARTITION_MONTH, PARTITION_YEAR):
+        raise FuncArgsError(f"partition granularity must be one of {PARTITION_DAY}, {PARTITION_MONTH}, "
+                            f"{PARTITION_YEAR}.")
+
+
+def _as_date(value: Any) -> date:
+    """
+    分区字段的值转换为日期
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    raise FuncArgsError(f"partition value type {type(value).__name__} must be date or datetime!")
+
+
+def _as_datetime(value: Any) -> Any:
+    """
+    日期转换为当天开始的时间,date和datetime不能直接比较,比较分区字段的范围前统一为datetime
+    """
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.combine(value, datetime.min.time())
+    return value
+
+
+class TimePartitionRouter(object):
+    """
+    按时间分表的路由
+
+    eg: router = TimePartitionRouter(db, Log, "created_time", PARTITION_MONTH, "%Y%m")
+        query = db.query.model(Log).where(Log.created_time >= start, Log.created_time < end)
+        rows = await db.scatter_partitions(router, query)  # 只查询log_202601、log_202602等重叠并且存在的分表
+    """
+
+    def __init__(self, db: Any, model_cls: DeclarativeMeta, partition_key: str,
+                 granularity: str = PARTITION_MONTH, suffix_format: str = "%Y%m", *, bind: Optional[str] = None,
+                 table_ttl: float = 300):
+        """
+            按时间分表的路由
+        Args:
+            db: SanicMySQL或者DBAlchemy实例
+            model_cls: 原model类
+            partition_key: 分区字段的属性名,字段类型为日期或者时间
+            granularity: 分区粒度,day、month或者year
+            suffix_format: 表名后缀的strftime格式
+            bind: 分表所在的bind,None为默认的bind
+            table_ttl: 已经存在的分表列表的缓存秒数,为0时不检查分表是否存在
+        """
+        verify_partition_granularity(granularity)
+        if not hasattr(model_cls, partition_key):
+            raise FuncArgsError(f"partition key {partition_key} is not a column of {model_cls.__name__}!")
+        if table_ttl < 0:
+            raise FuncArgsError("table_ttl value error!")
+        self.db: Any = db
+        self.model_cls: DeclarativeMeta = model_cls
+        self.partition_key: str = partition_key
+        self.granularity: str = granularity
+        self.suffix_format: str = suffix_format
+        self.bind: Optional[str] = bind
+        self.table_ttl: float = table_ttl
+        self.table_name: str = model_cls.__tablename__
+        self._tables: Optional[FrozenSet[str]] = None
+        self._tables_time: float = 0
+
+    def period_start(self, value: Any) -> date:
+        """
+        值所在分区的开始日期
+        Args:
+            value: 日期或者时间
+        Returns:
+
+        """
+        value = _as_date(value)
+        if self.granularity == PARTITION_DAY:
+            return value
+        if self.granularity == PARTITION_MONTH:
+            return value.replace(day=1)
+        return value.replace(month=1, day=1)
+
+    def _next_period(self, period: date) -> date:
+        """
+        下一个分区的开始日期
+        """
+        if self.granularity == PARTITION_DAY:
+            return period + timedelta(days=1)
+        if self.granularity == PARTITION_MONTH:
+            return period.replace(year=period.year + 1, month=1) if period.month == 12 else period.replace(
+                month=period.month + 1)
+        return period.replace(year=period.year + 1)
+
+    def suffix(self, value: Any) -> str:
+        """
+        值所在分区的表名后缀
+        Args:
+            value: 日期或者时间
+        Returns:
+
+        """
+        return self.period_start(value).strftime(self.suffix_format)
+
+    def model(self, value: Any) -> DeclarativeMeta:
+        """
+        值所在分区的分表model,由gen_model的分表model缓存按照LRU淘汰
+        Args:
+            value: 日期或者时间
+        Returns:
+
+        """
+        suffix = self.suffix(value)
+        return self.db.gen_model(self.model_cls, class_suffix=suffix, table_suffix=suffix)
+
+    def query_range(self, whereclause: Sequence[Any]) -> Tuple[Optional[Tuple[Any, bool]], Optional[Tuple[Any, bool]]]:
+        """
+        从查询条件中获取分区字段的范围,只识别AND连接的 >、>=、<、<=、==、between 条件
+        Args:
+            whereclause: 查询条件
+        Returns:
+            ((下限, 是否包含), (上限, 是否包含)),没有下限或者上限时为None,日期转换为datetime
+        """
+        column = getattr(self.model_cls, self.partition_key).__clause_element__()._deannotate()
+        lower: Optional[Tuple[Any, bool]] = None
+        upper: Optional[Tuple[Any, bool]] = None
+
+        def bind_value(element: Any) -> Any:
+            return _as_datetime(element.effective_value) if isinstance(element, BindParameter) else None
+
+        def add_lower(value: Any, inclusive: bool):
+            nonlocal lower
+            if value is not None and (lower is None or value > lower[0] or (value == lower[0] and not inclusive)):
+                lower = (value, inclusive)
+
+        def add_upper(value: Any, inclusive: bool):
+            nonlocal upper
+            if value is not None and (upper is None or value < upper[0] or (value == upper[0] and not inclusive)):
+                upper = (value, inclusive)
+
+        def visit(clause: Any):
+            clause = clause.__clause_element__() if hasattr(clause, "__clause_element__") else clause
+            if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+                for one_clause in clause.clauses:
+                    visit(one_clause)
+                return
+            if not isinstance(clause, BinaryExpression) or not hasattr(clause.left, "_deannotate") or \
+                    clause.left._deannotate() is not column:
+                return
+            operator = clause.operator
+            if operator is operators.between_op and isinstance(clause.right, ClauseList):
+                low, high = clause.right.clauses
+                add_lower(bind_value(low), True)
+                add_upper(bind_value(high), True)
+            elif operator in (operators.ge, operators.gt):
+                add_lower(bind_value(clause.right), operator is operators.ge)
+            elif operator in (operators.le, operators.lt):
+                add_upper(bind_value(clause.right), operator is operators.le)
+            elif operator is operators.eq:
+                add_lower(bind_value(clause.right), True)
+                add_upper(bind_value(clause.right), True)
+
+        for one_clause in whereclause:
+            visit(one_clause)
+        return lower, upper
+
+    def periods(self, start: Optional[Any] = None, end: Optional[Any] = None, end_inclusive: bool = True
+                ) -> List[date]:
+        """
+        和时间范围重叠的分区开始日期,按照时间顺序
+        Args:
+            start: 开始时间,为None时从已经存在的最早的分表开始
+            end: 结束时间,为None时到已经存在的最晚的分表结束
+            end_inclusive: 是否包含结束时间
+        Returns:
+
+        """
+        if start is None or end is None:
+            existing_periods = self.existing_periods()
+            if existing_periods is None:
+                raise FuncArgsError("partition query needs both start and end when tables are not checked!")
+            if not existing_periods:
+                return []
+            start = existing_periods[0] if start is None else start
+            end = existing_periods[-1] if end is None else end
+        period, last = self.period_start(start), self.period_start(end)
+        # 结束时间为不包含的分区开始时间时,不需要查询这个分区
+        boundary = datetime.combine(last, datetime.min.time()) if isinstance(end, datetime) else last
+        if not end_inclusive and end == boundary and last > period:
+            last = self._prev_period(last)
+        periods: List[date] = []
+        while period <= last:
+            periods.append(period)
+            period = self._next_period(period)
+        return periods
+
+    def _prev_period(self, period: date) -> date:
+        """
+        上一个分区的开始日期
+        """
+        return self.period_start(period - timedelta(days=1))
+
+    def tables_expired(self, ) -> bool:
+        """
+        分表列表是否需要重新获取
+        """
+        return self.table_ttl > 0 and (self._tables is None or time.monotonic() - self._tables_time > self.table_ttl)
+
+    def tables_sql(self, ) -> Tuple[TextClause, Dict[str, Any]]:
+        """
+        查询已经存在的分表的SQL
+        Returns:
+            (SQL, 参数)
+        """
+        prefix = self.table_name.replace("\\", "\\\\").replace("_", "\\_").replace("%", "\\%")
+        return (text("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+                     "AND TABLE_NAME LIKE :prefix"), {"prefix": f"{prefix}\\_%"})
+
+    def update_tables(self, table_names: Iterable[str]) -> None:
+        """
+        更新已经存在的分表列表
+        Args:
+            table_names: 表名
+        Returns:
+
+        """
+        self._tables = frozenset(table_names)
+        self._tables_time = time.monotonic()
+
+    def existing_periods(self, ) -> Optional[List[date]]:
+        """
+        已经存在的分表的分区开始日期,按照时间顺序,不检查分表时为None
+        """
+        if self.table_ttl == 0 or self._tables is None:
+            return None
+        prefix = f"{self.table_name}_"
+        periods = set()
+        for table_name in self._tables:
+            if table_name.startswith(prefix):
+                try:
+                    periods.add(self.period_start(datetime.strptime(table_name[len(prefix):], self.suffix_format)))
+                except ValueError:
+                    continue
+        return sorted(periods)
+
+    def exists(self, suffix: str) -> bool:
+        """
+        分区的分表是否存在,不检查分表时总是存在
+        Args:
+            suffix: 表名后缀
+        Returns:
+
+        """
+        return self.table_ttl == 0 or self._tables is None or f"{self.table_name}_{suffix}" in self._tables
+
+    def targets(self, whereclause: Sequence[Any] = (), start: Optional[Any] = None, end: Optional[Any] = None
+                ) -> List[ShardTarget]:
+        """
+        查询需要访问的分区,按照时间顺序,跳过不存在的分表
+        Args:
+            whereclause: 查询条件,从中获取分区字段的范围
+            start: 开始时间,和查询条件中的范围取交集
+            end: 结束时间(包含),和查询条件中的范围取交集
+        Returns:
+
+        """
+        lower, upper = self.query_range(whereclause)
+        start, end = _as_datetime(start), _as_datetime(end)
+        if start is not None and (lower is None or start > lower[0]):
+            lower = (start, True)
+        if end is not None and (upper is None or end < upper[0]):
+            upper = (end, True)
+        if lower is not None and upper is not None and lower[0] > upper[0]:
+            return []
+        periods = self.periods(lower[0] if lower else None, upper[0] if upper else None, upper[1] if upper else True)
+        targets: List[ShardTarget] = []
+        for index, period in enumerate(periods):
+            suffix = period.strftime(self.suffix_format)
+            if self.exists(suffix):
+                targets.append(ShardTarget(index, suffix, self.bind, self.model(period)))
+        return targets
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午9:50
+
+紧凑的查询结果行
+
+RowProxy每行都引用结果集、处理函数和keymap,大量缓存时占用较多的内存.
+紧凑行是tuple的子类,没有实例属性,每种字段组合生成一个行类,字段名到下标的映射保存在行类上,
+保留按下标、字段名和属性访问.
+"""
+from operator import itemgetter
+from threading import RLock
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+from ._cachelru import LRU
+from .err import FuncArgsError
+
+__all__ = ("ROW_PROXY", "ROW_COMPACT", "verify_row_format", "CompactRow", "compact_row_class", "make_compact_rows",
+           "fetch_compact")
+
+#: 返回RowProxy
+ROW_PROXY: str = "proxy"
+#: 返回紧凑行CompactRow
+ROW_COMPACT: str = "compact"
+
+
+def verify_row_format(row_format: str) -> None:
+    """
+    校验行格式
+    Args:
+        row_format: 行格式
+    Returns:
+
+    """
+    if row_format not in (ROW_PROXY, ROW_COMPACT):
+        raise FuncArgsError(f"row_format must be one of {ROW_PROXY}, {ROW_COMPACT}.")
+
+
+class CompactRow(tuple):
+    """
+    紧凑行
+
+    row[0]、row["name"]、row.name都可以访问字段值,dict(row)转换为字典,迭代时返回字段值.
+    字段名和keys、values、items、get等方法同名或者以_开头时只能通过row["name"]访问.
+    """
+
+    __slots__ = ()
+
+    #: 字段名
+    _keys: Tuple[str, ...] = ()
+    #: {字段名: 下标}
+    _index: Dict[str, int] = {}
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, (int, slice)):
+            return tuple.__getitem__(self, key)
+        try:
+            return tuple.__getitem__(self, self._index[key if isinstance(key, str) else key.name])
+        except (KeyError, AttributeError):
+            raise KeyError(key)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({tuple.__repr__(self)})"
+
+    def keys(self, ) -> Tuple[str, ...]:
+        return self._keys
+
+    def values(self, ) -> Tuple[Any, ...]:
+        return tuple(self)
+
+    def items(self, ) -> Iterator[Tuple[str, Any]]:
+        return zip(self._keys, self)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._index
+
+    def __reduce__(self):
+        return _rebuild_row, (self._keys, tuple(self))
+
+
+def _rebuild_row(keys: Tuple[str, ...], values: Tuple[Any, ...]) -> CompactRow:
+    """
+    pickle还原紧凑行
+    """
+    return compact_row_class(keys)(values)
+
+
+#: 不能作为字段属性的名称
+_RESERVED_NAMES = frozenset(("keys", "values", "items", "get"))
+_row_classes: LRU = LRU(max_size=256)
+_row_classes_lock = RLock()
+
+
+def compact_row_class(keys: Sequence[str]) -> Type[CompactRow]:
+    """
+    获取字段组合对应的行类,相同的字段组合共用一个行类
+    Args:
+        keys: 字段名
+    Returns:
+
+    """
+    keys = tuple(keys)
+    row_class = _row_classes.get(keys)
+    if row_class is None:
+        with _row_classes_lock:
+            row_class = _row_classes.get(keys)
+            if row_class is None:
+                # 字段名重复时和RowProxy一样使用最后一个
+                index = {key: position for position, key in enumerate(keys)}
+                namespace = {"__slots__": (), "_keys": keys, "_index": index}
+                # 字段作为只读属性,覆盖tuple的count、index等同名方法
+                namespace.update({key: property(itemgetter(position)) for key, position in index.items()
+                                  if not key.startswith("_") and key not in _RESERVED_NAMES})
+                row_class = type("CompactRow", (CompactRow,), namespace)
+                _row_classes[keys] = row_class
+    return row_class
+
+
+def make_compact_rows(keys: Sequence[str], processors: Optional[Sequence[Optional[Callable]]],
+                      rows: Sequence[Sequence[Any]]) -> List[CompactRow]:
+    """
+    把驱动返回的原始行转换为紧凑行
+    Args:
+        keys: 字段名
+        processors: 每个字段的结果处理函数,和RowProxy中的一致,为None时不处理
+        rows: 原始的行数据
+    Returns:
+
+    """
+    row_class = compact_row_class(keys)
+    active = [(index, processor) for index, processor in enumerate(processors or ()) if processor is not None]
+    if not active:
+        return list(map(row_class, rows))
+    compact_rows = []
+    for row in rows:
+        values = list(row)
+        for index, processor in active:
+            values[index] = processor(values[index])
+        compact_rows.append(row_class(values))
+    return compact_rows
+
+
+def fetch_compact(result: Any, size: Optional[int] = None) -> List[CompactRow]:
+    """
+    读取sqlalchemy ResultProxy的结果为紧凑行,读取完成后关闭结果
+    Args:
+        result: sqlalchemy ResultProxy
+        size: 最多读取的行数,为None时读取所有
+    Returns:
+
+    """
+    if not result.returns_rows:
+        return []
+    rows = result._fetchall_impl() if size is None else result._fetchmany_impl(size)
+    compact_rows = make_compact_rows(result.keys(), result._metadata._processors, rows)
+    result.close()
+    return compact_rows
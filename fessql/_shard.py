@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/17 上午9:10
+
+分表查询
+
+gen_model生成的分表model和原model的字段相同,只有表名不同.按照原model生成的查询语句,
+把其中原表的表和字段替换为分表的表和字段后,就是分表上的查询语句,不需要为每个分表重新组织查询条件.
+多个分表的结果按照排序字段做k路归并,每个分表最多只需要返回 offset + limit 行.
+聚合查询拆分为每个分表上的部分聚合,AVG拆分为SUM和COUNT,各分表的分组结果在内存中合并.
+"""
+import heapq
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.sql import ClauseElement, func, operators, visitors
+from sqlalchemy.sql.elements import Label, UnaryExpression
+from sqlalchemy.sql.functions import FunctionElement
+
+from ._keyset import KeysetOrder
+from ._model_meta import model_registry
+from ._shard_table import ShardTable
+from .err import FuncArgsError
+
+__all__ = ("shard_statement", "ShardMerger", "ShardAggregator")
+
+
+def _table_mapping(base_model: DeclarativeMeta, shard_model: DeclarativeMeta) -> Dict[int, Any]:
+    """
+    原表和字段到分表的表和字段的映射,key为原对象的id
+    """
+    shard_columns = model_registry.get(shard_model).columns
+    mapping: Dict[int, Any] = {id(base_model.__table__): shard_model.__table__}
+    for attr_name, column in model_registry.get(base_model).columns.items():
+        if attr_name in shard_columns:
+            mapping[id(column)] = shard_columns[attr_name]
+    return mapping
+
+
+def _iterate(statement: ClauseElement) -> Iterable[Any]:
+    """
+    遍历语句中的元素,ShardTable中的原表不需要遍历
+    """
+    stack = [statement]
+    while stack:
+        element = stack.pop()
+        yield element
+        if not isinstance(element, ShardTable):
+            stack.extend(element.get_children())
+
+
+def shard_statement(statement: ClauseElement, base_model: DeclarativeMeta, shard_model: DeclarativeMeta
+                    ) -> ClauseElement:
+    """
+    把原model上的查询语句转换为分表上的查询语句
+    Args:
+        statement: 原model上的sqlalchemy表达式
+        base_model: 原model
+        shard_model: gen_model生成的分表model或者ShardModel
+    Returns:
+        分表上的sqlalchemy表达式,shard_model就是base_model时原样返回
+    """
+    if shard_model is base_model:
+        return statement
+    mapping = _table_mapping(base_model, shard_model)
+    base_table = base_model.__table__
+
+    def replace(element: Any) -> Any:
+        # ORM属性生成的字段是带注解的拷贝,按照原字段查找
+        return mapping.get(id(element._deannotate())) if hasattr(element, "_deannotate") else None
+
+    statement = visitors.replacement_traverse(statement, {}, replace)
+    if any(element is base_table or getattr(element, "table", None) is base_table
+           for element in _iterate(statement)):
+        raise FuncArgsError(f"shard table {shard_model.__table__.name} does not have all the columns "
+                            f"used in the query!")
+    return statement
+
+
+class _Desc(object):
+    """
+    倒序比较
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __lt__(self, other: '_Desc') -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, _Desc) and self.value == other.value
+
+
+class ShardMerger(object):
+    """
+    合并多个分表的查询结果
+
+    有排序时每个分表的结果已经按照排序字段有序,使用堆做k路归并,和MySQL一样正序时NULL在前、倒序时NULL在后;
+    没有排序时按照分表的顺序拼接.
+    """
+
+    __slots__ = ("names", "descs", "limit", "offset")
+
+    def __init__(self, order_by: Sequence[Any] = (), limit: Optional[int] = None, offset: int = 0):
+        """
+            合并多个分表的查询结果
+        Args:
+            order_by: 查询的排序,只支持字段以及字段的asc()、desc()
+            limit: 合并后返回的最大行数,为None时返回所有
+            offset: 合并后跳过的行数
+        """
+        if (limit is not None and limit < 0) or offset < 0:
+            raise FuncArgsError("limit or offset value error!")
+        try:
+            order = KeysetOrder(order_by) if order_by else None
+        except FuncArgsError:
+            raise FuncArgsError("shard merge order by only supports columns and column.asc()/desc()!")
+        self.names: List[str] = order.names if order is not None else []
+        self.descs: List[bool] = order.descs if order is not None else []
+        self.limit: Optional[int] = limit
+        self.offset: int = offset
+
+    @property
+    def shard_limit(self, ) -> Optional[int]:
+        """
+        每个分表需要返回的最大行数
+        """
+        return None if self.limit is None else self.offset + self.limit
+
+    def sort_key(self, ) -> Callable[[Any], Tuple[Any, ...]]:
+        """
+        行的排序key
+        """
+        getters = list(zip(self.names, self.descs))
+
+        def key(row: Any) -> Tuple[Any, ...]:
+            values = []
+            for name, desc in getters:
+                value = row[name]
+                value = (value is not None, value)
+                values.append(_Desc(value) if desc else value)
+            return tuple(values)
+
+        return key
+
+    def merge(self, results: Sequence[Sequence[Any]]) -> List[Any]:
+        """
+        合并多个分表的结果
+        Args:
+            results: 每个分表的查询结果
+        Returns:
+            合并后的结果
+        """
+        if self.names:
+            # 排序值相同时按照分表的顺序
+            rows: Iterable[Any] = heapq.merge(*results, key=self.sort_key())
+        else:
+            rows = chain.from_iterable(results)
+        stop = None if self.limit is None else self.offset + self.limit
+        return list(islice(rows, self.offset, stop))
+
+
+def _merge_sum(first: Any, second: Any) -> Any:
+    """
+    合并SUM、COUNT,和MySQL一样忽略NULL
+    """
+    return second if first is None else first if second is None else first + second
+
+
+def _merge_min(first: Any, second: Any) -> Any:
+    """
+    合并MIN
+    """
+    return second if first is None else first if second is None else min(first, second)
+
+
+def _merge_max(first: Any, second: Any) -> Any:
+    """
+    合并MAX
+    """
+    return second if first is None else first if second is None else max(first, second)
+
+
+#: 每种聚合的部分聚合结果的合并函数
+_AGGREGATE_MERGES: Dict[str, Callable[[Any, Any], Any]] = {
+    "count": _merge_sum, "sum": _merge_sum, "min": _merge_min, "max": _merge_max}
+
+
+class ShardAggregator(object):
+    """
+    跨分表的聚合
+
+    查询的字段为分组字段和带label的count、sum、min、max、avg聚合,每个分表上执行部分聚合,
+    AVG拆分为SUM和COUNT两个部分聚合,合并后再相除.HAVING和COUNT(DISTINCT)不能由部分聚合合并,不支持.
+    """
+
+    __slots__ = ("names", "group_indexes", "aggregates", "partial_columns")
+
+    def __init__(self, columns: Sequence[Any]):
+        """
+            跨分表的聚合
+        Args:
+            columns: 查询的字段,分组字段以及聚合函数.label(名称)
+        """
+        if not columns:
+            raise FuncArgsError("shard aggregate needs columns!")
+        self.names: List[str] = []
+        self.group_indexes: List[int] = []
+        # (聚合名称, 部分聚合结果的下标) avg时下标为(sum的下标, count的下标)
+        self.aggregates: List[Tuple[str, Any]] = []
+        self.partial_columns: List[Any] = []
+        for column in columns:
+            clause = column.__clause_element__() if hasattr(column, "__clause_element__") else column
+            element = clause.element if isinstance(clause, Label) else clause
+            if not isinstance(element, FunctionElement):
+                # 包含聚合的表达式不能作为分组字段,eg: (func.sum(Order.amount) + 1).label("total")
+                if any(isinstance(one, FunctionElement) and one.name.lower() in ("count", "sum", "min", "max", "avg")
+                       for one in visitors.iterate(element, {})):
+                    raise FuncArgsError("shard aggregate function must be the outermost expression of the column!")
+                name = getattr(clause, "name", None) or getattr(clause, "key", None)
+                if name is None:
+                    raise FuncArgsError("shard aggregate group column must have a name!")
+                self.names.append(name)
+                self.group_indexes.append(len(self.partial_columns))
+                self.aggregates.append(("group", len(self.partial_columns)))
+                self.partial_columns.append(column)
+                continue
+            if not isinstance(clause, Label):
+                raise FuncArgsError("shard aggregate function must have a label!")
+            func_name = element.name.lower()
+            if func_name not in ("count", "sum", "min", "max", "avg"):
+                raise FuncArgsError(f"shard aggregate does not support function {element.name}!")
+            if any(isinstance(one, UnaryExpression) and one.operator is operators.distinct_op
+                   for one in visitors.iterate(element, {})):
+                raise FuncArgsError("shard aggregate does not support distinct aggregate!")
+            self.names.append(clause.name)
+            index = len(self.partial_columns)
+            if func_name == "avg":
+                arguments = list(element.clauses)
+                self.aggregates.append(("avg", (index, index + 1)))
+                self.partial_columns.append(func.sum(*arguments).label(f"{clause.name}__sum"))
+                self.partial_columns.append(func.count(*arguments).label(f"{clause.name}__count"))
+            else:
+                self.aggregates.append((func_name, index))
+                self.partial_columns.append(clause)
+
+    def merge(self, results: Iterable[Sequence[Sequence[Any]]]) -> List[Tuple[Any, ...]]:
+        """
+        合并每个分表的部分聚合结果
+        Args:
+            results: 每个分表的查询结果,字段顺序和partial_columns一致
+        Returns:
+            合并后的行,字段顺序和names一致,按照分组第一次出现的顺序
+        """
+        groups: Dict[Tuple[Any, ...], List[Any]] = {}
+        for row in chain.from_iterable(results):
+            row = tuple(row)
+            group_key = tuple(row[index] for index in self.group_indexes)
+            partial = groups.get(group_key)
+            if partial is None:
+                groups[group_key] = list(row)
+                continue
+            for func_name, index in self.aggregates:
+                if func_name == "avg":
+                    for one_index in index:
+                        partial[one_index] = _merge_sum(partial[one_index], row[one_index])
+                elif func_name != "group":
+                    partial[index] = _AGGREGATE_MERGES[func_name](partial[index], row[index])
+
+        merged_rows: List[Tuple[Any, ...]] = []
+        for partial in groups.values():
+            values = []
+            for func_name, index in self.aggregates:
+                if func_name == "avg":
+                    total, count = partial[index[0]], partial[index[1]]
+                    values.append(total / count if count else None)
+                else:
+                    values.append(partial[index])
+            merged_rows.append(tuple(values))
+        return merged_rows
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/17 下午4:30
+
+轻量的分表
+
+gen_model为每个分表生成完整的declarative类,包括Model.metadata中新的Table、Column以及mapper.
+ShardTable是原表的别名,字段为原表字段的ColumnClause代理,渲染SQL时只使用分表的表名,不注册到metadata中;
+ShardModel包装ShardTable,可以像model一样用于Query.model()和FesMgrSession.query(),
+insert、update时的默认值等元数据和原model共用.
+"""
+from typing import Any, Dict
+
+from sqlalchemy import inspection
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.sql.elements import ColumnClause
+from sqlalchemy.sql.schema import Table
+from sqlalchemy.sql.selectable import Alias
+
+from ._model_meta import model_registry
+
+__all__ = ("ShardTable", "ShardModel")
+
+
+class ShardTable(Alias):
+    """
+    分表,原表的别名,渲染时只使用分表的表名
+
+    eg: SELECT order_01.id FROM order_01 而不是 SELECT order_01.id FROM order AS order_01
+    """
+
+    __visit_name__ = "shard_table"
+
+    @classmethod
+    def create(cls, table: Table, name: str) -> 'ShardTable':
+        """
+        生成分表
+        Args:
+            table: 原表
+            name: 分表的表名
+        Returns:
+
+        """
+        shard_table = cls._construct(table, name)
+        shard_table.schema = table.schema
+        return shard_table
+
+    def _populate_column_collection(self, ) -> None:
+        """
+        字段代理使用ColumnClause,不像Column的代理那样复制约束、外键等
+        """
+        for column in self.element.columns:
+            shard_column = ColumnClause(column.name, type_=column.type, _selectable=self)
+            shard_column.key = column.key
+            shard_column._proxies = [column]
+            if column.primary_key:
+                shard_column.primary_key = True
+                self.primary_key.add(shard_column)
+            self._columns[column.key] = shard_column
+
+    @property
+    def _autoincrement_column(self, ) -> Any:
+        """
+        insert时使用的自增字段
+        """
+        # noinspection PyProtectedMember
+        column = self.element._autoincrement_column
+        return None if column is None else self.corresponding_column(column)
+
+
+# noinspection PyUnusedLocal
+@compiles(ShardTable)
+def _compile_shard_table(element: ShardTable, compiler: Any, **kwargs) -> str:
+    """
+    FROM、INSERT、UPDATE、DELETE中只渲染分表的表名
+    """
+    return compiler.preparer.format_table(element, use_schema=True)
+
+
+class ShardModel(object):
+    """
+    分表model,字段为原model字段在分表上的代理
+
+    eg: order = db.shard_model(Order, "01")
+        query = db.query.model(order).where(order.uid == 1)  # SanicMySQL
+        rows = db.session.query(order).filter(order.uid == 1).all()  # DBAlchemy
+    """
+
+    __slots__ = ("base_model", "__table__", "__tablename__", "__weakref__")
+
+    def __init__(self, base_model: DeclarativeMeta, table_name: str):
+        """
+            分表model
+        Args:
+            base_model: 原model类
+            table_name: 分表的表名
+        """
+        self.base_model: DeclarativeMeta = base_model
+        self.__table__: ShardTable = ShardTable.create(base_model.__table__, table_name)
+        self.__tablename__: str = table_name
+
+    def __clause_element__(self, ) -> ShardTable:
+        return self.__table__
+
+    def __getattr__(self, attr_name: str) -> ColumnClause:
+        # 只有原model的字段,其他属性没有代理
+        column = model_registry.get(self.base_model).columns.get(attr_name) if not attr_name.startswith("__") else None
+        if column is None:
+            raise AttributeError(f"{self!r} has no attribute {attr_name}")
+        return self.__table__.c[column.key]
+
+    def shard_columns(self, ) -> Dict[str, ColumnClause]:
+        """
+        {属性名: 分表上的字段},按照原model中定义的顺序
+        """
+        columns = self.__table__.c
+        return {attr_name: columns[column.key]
+                for attr_name, column in model_registry.get(self.base_model).columns.items()}
+
+    def __repr__(self, ) -> str:
+        return f"<ShardModel {self.base_model.__name__} {self.__tablename__}>"
+
+
+# insert、update、delete等需要FROM的地方把ShardModel作为分表
+inspection._inspects(ShardModel)(lambda shard_model: shard_model.__table__)
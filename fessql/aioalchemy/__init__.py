@@ -11,7 +11,7 @@ from .sanic_mysql import *
 from .blinker import *
 
 __all__ = (
-    "Query",
+    "Query", "PreparedQuery", "compiled_cache",
 
     "SanicMySQL", "Pagination", "Session",
 
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 上午10:12
+
+编译SQL缓存
+
+同一种结构的SQL语句(只有绑定的值不同)只编译一次,编译后的SQL字符串、绑定参数的名称以及bind processor都会缓存起来,
+之后相同结构的语句只需要遍历一次语句树取出当前的绑定值,然后重新计算参数即可,不用再次调用compile.
+
+语句结构的key由语句树按广度优先遍历得到,每个节点只取和生成SQL相关的信息(类型、操作符、列、表、绑定参数的名称及类型等),
+绑定的值不参与key的计算.遇到无法识别的节点时,语句不进入缓存,直接编译,保证生成的SQL一定是正确的.
+"""
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.sql import schema, sqltypes
+from sqlalchemy.sql.dml import Delete, Insert, Update
+from sqlalchemy.sql.elements import (BinaryExpression, BindParameter, Case, Cast, ClauseElement, ClauseList,
+                                     ColumnClause, Extract, False_, Grouping, Label, Null, TextClause, True_,
+                                     TypeClause, UnaryExpression, _anonymous_label, _label_reference,
+                                     _textual_label_reference)
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.sql.selectable import Alias, FromGrouping, Join, Select, TableClause
+
+from fessql._cachelru import LRU
+from fessql._shard_table import ShardTable
+
+__all__ = ("CompiledCache", "CompiledTemplate", "CompiledStatement")
+
+DEFAULT_MAX_SIZE = 512
+
+# 绑定参数值的来源, 遍历语句树得到的绑定参数、insert/update中values的字面值或者列的默认值
+_SRC_BIND, _SRC_VALUE, _SRC_PREFETCH = 0, 1, 2
+
+# 这些类型的bind processor只和方言有关,和实例的属性无关,可以按照类型来区分,其他的类型按照实例来区分
+_PLAIN_TYPES = frozenset((sqltypes.Integer, sqltypes.SmallInteger, sqltypes.BigInteger, sqltypes.String,
+                          sqltypes.Unicode, sqltypes.Text, sqltypes.UnicodeText, sqltypes.Float, sqltypes.Numeric,
+                          sqltypes.DateTime, sqltypes.Date, sqltypes.Time, sqltypes.Boolean, sqltypes.LargeBinary,
+                          sqltypes.NullType))
+
+
+def _noop(value):
+    return value
+
+
+class _Fingerprint(object):
+    """
+    语句树的结构指纹
+    """
+
+    __slots__ = ("tokens", "binds", "values", "refs")
+
+    def __init__(self, ):
+        self.tokens: List[Any] = []
+        #: 按照遍历顺序的绑定参数
+        self.binds: List[BindParameter] = []
+        #: insert/update中的字面值, key为列名
+        self.values: Dict[str, Any] = {}
+        #: key中使用了id的对象,缓存期间保持引用防止id被复用
+        self.refs: List[Any] = []
+
+    def ident(self, obj) -> int:
+        """
+        以对象的id作为key的一部分
+        """
+        self.refs.append(obj)
+        return id(obj)
+
+    def type_token(self, type_) -> Any:
+        """
+        绑定参数类型的key
+        """
+        if type_.__class__ in _PLAIN_TYPES:
+            return type_.__class__
+        return self.ident(type_)
+
+    @property
+    def key(self, ) -> Tuple:
+        return tuple(self.tokens)
+
+
+def _prefixes_token(fp: _Fingerprint, prefixes: Sequence) -> Optional[Tuple]:
+    token = []
+    for prefix, dialect_name in prefixes:
+        if not isinstance(prefix, TextClause) or prefix._bindparams:
+            return None
+        token.append((prefix.text, dialect_name))
+    return tuple(token)
+
+
+def _dialect_options_token(elem) -> Optional[Tuple]:
+    # dialect_options是memoized属性,没有传入方言参数时不会生成
+    dialect_options = elem.__dict__.get("dialect_options")
+    if not dialect_options:
+        return ()
+    token = tuple(sorted((name, tuple(sorted(opts._non_defaults.items())))
+                         for name, opts in dialect_options.items() if opts._non_defaults))
+    try:
+        hash(token)
+    except TypeError:
+        return None
+    return token
+
+
+def _visit_select(fp: _Fingerprint, elem: Select):
+    if elem._correlate or elem._correlate_except or elem._suffixes:
+        return None, ()
+    for_update = elem._for_update_arg
+    if for_update is not None:
+        if for_update.of:
+            return None, ()
+        for_update = (for_update.read, for_update.nowait, for_update.skip_locked, for_update.key_share)
+    prefixes = _prefixes_token(fp, elem._prefixes)
+    if prefixes is None:
+        return None, ()
+    distinct = elem._distinct if isinstance(elem._distinct, (bool, str)) else bool(elem._distinct)
+    hints = tuple((fp.ident(selectable), dialect_name, text_)
+                  for (selectable, dialect_name), text_ in elem._hints.items())
+    froms = elem._froms
+    children = [*elem._raw_columns, *froms]
+    for clause in (elem._whereclause, elem._having):
+        if clause is not None:
+            children.append(clause)
+    children.extend((elem._order_by_clause, elem._group_by_clause))
+    # limit和offset不在get_children中,这里单独加入
+    for clause in (elem._limit_clause, elem._offset_clause):
+        if isinstance(clause, BindParameter):
+            fp.binds.append(clause)
+        elif clause is not None:
+            return None, ()
+    token = (Select, len(elem._raw_columns), len(froms), elem._whereclause is not None,
+             elem._having is not None, elem._limit_clause is not None, elem._offset_clause is not None,
+             distinct, elem.use_labels, elem._auto_correlate, for_update, prefixes, hints, elem._statement_hints)
+    return token, children
+
+
+def _visit_values(fp: _Fingerprint, elem, children: List) -> Optional[Tuple]:
+    # insert和update的values,字面值在编译时才会生成绑定参数,这里记录下来,SQL表达式的值按照子节点处理
+    if elem._has_multi_parameters or elem.parameters is None:
+        return () if elem.parameters is None else None
+    token = []
+    for key in sorted(elem.parameters, key=str):
+        if not isinstance(key, str):
+            return None
+        value = elem.parameters[key]
+        if isinstance(value, ClauseElement):
+            token.append((key, True))
+            children.append(value)
+        else:
+            token.append((key, False))
+            fp.values[key] = value
+    return tuple(token)
+
+
+def _visit_dml(fp: _Fingerprint, elem):
+    if elem._returning or elem._hints:
+        return None, ()
+    prefixes = _prefixes_token(fp, elem._prefixes)
+    dialect_options = _dialect_options_token(elem)
+    if prefixes is None or dialect_options is None:
+        return None, ()
+    children: List = []
+    if isinstance(elem, Insert):
+        if elem.select is not None or elem._post_values_clause is not None:
+            return None, ()
+        values = _visit_values(fp, elem, children)
+        extra: Tuple = (elem.inline,)
+    elif isinstance(elem, Update):
+        if elem._whereclause is not None:
+            children.append(elem._whereclause)
+        values = _visit_values(fp, elem, children)
+        extra = (elem.inline, elem._preserve_parameter_order, elem._whereclause is not None)
+    else:
+        if elem._whereclause is not None:
+            children.append(elem._whereclause)
+        values, extra = (), ()
+    if values is None:
+        return None, ()
+    return (elem.__class__, fp.ident(elem.table), values, prefixes, dialect_options, *extra), children
+
+
+def _visit_bind(fp: _Fingerprint, elem: BindParameter):
+    fp.binds.append(elem)
+    key = None if isinstance(elem.key, _anonymous_label) else elem.key
+    return (BindParameter, key, fp.type_token(elem.type), elem.expanding, elem.required, elem.isoutparam), ()
+
+
+def _visit_column(fp: _Fingerprint, elem: ColumnClause):
+    if isinstance(elem, schema.Column):
+        # orm中的列是annotated的列,取原始的列
+        return (schema.Column, fp.ident(getattr(elem, "_Annotated__element", elem))), ()
+    table = elem.table
+    return (ColumnClause, elem.name, elem.is_literal, fp.ident(table) if table is not None else None,
+            fp.type_token(elem.type)), ()
+
+
+def _visit_function(fp: _Fingerprint, elem: FunctionElement):
+    return (elem.__class__, getattr(elem, "name", None), tuple(getattr(elem, "packagenames", ())),
+            fp.type_token(elem.type)), (elem.clause_expr,)
+
+
+def _visit_label(fp: _Fingerprint, elem: Label):
+    name = None if isinstance(elem.name, _anonymous_label) else elem.name
+    return (Label, name), (elem.element,)
+
+
+def _visit_clause_list(fp: _Fingerprint, elem: ClauseList):
+    return (elem.__class__, elem.operator, len(elem.clauses), elem.group, elem.group_contents), elem.clauses
+
+
+def _visit_binary(fp: _Fingerprint, elem: BinaryExpression):
+    try:
+        modifiers = tuple(sorted(elem.modifiers.items()))
+        hash(modifiers)
+    except TypeError:
+        return None, ()
+    return (elem.__class__, elem.operator, elem.negate, modifiers), (elem.left, elem.right)
+
+
+def _visit_unary(fp: _Fingerprint, elem: UnaryExpression):
+    return (elem.__class__, elem.operator, elem.modifier, elem.wraps_column_expression), (elem.element,)
+
+
+def _visit_case(fp: _Fingerprint, elem: Case):
+    return (Case, elem.value is not None, len(elem.whens), elem.else_ is not None), list(elem.get_children())
+
+
+def _visit_cast(fp: _Fingerprint, elem: Cast):
+    return (Cast,), (elem.clause, elem.typeclause)
+
+
+def _visit_type_clause(fp: _Fingerprint, elem: TypeClause):
+    return (TypeClause, repr(elem.type)), ()
+
+
+def _visit_text(fp: _Fingerprint, elem: TextClause):
+    return (TextClause, elem.text), list(elem._bindparams.values())
+
+
+def _visit_table(fp: _Fingerprint, elem: TableClause):
+    return (TableClause, fp.ident(elem)), ()
+
+
+def _visit_alias(fp: _Fingerprint, elem: Alias):
+    name = None if isinstance(elem.name, _anonymous_label) else elem.name
+    return (elem.__class__, name), (elem.element,)
+
+
+def _visit_join(fp: _Fingerprint, elem: Join):
+    return (Join, elem.isouter, elem.full), (elem.left, elem.right, elem.onclause)
+
+
+def _visit_extract(fp: _Fingerprint, elem: Extract):
+    return (Extract, elem.field), (elem.expr,)
+
+
+def _visit_label_reference(fp: _Fingerprint, elem: _label_reference):
+    return (_label_reference,), (elem.element,)
+
+
+def _visit_textual_label_reference(fp: _Fingerprint, elem: _textual_label_reference):
+    return (_textual_label_reference, elem.element), ()
+
+
+def _visit_grouping(fp: _Fingerprint, elem):
+    return (elem.__class__,), (elem.element,)
+
+
+def _visit_constant(fp: _Fingerprint, elem):
+    return (elem.__class__,), ()
+
+
+_VISITORS: Dict[type, Callable] = {
+    Select: _visit_select,
+    Insert: _visit_dml,
+    Update: _visit_dml,
+    Delete: _visit_dml,
+    BindParameter: _visit_bind,
+    ColumnClause: _visit_column,
+    FunctionElement: _visit_function,
+    Label: _visit_label,
+    ClauseList: _visit_clause_list,
+    BinaryExpression: _visit_binary,
+    UnaryExpression: _visit_unary,
+    Case: _visit_case,
+    Cast: _visit_cast,
+    TypeClause: _visit_type_clause,
+    TextClause: _visit_text,
+    TableClause: _visit_table,
+    ShardTable: _visit_table,
+    Alias: _visit_alias,
+    Join: _visit_join,
+    Extract: _visit_extract,
+    _label_reference: _visit_label_reference,
+    _textual_label_reference: _visit_textual_label_reference,
+    Grouping: _visit_grouping,
+    FromGrouping: _visit_grouping,
+    Null: _visit_constant,
+    True_: _visit_constant,
+    False_: _visit_constant,
+}
+
+
+def _find_visitor(cls: type) -> Optional[Callable]:
+    """
+    查找节点对应的处理函数
+
+    只有sqlalchemy自身的子类(比如orm中的Annotated类)才沿着MRO查找,用户自定义的节点可能有自己的编译逻辑,不做缓存
+    """
+    try:
+        return _VISITORS[cls]
+    except KeyError:
+        visitor = None
+        if cls.__module__.startswith("sqlalchemy."):
+            for base in cls.__mro__[1:]:
+                if base in _VISITORS:
+                    visitor = _VISITORS[base]
+                    break
+        _VISITORS[cls] = visitor
+        return visitor
+
+
+def fingerprint(statement: ClauseElement) -> Optional[_Fingerprint]:
+    """
+    计算语句的结构指纹
+
+    按照广度优先遍历语句树,每个节点的token包含了子节点的个数,所以token序列可以唯一的确定一个语句树
+    Args:
+        statement: sqlalchemy表达式
+    Returns:
+        无法缓存的语句返回None
+    """
+    fp = _Fingerprint()
+    stack = deque([statement])
+    while stack:
+        elem = stack.popleft()
+        visitor = _find_visitor(elem.__class__)
+        if visitor is None:
+            return None
+        token, children = visitor(fp, elem)
+        if token is None:
+            return None
+        children = [child for child in children if child is not None]
+        fp.tokens.append((len(children), token))
+        stack.extend(children)
+    return fp
+
+
+class CompiledTemplate(object):
+    """
+    编译后的SQL模板,相同结构的语句共用一个
+
+    slots中记录了每个绑定参数的名称及值的来源,构造参数的逻辑和SQLCompiler.construct_params一致
+    """
+
+    __slots__ = ("sql", "compiled", "slots", "processors", "prefetch", "result_map", "_refs")
+
+    def __init__(self, compiled, slots: List[Tuple[str, str, bool, int, Any]], refs: Sequence = ()):
+        self.sql: str = str(compiled)
+        self.compiled = compiled
+        #: (name, key, required, source, index or key)
+        self.slots = slots
+        self.processors: Dict[str, Callable] = compiled._bind_processors
+        # aiomysql高版本的编译器在构造参数时会执行列的默认值,这里保持一致
+        self.prefetch = compiled.prefetch if hasattr(compiled, "_exec_default") else ()
+        self.result_map = getattr(compiled, "_result_columns", None)
+        self._refs = tuple(refs)
+
+    @classmethod
+    def from_compiled(cls, compiled, fp: _Fingerprint) -> Optional['CompiledTemplate']:
+        """
+        根据编译结果和语句指纹生成模板,编译中出现了指纹中没有的绑定参数时返回None
+        """
+        bind_index: Dict[int, int] = {}
+        for index, bind in enumerate(fp.binds):
+            bind_index.setdefault(id(bind), index)
+        prefetch_keys = {column.key for column in getattr(compiled, "prefetch", ())}
+        slots = []
+        for bind, name in compiled.bind_names.items():
+            index = bind_index.get(id(bind))
+            if index is not None:
+                slots.append((name, bind.key, bind.required, _SRC_BIND, index))
+            elif bind.key in fp.values and bind.value is fp.values[bind.key]:
+                slots.append((name, bind.key, bind.required, _SRC_VALUE, bind.key))
+            elif bind.key in prefetch_keys and bind.value is None and not bind.callable:
+                slots.append((name, bind.key, bind.required, _SRC_PREFETCH, None))
+            else:
+                return None
+        return cls(compiled, slots, fp.refs)
+
+    @classmethod
+    def uncached(cls, compiled) -> Tuple['CompiledTemplate', List[BindParameter]]:
+        """
+        不进入缓存的语句,直接使用编译结果中的绑定参数
+        """
+        binds = list(compiled.bind_names)
+        slots = [(compiled.bind_names[bind], bind.key, bind.required, _SRC_BIND, index)
+                 for index, bind in enumerate(binds)]
+        return cls(compiled, slots), binds
+
+    def construct_params(self, binds: Sequence[BindParameter], values: Dict[str, Any],
+                         params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        构造执行参数,并且经过bind processor处理
+        Args:
+            binds: 当前语句按照遍历顺序的绑定参数
+            values: 当前语句insert/update中的字面值
+            params: 执行时传入的参数
+        Returns:
+
+        """
+        pd = {}
+        for name, key, required, source, ref in self.slots:
+            if params and key in params:
+                pd[name] = params[key]
+            elif params and name in params:
+                pd[name] = params[name]
+            elif required:
+                raise InvalidRequestError(f"A value is required for bind parameter {key!r}")
+            elif source == _SRC_BIND:
+                bind = binds[ref]
+                pd[name] = bind.effective_value if bind.callable else bind.value
+            elif source == _SRC_VALUE:
+                pd[name] = values[ref]
+            else:
+                pd[name] = None
+        for column in self.prefetch:
+            pd[column.key] = self.compiled._exec_default(column.default)
+
+        processors = self.processors
+        return {name: processors.get(name, _noop)(value) for name, value in pd.items()}
+
+
+class CompiledStatement(object):
+    """
+    编译后的语句,由缓存的模板和当前语句的绑定值组成
+    """
+
+    __slots__ = ("template", "binds", "values")
+
+    def __init__(self, template: CompiledTemplate, binds: Sequence[BindParameter], values: Dict[str, Any]):
+        self.template: CompiledTemplate = template
+        self.binds: Sequence[BindParameter] = binds
+        self.values: Dict[str, Any] = values
+
+    @property
+    def sql(self, ) -> str:
+        return self.template.sql
+
+    @property
+    def result_map(self, ):
+        return self.template.result_map
+
+    def construct_params(self, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        构造执行参数
+        Args:
+            params: 执行时传入的参数
+        Returns:
+
+        """
+        return self.template.construct_params(self.binds, self.values, params)
+
+
+class CompiledCache(object):
+    """
+    编译SQL缓存,基于LRU实现,key为语句的结构指纹
+    """
+
+    def __init__(self, dialect, max_size: int = DEFAULT_MAX_SIZE):
+        """
+            编译SQL缓存
+        Args:
+            dialect: 编译使用的方言
+            max_size: 缓存的最大条数
+        """
+        self.dialect = dialect
+        self._cache: LRU = LRU(max_size=max_size)
+        #: 无法缓存的语句数量
+        self.uncacheable_count: int = 0
+
+    @property
+    def max_size(self, ) -> int:
+        return self._cache.max_size
+
+    def resize(self, max_size: int):
+        """
+        更改缓存的最大条数,更改后会清空缓存
+        Args:
+            max_size: 缓存的最大条数
+        Returns:
+
+        """
+        self._cache = LRU(max_size=max_size)
+
+    def clear(self, ):
+        """
+        清空缓存
+        """
+        self._cache.clear()
+
+    def stats(self, ) -> Dict[str, int]:
+        """
+        缓存的统计信息
+        Returns:
+            {"hit_count": 命中次数, "miss_count": 未命中次数, "uncacheable_count": 无法缓存的次数,
+             "size": 当前缓存条数, "max_size": 最大缓存条数}
+        """
+        return {"hit_count": self._cache.hit_count, "miss_count": self._cache.miss_count,
+                "uncacheable_count": self.uncacheable_count, "size": len(self._cache),
+                "max_size": self._cache.max_size}
+
+    def compile(self, statement: ClauseElement) -> CompiledStatement:
+        """
+        编译语句,相同结构的语句直接使用缓存的编译结果
+        Args:
+            statement: sqlalchemy表达式
+        Returns:
+            CompiledStatement
+        """
+        fp = fingerprint(statement)
+        if fp is not None:
+            key = fp.key
+            template = self._cache.get(key)
+            if template is not None:
+                return CompiledStatement(template, fp.binds, fp.values)
+
+        compiled = statement.compile(dialect=self.dialect)
+        if fp is not None:
+            template = CompiledTemplate.from_compiled(compiled, fp)
+            if template is not None:
+                self._cache[fp.key] = template
+                return CompiledStatement(template, fp.binds, fp.values)
+
+        self.uncacheable_count += 1
+        template, binds = CompiledTemplate.uncached(compiled)
+        return CompiledStatement(template, binds, {})
@@ -7,12 +7,15 @@
 @time: 2020/3/1 上午12:00
 """
 
-from typing import Any, Dict, List, MutableMapping, Optional, Union
+import re
+from functools import wraps
+from typing import (Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Mapping, MutableMapping,
+                    Optional, Tuple, Union)
 
 import aelog
 from aiomysql.sa import exc
 # noinspection PyProtectedMember
-from aiomysql.sa.connection import _distill_params, noop
+from aiomysql.sa.connection import _distill_params
 # noinspection PyProtectedMember
 from aiomysql.sa.engine import _dialect
 from sqlalchemy.exc import SQLAlchemyError
@@ -22,16 +25,50 @@ from sqlalchemy.sql import (Delete, Insert, Select, Update, delete, func, insert
 from sqlalchemy.sql.dml import UpdateBase
 from sqlalchemy.sql.elements import BinaryExpression
 
+from fessql._bulk import DEFAULT_BULK_CHUNK_SIZE, gen_case_updates, gen_upserts
+from fessql._keyset import KeysetOrder
+from fessql._model_meta import model_registry
+from fessql._shard_table import ShardModel
 from fessql.err import FuncArgsError, QueryArgsError
+from ._compiled import CompiledCache, CompiledStatement
 
-__all__ = ("Query",)
+__all__ = ("Query", "PreparedQuery", "compiled_cache")
+
+#: 编译SQL缓存,所有的Query共用
+compiled_cache: CompiledCache = CompiledCache(_dialect)
+#: 批量插入时单条INSERT语句的默认最大字节数,和pymysql中executemany的max_stmt_length一致,需要小于服务端的max_allowed_packet
+DEFAULT_MAX_PACKET_SIZE: int = 1024000
+#: 编译后的INSERT语句中VALUES部分的参数名
+_BIND_NAME_RE = re.compile(r"%\(([^)]+)\)s")
+
+
+def _generative(func: Callable) -> Callable:
+    """
+    生成式方法,默认在当前查询上修改并返回当前查询;generative()之后在当前查询的拷贝上执行并返回拷贝,当前查询不变
+
+    拷贝只复制属性字典,条件列表和原查询共用,方法中修改条件时替换为新的列表,不在原列表上修改,
+    所以模块级别定义的基础查询可以在多个并发的请求中派生不同的查询.
+    """
+
+    @wraps(func)
+    def generate(self, *args, **kwargs):
+        return func(self._clone() if self._copy_on_write else self, *args, **kwargs)
+
+    return generate
 
 
 class BaseQuery(object):
     """
     查询
+
+    生成查询的方法默认在当前查询上修改并返回当前查询;generative()之后都返回新的查询对象,原查询不变,eg:
+        base_query = db.query.model(User).where(User.status == 1).generative()
+        page_query = base_query.paginate_query(page=2)  # base_query不变
     """
 
+    #: 为True时生成查询的方法在拷贝上执行,见generative()
+    _copy_on_write: bool = False
+
     def __init__(self, ) -> None:
         """
             查询
@@ -53,24 +90,60 @@ class BaseQuery(object):
         self._limit_clause: Optional[int] = None
         self._offset_clause: Optional[int] = None
 
+    def _clone(self, ) -> 'BaseQuery':
+        """
+        浅拷贝当前查询,未修改的条件列表和原查询共用
+        Args:
+
+        Returns:
+
+        """
+        query = self.__class__.__new__(self.__class__)
+        query.__dict__ = self.__dict__.copy()
+        return query
+
+    def copy(self, ) -> 'BaseQuery':
+        """
+        拷贝当前查询,在拷贝上修改不影响当前查询
+        Args:
+
+        Returns:
+
+        """
+        return self._clone()
+
+    def generative(self, ) -> 'BaseQuery':
+        """
+        返回生成式的查询拷贝,之后生成查询的方法都在拷贝上执行并返回拷贝,适合模块级别定义的基础查询
+        Args:
+
+        Returns:
+
+        """
+        query = self._clone()
+        query._copy_on_write = True
+        return query
+
+    @_generative
     def where(self, *whereclause) -> 'BaseQuery':
         """return basequery construct with the given expression added to
         its WHERE clause, joined to the existing clause via AND, if any.
 
         """
 
-        self._whereclause.extend(whereclause)
+        self._whereclause = [*self._whereclause, *whereclause]
         return self
 
+    @_generative
     def model(self, modelclause: DeclarativeMeta) -> 'BaseQuery':
         """
         return basequery construct with the given expression added to
         its model clause.
 
         Arg:
-            modelclause: sqlalchemy中的model或者table
+            modelclause: sqlalchemy中的model或者ShardModel
         """
-        if not isinstance(modelclause, DeclarativeMeta):
+        if not isinstance(modelclause, (DeclarativeMeta, ShardModel)):
             raise FuncArgsError("model type error!")
 
         self._model = modelclause
@@ -78,6 +151,7 @@ class BaseQuery(object):
 
     table = model
 
+    @_generative
     def order_by(self, *clauses) -> 'BaseQuery':
         """return basequery with the given list of ORDER BY
         criterion applied.
@@ -87,9 +161,10 @@ class BaseQuery(object):
 
         """
 
-        self._order_by.extend(clauses)
+        self._order_by = [*self._order_by, *clauses]
         return self
 
+    @_generative
     def group_by(self, *clauses) -> 'BaseQuery':
         """return basequery with the given list of GROUP BY
         criterion applied.
@@ -99,17 +174,19 @@ class BaseQuery(object):
 
         """
 
-        self._group_by.extend(clauses)
+        self._group_by = [*self._group_by, *clauses]
         return self
 
+    @_generative
     def having(self, *having) -> 'BaseQuery':
         """return basequery construct with the given expression added to
         its HAVING clause, joined to the existing clause via AND, if any.
 
         """
-        self._having.extend(having)
+        self._having = [*self._having, *having]
         return self
 
+    @_generative
     def distinct(self, *expr) -> 'BaseQuery':
         r"""Return basequery construct which will apply DISTINCT to its
         columns clause.
@@ -119,9 +196,10 @@ class BaseQuery(object):
          construct.
 
         """
-        self._distinct.extend(expr)
+        self._distinct = [*self._distinct, *expr]
         return self
 
+    @_generative
     def columns(self, *columns) -> 'BaseQuery':
         r"""Return basequery :func:`.select` construct with its columns
         clause replaced with the given columns.
@@ -138,9 +216,10 @@ class BaseQuery(object):
         list no longer contains that FROM::
 
         """
-        self._columns.extend(columns)
+        self._columns = [*self._columns, *columns]
         return self
 
+    @_generative
     def union(self, other, **kwargs) -> 'BaseQuery':
         """return a SQL UNION of this select() construct against the given
         selectable."""
@@ -148,6 +227,7 @@ class BaseQuery(object):
         self._union = [other, kwargs]
         return self
 
+    @_generative
     def union_all(self, other, **kwargs) -> 'BaseQuery':
         """return a SQL UNION ALL of this select() construct against the given
         selectable.
@@ -156,6 +236,7 @@ class BaseQuery(object):
         self._union_all = [other, kwargs]
         return self
 
+    @_generative
     def with_hint(self, selectable, text_, dialect_name='*') -> 'BaseQuery':
         r"""Add an indexing or other executional context hint for the given
         selectable to this :class:`.Select`.
@@ -192,12 +273,51 @@ class BaseQuery(object):
         self._with_hint = [selectable, text_, dialect_name]
         return self
 
+    @_generative
     def values(self, *args) -> 'BaseQuery':
         r"""specify a fixed VALUES clause for an SET clause for an UPDATE."""
-        self._bind_values.extend(args)
+        self._bind_values = [*self._bind_values, *args]
         return self
 
 
+class PreparedQuery(object):
+    """
+    预编译的查询模板
+
+    由Query.prepare()生成,语句和编译结果在生成时就已经固定,之后不可更改,可以在模块级别定义后在多个请求中并发使用,
+    每次执行时只需要传入bindparam对应的参数值.
+
+    eg: user_tpl = db.query.model(User).where(User.id == bindparam("id")).prepare()
+        await db.session.find_one(user_tpl, {"id": 1})
+    """
+
+    __slots__ = ("_model", "_query_obj", "_compiled")
+
+    def __init__(self, model: Optional[DeclarativeMeta], query_obj: Union[Select, Insert, Update, Delete]):
+        """
+            预编译的查询模板
+        Args:
+            model: 查询的model
+            query_obj: sqlalchemy表达式
+        """
+        object.__setattr__(self, "_model", model)
+        object.__setattr__(self, "_query_obj", query_obj)
+        object.__setattr__(self, "_compiled", compiled_cache.compile(query_obj))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__class__.__name__} object is immutable")
+
+    def sql(self, params: Optional[Dict[str, Any]] = None) -> Dict[str, Union[str, Dict, None]]:
+        """
+        generate sql
+        Args:
+            params: bindparam的参数值
+        Returns:
+            {"sql": "select sql", "params": "select params"}
+        """
+        return {"sql": self._compiled.sql, "params": self._compiled.construct_params(params)}
+
+
 # noinspection PyProtectedMember
 class Query(BaseQuery):
     """
@@ -215,13 +335,30 @@ class Query(BaseQuery):
         # data
         self._insert_data: Union[List[Dict[str, Any]], Dict[str, Any]] = {}
         self._update_data: Union[List[Dict[str, Any]], Dict[str, Any]] = {}
+        # 批量更新时分块的CASE更新语句,不是批量更新时为None
+        self._bulk_update_queries: Optional[List[Update]] = None
+        # 批量upsert时分块的(行数, INSERT ... ON DUPLICATE KEY UPDATE语句)
+        self._upsert_queries: List[Tuple[int, Insert]] = []
+        # 批量插入的数据,可以是列表或者异步迭代器
+        self._insert_rows: Optional[Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]]] = None
+        self._max_packet_size: int = DEFAULT_MAX_PACKET_SIZE
+        self._max_rows: int = 0
         # query
         self._query_obj: Optional[Union[Select, Insert, Update, Delete]] = None
         self._query_count_obj: Optional[Select] = None  # 查询数量select
+        # 生成查询数量select时的model和条件列表,条件列表修改时会替换为新的列表,不一致时重新生成
+        self._query_count_key: Tuple[Any, ...] = ()
+        # 是否为分页查询,分页查询的数量select在需要时才生成
+        self._paginated: bool = False
         #: the current page number (1 indexed)
         self._page: int = 1
         #: the number of items to be displayed on a page.
         self._per_page: int = 20
+        # keyset分页,排序字段、定位条件、游标以及是否为向前翻页
+        self._keyset_order: Optional[KeysetOrder] = None
+        self._keyset_where: Optional[BinaryExpression] = None
+        self._keyset_cursor: Optional[str] = None
+        self._keyset_backward: bool = False
 
         super().__init__()
 
@@ -232,15 +369,7 @@ class Query(BaseQuery):
         Returns:
 
         """
-        default_values = {}
-        for key, val in self._model.__dict__.items():
-            if not key.startswith("_") and isinstance(val, InstrumentedAttribute):
-                if val.default:
-                    if val.default.is_callable:
-                        default_values[key] = val.default.arg.__wrapped__()
-                    else:
-                        default_values[key] = val.default.arg
-        return default_values
+        return model_registry.get(self._model).gen_default_value()
 
     def _get_model_onupdate_value(self, ) -> Dict:
         """
@@ -249,15 +378,10 @@ class Query(BaseQuery):
         Returns:
 
         """
-        update_values = {}
-        for key, val in self._model.__dict__.items():
-            if not key.startswith("_") and isinstance(val, InstrumentedAttribute):
-                if val.onupdate and val.onupdate.is_callable:
-                    update_values[key] = val.onupdate.arg.__wrapped__()
-        return update_values
+        return model_registry.get(self._model).gen_onupdate_value()
 
     @staticmethod
-    def _base_params(query, dp, compiled, is_update) -> Optional[Dict]:
+    def _base_params(query, dp, compiled: CompiledStatement, is_update) -> Optional[Dict]:
         """
         handle params
         """
@@ -266,12 +390,7 @@ class Query(BaseQuery):
                 dp = {c.key: pval for c, pval in zip(query.table.c, dp)}
             else:
                 raise exc.ArgumentError("Don't mix sqlalchemy SELECT clause with positional parameters")
-        compiled_params = compiled.construct_params(dp)
-        processors = compiled._bind_processors
-        params = [{
-            key: processors.get(key, noop)(compiled_params[key])
-            for key in compiled_params
-        }]
+        params = [compiled.construct_params(dp)]
         post_processed_params = _dialect.execute_sequence_format(params)
         return post_processed_params[0]
 
@@ -291,8 +410,8 @@ class Query(BaseQuery):
             if isinstance(query, str):
                 query_, params_ = query, bind_params
             else:
-                compiled = query.compile(dialect=_dialect)
-                query_ = str(compiled)
+                compiled = compiled_cache.compile(query)
+                query_ = compiled.sql
                 params_ = []
                 for bind_param in bind_params:
                     params_.append(self._base_params(query, bind_param, compiled, isinstance(query, UpdateBase)))
@@ -303,12 +422,9 @@ class Query(BaseQuery):
             if isinstance(query, str):
                 query_, params_ = query, bind_params or None
             else:
-                compiled = query.compile(dialect=_dialect)
-                query_ = str(compiled)
+                compiled = compiled_cache.compile(query)
+                query_ = compiled.sql
                 params_ = self._base_params(query, bind_params, compiled, isinstance(query, UpdateBase))
-        # 处理自动增加的后缀
-        if getattr(self._model, "__table_suffix__", None) is not None:
-            query_ = query_.replace(getattr(self._model, "__table_suffix__"), "")
 
         return {"sql": query_, "params": params_}
 
@@ -323,6 +439,7 @@ class Query(BaseQuery):
         if self._model is None:
             raise FuncArgsError("Query 对象中缺少Model")
 
+    @_generative
     def insert_from_query(self, column_names: List, query: 'Query') -> 'Query':
         """
         查询并且插入数据, ``INSERT...FROM SELECT`` statement.
@@ -345,6 +462,7 @@ class Query(BaseQuery):
         else:
             return self
 
+    @_generative
     def insert_query(self, insert_data: Union[List[Dict], Dict]) -> 'Query':
         """
         insert query
@@ -360,7 +478,8 @@ class Query(BaseQuery):
                 insert_data_ = {**self._get_model_default_value(), **insert_data}
                 query = insert(self._model).values(insert_data_)
             else:
-                insert_data_ = [{**self._get_model_default_value(), **one_data} for one_data in insert_data]
+                model_meta = model_registry.get(self._model)
+                insert_data_ = [{**model_meta.gen_default_value(), **one_data} for one_data in insert_data]
                 query = insert(self._model).values(insert_data_[0])
         except SQLAlchemyError as e:
             aelog.exception(e)
@@ -369,18 +488,155 @@ class Query(BaseQuery):
             self._query_obj, self._insert_data = query, insert_data_
             return self
 
-    def update_query(self, update_data: Union[List[Dict], Dict]) -> 'Query':
+    @_generative
+    def upsert_query(self, upsert_data: List[Dict], *, update_columns: Union[List[str], Dict[str, str], None] = None,
+                     chunk_size: int = DEFAULT_BULK_CHUNK_SIZE) -> 'Query':
+        """
+        批量插入或更新 query
+
+        数据分块生成多行的 INSERT ... ON DUPLICATE KEY UPDATE 语句,由Session.upsert_many执行
+        eg: upsert_query(rows, update_columns={"price": "values", "stock": "increment"})
+         INSERT INTO t (...) VALUES (...), (...) ON DUPLICATE KEY UPDATE price = VALUES(price),
+         stock = t.stock + VALUES(stock)
+        Args:
+            upsert_data: 值类型List[Dict],补充insert默认值后所有行的字段必须相同
+            update_columns: 重复时更新的字段,字段名列表时更新为插入的值;字典时为{字段名: 更新方式},
+                更新方式为values、increment或者keep;默认更新数据中除主键外的所有字段
+            chunk_size: 每个分块的最大行数
+        Returns:
+
+        """
+        self._verify_model()
+        if isinstance(upsert_data, (Mapping, str)):
+            raise FuncArgsError("upsert data type error!")
+        try:
+            self._upsert_queries = list(gen_upserts(self._model, list(upsert_data), update_columns, chunk_size,
+                                                    self._get_model_onupdate_value()))
+        except SQLAlchemyError as e:
+            aelog.exception(e)
+            raise QueryArgsError(message="Cloumn args error: {}".format(str(e)))
+        return self
+
+    @_generative
+    def insert_batch_query(self, insert_rows: Union[Iterable[Dict], AsyncIterable[Dict]], *,
+                           max_packet_size: int = DEFAULT_MAX_PACKET_SIZE, max_rows: int = 0) -> 'Query':
+        """
+        批量插入 query
+
+        数据会按照max_packet_size分块生成多行的INSERT ... VALUES (...),(...)语句,由Session.insert_batch执行,
+        数据可以是异步迭代器,执行时边读取边插入,不需要一次加载到内存中.
+        所有行的字段必须相同,值必须是字面值,不能是sqlalchemy表达式.
+
+        eg: await db.session.insert_batch(db.query.model(User).insert_batch_query(read_rows()))
+        Args:
+            insert_rows: 值类型List[Dict]、Dict的迭代器或者Dict的异步迭代器
+            max_packet_size: 单条INSERT语句的最大字节数,需要小于服务端的max_allowed_packet
+            max_rows: 单条INSERT语句的最大行数,默认0不限制
+        Returns:
+
+        """
+        self._verify_model()
+        if isinstance(insert_rows, (Mapping, str)) or not (
+                hasattr(insert_rows, "__iter__") or hasattr(insert_rows, "__aiter__")):
+            raise FuncArgsError("insert rows type error!")
+        if max_packet_size <= 0 or max_rows < 0:
+            raise FuncArgsError("max_packet_size or max_rows value error!")
+
+        self._insert_rows, self._max_packet_size, self._max_rows = insert_rows, max_packet_size, max_rows
+        return self
+
+    async def _aiter_insert_rows(self, ) -> AsyncIterator[Dict]:
+        """
+        统一迭代批量插入的数据
+        Args:
+        Returns:
+
+        """
+        if hasattr(self._insert_rows, "__aiter__"):
+            async for one_row in self._insert_rows:  # type: ignore
+                yield one_row
+        else:
+            for one_row in self._insert_rows:  # type: ignore
+                yield one_row
+
+    async def _gen_insert_chunks(self, literal: Callable[[Any], str], encoding: str
+                                 ) -> AsyncIterator[Tuple[int, bytes]]:
+        """
+        生成批量插入的多行INSERT语句
+
+        INSERT语句只按照第一行编译一次,之后每行只处理参数值并转义为字面值,
+        语句的字节数达到max_packet_size或者行数达到max_rows时生成一个分块
+        Args:
+            literal: 值转义函数,和连接的字符集及sql_mode一致
+            encoding: 连接的编码
+        Returns:
+            (分块的行数, 分块的INSERT语句)
+        """
+        model_meta = model_registry.get(self._model)
+        compiled: Optional[CompiledStatement] = None
+        prefix, bind_names, row_keys = b"", [], set()
+        chunk: List[bytes] = []
+        chunk_size = 0
+
+        async for one_row in self._aiter_insert_rows():
+            one_row = {**model_meta.gen_default_value(), **one_row}
+            if compiled is None:
+                try:
+                    compiled = compiled_cache.compile(insert(self._model).values(one_row))
+                except SQLAlchemyError as e:
+                    aelog.exception(e)
+                    raise QueryArgsError(message="Cloumn args error: {}".format(str(e)))
+                head, _, values = compiled.sql.partition(" VALUES ")
+                prefix = f"{head} VALUES ".encode(encoding)
+                bind_names = _BIND_NAME_RE.findall(values)
+                row_keys = set(one_row)
+            elif one_row.keys() != row_keys:
+                raise FuncArgsError("insert rows must have the same columns!")
+
+            params = compiled.construct_params(one_row)
+            value = f"({','.join([literal(params[name]) for name in bind_names])})".encode(encoding)
+            # 分隔的逗号也要计算在内
+            if chunk and (len(prefix) + chunk_size + len(chunk) + len(value) > self._max_packet_size or
+                          len(chunk) == self._max_rows):
+                yield len(chunk), prefix + b",".join(chunk)
+                chunk, chunk_size = [], 0
+            chunk.append(value)
+            chunk_size += len(value)
+
+        if chunk:
+            yield len(chunk), prefix + b",".join(chunk)
+
+    @_generative
+    def update_query(self, update_data: Union[List[Dict], Dict], *, bulk_key: Optional[str] = None,
+                     chunk_size: int = DEFAULT_BULK_CHUNK_SIZE) -> 'Query':
         """
         update query
 
         eg: where(User.c.id == bindparam("id")).values({"name": bindparam("name")})
          await conn.execute(sql, [{"id": 1, "name": "t1"}, {"id": 2, "name": "t2"}]
+
+        指定bulk_key时多行数据合并为分块的CASE更新语句,不再逐行执行
+        eg: update_query([{"id": 1, "price": 10}, {"id": 2, "price": 12}], bulk_key="id")
+         UPDATE t SET price=CASE t.id WHEN 1 THEN 10 WHEN 2 THEN 12 ELSE t.price END WHERE t.id IN (1, 2)
         Args:
             update_data: 值类型Dict or List[Dict]
+            bulk_key: 批量更新时定位行的字段名,一般为主键,数据按照此字段排序后分块
+            chunk_size: 批量更新时每个分块的最大行数
         Returns:
             返回更新的条数
         """
         self._verify_model()
+        self._bulk_update_queries = None
+        if bulk_key is not None and not isinstance(update_data, MutableMapping):
+            try:
+                self._bulk_update_queries = list(gen_case_updates(
+                    self._model, update_data, bulk_key, chunk_size, self._whereclause,
+                    self._get_model_onupdate_value()))
+            except SQLAlchemyError as e:
+                aelog.exception(e)
+                raise QueryArgsError(message="Cloumn args error: {}".format(str(e)))
+            self._query_obj, self._update_data = None, update_data
+            return self
         try:
             update_data_: Union[List[Dict], Dict]
             if isinstance(update_data, MutableMapping):
@@ -388,7 +644,8 @@ class Query(BaseQuery):
                 values_data = update_data_ if not self._bind_values else {
                     key: val for key, val in update_data_.items() if key in self._bind_values}
             else:
-                update_data_ = [{**self._get_model_onupdate_value(), **one_data} for one_data in update_data]
+                model_meta = model_registry.get(self._model)
+                update_data_ = [{**model_meta.gen_onupdate_value(), **one_data} for one_data in update_data]
                 values_data = update_data_[0] if not self._bind_values else {
                     key: val for key, val in update_data_[0].items() if key in self._bind_values}
 
@@ -402,6 +659,7 @@ class Query(BaseQuery):
             self._query_obj, self._update_data = query, update_data_
             return self
 
+    @_generative
     def delete_query(self, ) -> 'Query':
         """
         delete query
@@ -421,6 +679,7 @@ class Query(BaseQuery):
             self._query_obj = query
             return self
 
+    @_generative
     def select_query(self, is_count: bool = False) -> 'Query':
         """
         select query
@@ -428,12 +687,26 @@ class Query(BaseQuery):
             is_count: 是否为数量查询
         Returns:
             返回匹配的数据或者None
+        """
+        return self._build_select(is_count)
+
+    def _build_select(self, is_count: bool = False) -> 'Query':
+        """
+        在当前查询上生成select语句
+        Args:
+            is_count: 是否为数量查询
+        Returns:
+
         """
         try:
             if is_count is False:
                 query = select([self._model] if not self._columns else self._columns)
                 # 以下的查询只有普通查询才有，和查询数量么有关系
-                if self._order_by:
+                if self._keyset_order is not None:
+                    query.append_order_by(*self._keyset_order.order_by(self._keyset_backward))
+                    if self._keyset_where is not None:
+                        query.append_whereclause(self._keyset_where)
+                elif self._order_by:
                     query.append_order_by(*self._order_by)
                 if self._columns:
                     query = query.with_only_columns(self._columns)
@@ -463,10 +736,35 @@ class Query(BaseQuery):
                 self._query_obj = query
             else:
                 self._query_count_obj = query
+                self._query_count_key = self._count_key()
             return self
 
+    def _count_key(self, ) -> Tuple[Any, ...]:
+        """
+        影响查询数量的model和条件
+        """
+        return self._model, self._whereclause, self._group_by, self._having, self._distinct, self._with_hint
+
+    def _count_query(self, ) -> Select:
+        """
+        查询数量的select语句
+
+        分页时只有需要总数时才生成,生成后缓存在查询上,翻页时的查询沿用,model和条件改变后重新生成
+        Args:
+
+        Returns:
+
+        """
+        count_key = self._count_key()
+        if self._query_count_obj is None or len(count_key) != len(self._query_count_key) or any(
+                current is not cached for current, cached in zip(count_key, self._query_count_key)):
+            self._build_select(is_count=True)
+        return self._query_count_obj
+
     # noinspection DuplicatedCode
-    def paginate_query(self, *, page: int = 1, per_page: int = 20, primary_order: bool = True) -> 'Query':
+    @_generative
+    def paginate_query(self, *, page: int = 1, per_page: int = 20, primary_order: bool = True,
+                       keyset: bool = False, cursor: Optional[str] = None) -> 'Query':
         """
         If ``page`` or ``per_page`` are ``None``, they will be retrieved from
         the request query. If there is no request or they aren't in the
@@ -474,10 +772,15 @@ class Query(BaseQuery):
 
         目前是改造如果limit传递为0，则返回所有的数据，这样业务代码中就不用更改了
 
+        keyset分页时按照游标中上一页边界行的排序字段值定位,生成 WHERE (k1, k2) > (:a, :b) ORDER BY k1, k2 LIMIT n,
+        不再使用OFFSET,page参数无效,翻页使用Pagination中的next_cursor和prev_cursor.
+
         Args:
             page: page is less than 1, or ``per_page`` is negative.
             per_page: page or per_page are not ints.
             primary_order: 默认启用主键ID排序的功能，在大数据查询时可以关闭此功能，在90%数据量不大的情况下可以加快分页的速度
+            keyset: 是否使用keyset分页,排序只支持字段以及字段的asc()、desc(),排序中没有主键时自动追加主键
+            cursor: keyset分页的游标,传入游标时自动使用keyset分页,不传时为第一页
 
             When ``error_out`` is ``False``, ``page`` and ``per_page`` default to
             1 and 20 respectively.
@@ -510,24 +813,66 @@ class Query(BaseQuery):
             # 如果业务层有排序了，则此处不再提供排序功能
             # 如果遇到大数据量的分页查询问题时，建议关闭此处，然后再基于已有的索引分页
             if not self._order_by and getattr(self._model, "id", None) is not None:
-                self.order_by(getattr(self._model, "id").asc())
+                self._order_by = [*self._order_by, getattr(self._model, "id").asc()]
 
         try:
+            if keyset is True or cursor is not None:
+                self._page = 1
+                self._set_keyset(per_page, cursor)
             # 如果per_page为0,则证明要获取所有的数据,这里最大返回1000条数据，否则还是通常的逻辑
-            if per_page != 0:
+            elif per_page != 0:
+                self._keyset_order, self._keyset_where, self._keyset_cursor = None, None, None
                 self._limit_clause = per_page
                 self._offset_clause = (page - 1) * per_page
             else:
+                self._keyset_order, self._keyset_where, self._keyset_cursor = None, None, None
                 self._limit_clause = 1000
 
-            self.select_query()  # 生成select SQL
-            self.select_query(is_count=True)  # 生成select count SQL
+            self._build_select()  # 生成select SQL,select count SQL在需要总数时生成
+            self._paginated = True
         except SQLAlchemyError as e:
             aelog.exception(e)
             raise QueryArgsError(message="Cloumn args error: {}".format(str(e)))
         else:
             return self
 
+    def _set_keyset(self, per_page: int, cursor: Optional[str]):
+        """
+        设置keyset分页的排序、定位条件和limit,多查询一行用来判断是否还有下一页
+        Args:
+            per_page: 每页的条数,为0时最多返回1000条
+            cursor: keyset分页的游标
+        Returns:
+
+        """
+        self._verify_model()
+        primary_keys = [getattr(self._model, key) for key in model_registry.get(self._model).primary_keys]
+        self._keyset_order = KeysetOrder(self._order_by, primary_keys)
+        if cursor is not None:
+            values, self._keyset_backward = self._keyset_order.decode_cursor(cursor)
+            self._keyset_where = self._keyset_order.where(values, self._keyset_backward)
+        else:
+            self._keyset_where, self._keyset_backward = None, False
+        self._keyset_cursor = cursor
+        self._limit_clause = (per_page or 1000) + 1
+        self._offset_clause = None
+
+    def prepare(self, is_count: bool = False) -> PreparedQuery:
+        """
+        生成预编译的查询模板
+
+        查询条件中需要变化的值使用bindparam命名,生成模板后每次执行只需要传入参数值,不再重复生成和编译select语句
+
+        eg: db.query.model(User).where(User.id == bindparam("id")).order_by(User.id).prepare()
+        Args:
+            is_count: 是否为数量查询
+        Returns:
+            PreparedQuery
+        """
+        self._verify_model()
+        query = self.select_query(is_count=is_count)
+        return PreparedQuery(query._model, query._query_obj if is_count is False else query._query_count_obj)
+
     def sql(self, ) -> Union[Dict[str, Union[str, Dict, List[Dict], None]],
                              List[Dict[str, Union[str, Dict, List[Dict], None]]]]:
         """
@@ -553,9 +898,9 @@ class Query(BaseQuery):
         result_sql: Union[Dict[str, Union[str, Dict, List[Dict], None]],
                           List[Dict[str, Union[str, Dict, List[Dict], None]]]] = {}
 
-        if self._query_obj is not None and self._query_count_obj is not None:
+        if self._query_obj is not None and (self._paginated or self._query_count_obj is not None):
             select_sql = self._compiled_quey(self._query_obj)
-            select_count_sql = self._compiled_quey(self._query_count_obj)
+            select_count_sql = self._compiled_quey(self._count_query())
             result_sql = [select_sql, select_count_sql]
         elif self._query_obj is not None and self._insert_data is not None:
             result_sql = self._compiled_quey(self._query_obj, self._insert_data)
@@ -8,26 +8,69 @@
 """
 import asyncio
 import atexit
+import inspect
+import os
+import time
 from math import ceil
-from typing import Any, Dict, List, MutableMapping, MutableSequence, Optional, Tuple, Union
+from operator import methodcaller
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, IO, Iterable, List, Mapping, MutableMapping,
+                    MutableSequence, Optional, Sequence, Tuple, Union)
 
 import aelog
+from aiomysql import Cursor, DictCursor, SSCursor
 from aiomysql.sa import Engine, SAConnection, create_engine
 from aiomysql.sa.exc import Error
-from aiomysql.sa.result import ResultProxy, RowProxy
+from aiomysql.sa.result import ResultProxy, RowProxy, create_result_proxy
 from pymysql.err import IntegrityError, MySQLError
+from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.sql import Delete, Insert, Select, Update
 from sqlalchemy.sql.elements import TextClause
 
 from fessql._alchemy import AlchemyMixIn
+from fessql._bulk import BatchWriter, DEFAULT_BULK_CHUNK_SIZE, parse_upsert_result
+from fessql._columnar import COLUMNAR_BATCH_SIZE, ColumnarBuilder
+from fessql._count import (COUNT_ESTIMATE, COUNT_EXACT, CountCache, DEFAULT_COUNT_THRESHOLD, gen_table_rows_sql,
+                           is_estimable, parse_explain_rows, parse_table_rows, verify_count_strategy)
 from fessql._err_msg import mysql_msg
+from fessql._export import EXPORT_CSV, ExportWriter
+from fessql._loaddata import BulkLoader, LoadDataFormat, is_local_infile_rejected
+from fessql._router import ShardRouter, ShardTarget, TimePartitionRouter
+from fessql._rows import CompactRow, ROW_COMPACT, ROW_PROXY, make_compact_rows, verify_row_format
+from fessql._shard import ShardAggregator, ShardMerger, shard_statement
 from fessql.err import DBDuplicateKeyError, DBError, FuncArgsError, HttpError
 from fessql.utils import _verify_message
-from .query import Query
+from ._compiled import CompiledCache, CompiledStatement
+from .query import PreparedQuery, Query, compiled_cache
 
 __all__ = ("SanicMySQL", "Pagination", "Session")
 
 
+async def _gather_limited(tasks: Sequence[Callable[[], Awaitable[Any]]], concurrency: int) -> List[Any]:
+    """
+    并发执行,最多concurrency个同时执行,某个失败后取消其他的并抛出异常
+    Args:
+        tasks: 返回awaitable的函数
+        concurrency: 同时执行的个数
+    Returns:
+        按照tasks顺序的结果
+    """
+    if concurrency < 1:
+        raise FuncArgsError("concurrency value error!")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(task: Callable[[], Awaitable[Any]]) -> Any:
+        async with semaphore:
+            return await task()
+
+    futures = [asyncio.ensure_future(run(task)) for task in tasks]
+    try:
+        return await asyncio.gather(*futures)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
 # noinspection PyProtectedMember
 class Pagination(object):
     """Internal helper class returned by :meth:`BaseQuery.paginate`.  You
@@ -37,7 +80,8 @@ class Pagination(object):
     no longer work.
     """
 
-    def __init__(self, db_client: 'SessionReader', query: Query, total: int, items: List[RowProxy]):
+    def __init__(self, db_client: 'SessionReader', query: Query, total: int, items: List[RowProxy],
+                 approximate: bool = False):
         #: the unlimited query object that was used to create this
         #: aiomysqlclient object.
         self.session: SessionReader = db_client
@@ -49,6 +93,16 @@ class Pagination(object):
         self.per_page: int = query._per_page
         #: the total number of items matching the query
         self.total: int = total
+        #: total是否为估算的总数
+        self.approximate: bool = approximate
+        #: 是否为keyset分页
+        self.keyset: bool = query._keyset_order is not None
+        #: keyset分页上一页和下一页的游标,没有上一页或者下一页时为None
+        self.prev_cursor: Optional[str] = None
+        self.next_cursor: Optional[str] = None
+        if query._keyset_order is not None:
+            items, self.prev_cursor, self.next_cursor = query._keyset_order.split_page(
+                items, query._limit_clause - 1, query._keyset_backward, query._keyset_cursor is not None)
         #: the items for the current page
         self.items: List[RowProxy] = items
 
@@ -61,59 +115,130 @@ class Pagination(object):
             pages = int(ceil(self.total / float(self.per_page)))
         return pages
 
+    async def _keyset_page(self, cursor: Optional[str], primary_order: bool) -> 'Pagination':
+        """
+        按照游标查询keyset分页,游标为None时证明没有这一页,直接返回空的分页
+        """
+        if cursor is None:
+            return Pagination(self.session, self._query, self.total, [], self.approximate)
+        query = self._query.copy().paginate_query(per_page=self.per_page, primary_order=primary_order, cursor=cursor)
+        items = await self.session._find_data(query)
+
+        return Pagination(self.session, query, self.total, items, self.approximate)
+
     async def prev(self, primary_order: bool = True) -> 'Pagination':
         """Returns a :class:`Pagination` object for the previous page."""
-        self._query.paginate_query(page=self.page - 1, per_page=self.per_page, primary_order=primary_order)
-        items = await self.session._find_data(self._query)
+        if self.keyset:
+            return await self._keyset_page(self.prev_cursor, primary_order)
+        query = self._query.copy().paginate_query(page=self.page - 1, per_page=self.per_page,
+                                                  primary_order=primary_order)
+        items = await self.session._find_data(query)
 
-        return Pagination(self.session, self._query, self.total, items)
+        return Pagination(self.session, query, self.total, items, self.approximate)
 
     @property
     def prev_num(self) -> Optional[int]:
         """Number of the previous page."""
-        if not self.has_prev:
+        if not self.has_prev or self.keyset:
             return None
         return self.page - 1
 
     @property
     def has_prev(self) -> bool:
         """True if a previous page exists"""
+        if self.keyset:
+            return self.prev_cursor is not None
         return self.page > 1
 
     async def next(self, primary_order: bool = True) -> 'Pagination':
         """Returns a :class:`Pagination` object for the next page."""
-        self._query.paginate_query(page=self.page + 1, per_page=self.per_page, primary_order=primary_order)
-        items = await self.session._find_data(self._query)
+        if self.keyset:
+            return await self._keyset_page(self.next_cursor, primary_order)
+        query = self._query.copy().paginate_query(page=self.page + 1, per_page=self.per_page,
+                                                  primary_order=primary_order)
+        items = await self.session._find_data(query)
 
-        return Pagination(self.session, self._query, self.total, items)
+        return Pagination(self.session, query, self.total, items, self.approximate)
 
     @property
     def has_next(self) -> bool:
         """True if a next page exists."""
+        if self.keyset:
+            return self.next_cursor is not None
         return self.page < self.pages
 
     @property
     def next_num(self) -> Optional[int]:
         """Number of the next page"""
-        if not self.has_next:
+        if not self.has_next or self.keyset:
             return None
         return self.page + 1
 
 
+# noinspection PyProtectedMember
 class BaseSession(object):
     """
     query session reader and writer
     """
 
-    def __init__(self, aio_engine: Engine, message: Dict[int, Dict[str, Any]], msg_zh: str):
+    def __init__(self, aio_engine: Engine, message: Dict[int, Dict[str, Any]], msg_zh: str,
+                 count_cache: Optional[CountCache] = None, bind: Optional[str] = None):
         """
             query session reader and writer
         Args:
-
+            count_cache: 分页总数的缓存
+            bind: session对应的bind,用于区分不同库中的同名表
         """
         self.aio_engine: Engine = aio_engine
         self.message: Dict[int, Dict[str, Any]] = message
         self.msg_zh: str = msg_zh
+        self.count_cache: CountCache = count_cache if count_cache is not None else CountCache()
+        self.bind: Optional[str] = bind
+
+    @staticmethod
+    async def _fetch_columnar(cursor: ResultProxy, size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        分批读取驱动返回的原始行并按列填充,不生成每行的RowProxy,读取完成后关闭游标
+        Args:
+            cursor: ResultProxy实例
+            size: 最多读取的行数,为None时读取所有
+        Returns:
+            {字段名: 字段数据},数值字段为array.array或者numpy数组,其他字段为列表
+        """
+        if not cursor.returns_rows:
+            return {}
+        builder = ColumnarBuilder(cursor.keys(), cursor._metadata._processors)
+        remaining = size
+        while remaining is None or remaining > 0:
+            rows = await cursor.cursor.fetchmany(
+                COLUMNAR_BATCH_SIZE if remaining is None else min(COLUMNAR_BATCH_SIZE, remaining))
+            if not rows:
+                break
+            builder.append(rows)
+            if remaining is not None:
+                remaining -= len(rows)
+        await cursor.close()
+        return builder.build()
+
+    @staticmethod
+    async def _execute_compiled(conn: SAConnection, compiled: CompiledStatement,
+                                params: Optional[Dict[str, Any]] = None) -> ResultProxy:
+        """
+        执行编译后的语句
+
+        和SAConnection.execute的逻辑一致,只是编译的结果从缓存中获取,相同结构的语句不再重复编译
+        Args:
+            conn: SAConnection
+            compiled: 编译后的语句
+            params: 执行的参数值
+        Returns:
+            ResultProxy实例
+        """
+        cursor = await conn.connection.cursor()
+        await cursor.execute(compiled.sql, compiled.construct_params(params))
+        result = await create_result_proxy(conn, cursor, conn._dialect, compiled.result_map)
+        conn._weak_results.add(result)
+        return result
 
 
 # noinspection PyProtectedMember
@@ -122,7 +247,8 @@ class SessionReader(BaseSession):
     query session reader
     """
 
-    async def _query_execute(self, query: Union[Select, str], params: Optional[Dict[str, Any]] = None) -> ResultProxy:
+    async def _query_execute(self, query: Union[Select, CompiledStatement, str],
+                             params: Optional[Dict[str, Any]] = None) -> ResultProxy:
         """
         查询数据
 
@@ -133,7 +259,7 @@ class SessionReader(BaseSession):
         self.autocommit = True
 
         Args:
-            query: SQL的查询字符串或者sqlalchemy表达式
+            query: SQL的查询字符串、sqlalchemy表达式或者编译后的语句
             params: 执行的参数值,
         Returns:
             不确定执行的是什么查询，直接返回ResultProxy实例
@@ -142,7 +268,12 @@ class SessionReader(BaseSession):
         async with conn as conn:
             await conn.connection.autocommit(True)
             try:
-                cursor = await conn.execute(query, params or {})
+                if isinstance(query, CompiledStatement):
+                    cursor = await self._execute_compiled(conn, query, params)
+                elif isinstance(query, (Select, TextClause)):
+                    cursor = await self._execute_compiled(conn, compiled_cache.compile(query), params)
+                else:
+                    cursor = await conn.execute(query, params or {})
             except (MySQLError, Error) as e:
                 aelog.exception("Find data failed, {}".format(e))
                 raise HttpError(400, message=self.message[4][self.msg_zh])
@@ -152,19 +283,44 @@ class SessionReader(BaseSession):
 
         return cursor
 
-    async def _find_data(self, query: Query) -> List[RowProxy]:
+    async def _find_data(self, query: Query, columnar: bool = False, row_format: str = ROW_PROXY
+                         ) -> Union[List[RowProxy], List[CompactRow], Dict[str, Any]]:
         """
         查询单条数据
         Args:
             query: Query 查询类
+            columnar: 是否按列返回
+            row_format: 行格式
         Returns:
             返回匹配的数据或者None
         """
         cursor = await self._query_execute(query._query_obj)
-        return await cursor.fetchall() if cursor.returns_rows else []
+        return await self._fetch_all(cursor, columnar, row_format)
+
+    async def _fetch_all(self, cursor: ResultProxy, columnar: bool = False, row_format: str = ROW_PROXY
+                         ) -> Union[List[RowProxy], List[CompactRow], Dict[str, Any]]:
+        """
+        按照返回格式读取所有的数据
+        Args:
+            cursor: ResultProxy实例
+            columnar: 是否按列返回
+            row_format: 行格式
+        Returns:
+
+        """
+        if columnar:
+            return await self._fetch_columnar(cursor)
+        if not cursor.returns_rows:
+            return []
+        if row_format == ROW_COMPACT:
+            rows = make_compact_rows(cursor.keys(), cursor._metadata._processors, await cursor.cursor.fetchall())
+            await cursor.close()
+            return rows
+        return await cursor.fetchall()
 
     async def query_execute(self, query: Union[TextClause, str], params: Optional[Dict[str, Any]] = None,
-                            size=None, cursor_close=True) -> Union[List[RowProxy], RowProxy, None]:
+                            size=None, cursor_close=True, *, columnar: bool = False
+                            ) -> Union[List[RowProxy], RowProxy, Dict[str, Any], None]:
         """
         查询数据，用于复杂的查询
         Args:
@@ -173,12 +329,16 @@ class SessionReader(BaseSession):
             params: SQL表达式中的参数
             size: 查询数据大小, 默认返回所有
             cursor_close: 是否关闭游标，默认关闭，如果多次读取可以改为false，后面关闭的行为交给sqlalchemy处理
+            columnar: 是否按列返回{字段名: 字段数据},数值字段为array.array或者numpy数组,其他字段为列表,
+                      size为最多读取的行数,读取后游标总是关闭
 
         Returns:
             List[RowProxy] or RowProxy or None
         """
         params = params if isinstance(params, MutableMapping) else {}
         cursor = await self._query_execute(query, params)
+        if columnar:
+            return await self._fetch_columnar(cursor, size)
 
         if size is None:
             resp = await cursor.fetchall() if cursor.returns_rows else []
@@ -192,56 +352,278 @@ class SessionReader(BaseSession):
 
         return resp
 
-    async def find_one(self, query: Query) -> Optional[RowProxy]:
+    async def find_one(self, query: Union[Query, PreparedQuery], params: Optional[Dict[str, Any]] = None
+                       ) -> Optional[RowProxy]:
         """
         查询单条数据
         Args:
-            query: Query 查询类
+            query: Query 查询类或者PreparedQuery查询模板
+            params: 查询模板中bindparam的参数值
         Returns:
             返回匹配的数据或者None
         """
-        if not isinstance(query, Query):
+        if isinstance(query, PreparedQuery):
+            cursor = await self._query_execute(query._compiled, params)
+        elif isinstance(query, Query):
+            cursor = await self._query_execute(query._query_obj)
+        else:
             raise FuncArgsError("query type error!")
 
-        cursor = await self._query_execute(query._query_obj)
         return await cursor.first() if cursor.returns_rows else None
 
-    async def find_many(self, query: Optional[Query] = None) -> Pagination:
+    async def _estimate_count(self, query: Select) -> Optional[int]:
+        """
+        估算查询的总数
+
+        没有查询条件时使用information_schema.TABLES中的TABLE_ROWS,否则使用EXPLAIN中的rows估算
+        Args:
+            query: 查询数量的select
+        Returns:
+            估算的总数,无法估算时为None
+        """
+        estimable, table = is_estimable(query)
+        if not estimable:
+            return None
+        if table is not None:
+            (sql, params), parse_rows = gen_table_rows_sql(table), parse_table_rows
+        else:
+            compiled = compiled_cache.compile(query)
+            sql, params, parse_rows = f"EXPLAIN {compiled.sql}", compiled.construct_params(), parse_explain_rows
+
+        conn: SAConnection = self.aio_engine.acquire()
+        async with conn as conn:
+            await conn.connection.autocommit(True)
+            try:
+                cursor = await conn.connection.cursor(DictCursor)
+                try:
+                    await cursor.execute(sql, params)
+                    rows = await cursor.fetchall()
+                finally:
+                    await cursor.close()
+            except (MySQLError, Error) as e:
+                # 估算失败时使用精确统计
+                aelog.exception("Estimate count failed, {}".format(e))
+                return None
+        return parse_rows(rows)
+
+    async def _count_total(self, query: Query, count_strategy: str, count_threshold: int) -> Tuple[int, bool]:
+        """
+        按照统计策略获取分页的总数
+        Args:
+            query: Query 查询类
+            count_strategy: 统计策略
+            count_threshold: auto策略时的阈值
+        Returns:
+            (总数, 是否为估算的总数)
+        """
+        if not self.count_cache.enabled:
+            return await self._query_total(query, count_strategy, count_threshold)
+
+        # 相同的model和查询条件生成的SQL以及参数相同,作为缓存的key
+        count_obj = query._count_query()
+        compiled = compiled_cache.compile(count_obj)
+        cache_key = self.count_cache.gen_key(compiled.sql, compiled.construct_params(), count_strategy,
+                                             count_threshold)
+        # 版本号在查询之前获取,查询期间的写入使这次查询的总数不会命中
+        versions = self.count_cache.versions(self.bind, self.count_cache.statement_tables(count_obj))
+        total = self.count_cache.get(self.bind, cache_key, versions)
+        if total is None:
+            total = await self._query_total(query, count_strategy, count_threshold)
+            self.count_cache.set(self.bind, cache_key, versions, total)
+        return total
+
+    async def _query_total(self, query: Query, count_strategy: str, count_threshold: int) -> Tuple[int, bool]:
+        """
+        从数据库中查询分页的总数
+        Args:
+            query: Query 查询类
+            count_strategy: 统计策略
+            count_threshold: auto策略时的阈值
+        Returns:
+            (总数, 是否为估算的总数)
+        """
+        if count_strategy != COUNT_EXACT:
+            estimate = await self._estimate_count(query._count_query())
+            if estimate is not None and (count_strategy == COUNT_ESTIMATE or estimate >= count_threshold):
+                return estimate, True
+        total_result = await self.find_count(query)
+        return total_result.count, False
+
+    async def find_many(self, query: Optional[Query] = None, *, count_strategy: str = COUNT_EXACT,
+                        count_threshold: int = DEFAULT_COUNT_THRESHOLD) -> Pagination:
         """
         查询多条数据,分页数据
         Args:
             query: Query 查询类
+            count_strategy: 总数的统计策略,exact精确统计;estimate估算总数;auto估算的总数小于count_threshold时精确统计,
+                            否则使用估算的总数;无法估算时都是精确统计
+            count_threshold: auto策略时的阈值
         Returns:
             Returns a :class:`Pagination` object.
         """
 
         if not isinstance(query, Query):
             raise FuncArgsError("query type error!")
+        verify_count_strategy(count_strategy)
 
         items = await self._find_data(query)
 
         # No need to count if we're on the first page and there are fewer
         # items than we expected.
-        if query._page == 1 and len(items) < query._per_page:
+        approximate = False
+        if query._page == 1 and query._keyset_cursor is None and len(items) < query._per_page:
             total = len(items)
         else:
-            total_result = await self.find_count(query)
-            total = total_result.count
+            total, approximate = await self._count_total(query, count_strategy, count_threshold)
 
-        return Pagination(self, query, total, items)
+        return Pagination(self, query, total, items, approximate)
 
-    async def find_all(self, query: Query) -> List[RowProxy]:
+    async def find_all(self, query: Union[Query, PreparedQuery], params: Optional[Dict[str, Any]] = None, *,
+                       columnar: bool = False, row_format: str = ROW_PROXY
+                       ) -> Union[List[RowProxy], List[CompactRow], Dict[str, Any]]:
         """
-        插入数据
+        查询所有数据
+
+        columnar为True时按列返回,分批读取后直接填充到每个字段的数组中,不生成每行的RowProxy,适用于统计报表等需要按列计算的查询,
+        eg: result = await db.session.find_all(query, columnar=True)
+            sum(result["amount"])
+        row_format为compact时返回紧凑行,同一个查询的行共用字段名到下标的映射,适用于缓存或者批处理大量的行,
+        eg: rows = await db.session.find_all(query, row_format="compact")
+            rows[0].name, rows[0]["name"], dict(rows[0])
         Args:
-            query: Query 查询类
+            query: Query 查询类或者PreparedQuery查询模板
+            params: 查询模板中bindparam的参数值
+            columnar: 是否按列返回{字段名: 字段数据},数值字段为array.array或者numpy数组,其他字段为列表
+            row_format: 行格式,proxy返回RowProxy;compact返回CompactRow
         Returns:
 
         """
+        verify_row_format(row_format)
+        if isinstance(query, PreparedQuery):
+            cursor = await self._query_execute(query._compiled, params)
+            return await self._fetch_all(cursor, columnar, row_format)
         if not isinstance(query, Query):
             raise FuncArgsError("query type error!")
 
-        return await self._find_data(query)
+        return await self._find_data(query, columnar, row_format)
+
+    async def stream(self, query: Union[Query, PreparedQuery, Select, TextClause, str],
+                     params: Optional[Dict[str, Any]] = None, *, batch_size: int = 1000) -> AsyncIterator[RowProxy]:
+        """
+        流式查询数据
+
+        使用服务端游标(SSCursor)每次从服务端读取batch_size行,不缓存整个结果集,内存占用和结果集的大小无关,适用于导出等大结果集.
+        迭代期间独占一个连接,迭代完成后归还连接池;中途退出或者被取消时直接关闭连接,不再读取剩余的数据.
+        中途break时迭代器在回收时才关闭,可以调用aclose()立即关闭,eg:
+            rows = db.session.stream(db.query.model(User).select_query(), batch_size=2000)
+            try:
+                async for row in rows:
+                    ...
+            finally:
+                await rows.aclose()
+        Args:
+            query: Query查询类、PreparedQuery查询模板、sqlalchemy表达式或者SQL字符串
+            params: 查询模板、sqlalchemy表达式或者SQL字符串中的参数值
+            batch_size: 每次从服务端读取的行数
+        Returns:
+            异步迭代器,每次返回一行RowProxy
+        """
+        if not isinstance(batch_size, int) or batch_size <= 0:
+            raise FuncArgsError("batch_size must be a positive integer!")
+        if isinstance(query, PreparedQuery):
+            compiled = query._compiled
+        elif isinstance(query, Query):
+            compiled = compiled_cache.compile(query._query_obj)
+        elif isinstance(query, (Select, TextClause)):
+            compiled = compiled_cache.compile(query)
+        elif isinstance(query, str):
+            compiled = None
+        else:
+            raise FuncArgsError("query type error!")
+
+        result: Optional[ResultProxy] = None
+        finished = False
+        async with self.aio_engine.acquire() as conn:
+            try:
+                await conn.connection.autocommit(True)
+                cursor = await conn.connection.cursor(SSCursor)
+                if compiled is None:
+                    await cursor.execute(query, params or None)
+                    result = await create_result_proxy(conn, cursor, conn._dialect, None)
+                else:
+                    await cursor.execute(compiled.sql, compiled.construct_params(params))
+                    result = await create_result_proxy(conn, cursor, conn._dialect, compiled.result_map)
+                while result.returns_rows:
+                    rows = await result.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+                finished = True
+            except (MySQLError, Error) as e:
+                aelog.exception("Find data failed, {}".format(e))
+                raise HttpError(400, message=self.message[4][self.msg_zh])
+            finally:
+                if finished:
+                    await result.close()
+                else:
+                    # 未读取完的服务端游标关闭时需要读取剩余的数据,所以直接关闭连接,连接池不会再使用关闭的连接
+                    conn.connection.close()
+
+    async def export(self, query: Union[Query, PreparedQuery, Select, TextClause, str], sink: Union[str, IO], *,
+                     params: Optional[Dict[str, Any]] = None, export_format: str = EXPORT_CSV, batch_size: int = 1000,
+                     header: bool = True, encoding: str = "utf-8", csv_options: Optional[Dict[str, Any]] = None,
+                     progress: Optional[Callable[[Dict[str, float]], Any]] = None) -> Dict[str, float]:
+        """
+        流式导出查询结果为CSV或者NDJSON
+
+        通过stream分批读取,每批在线程池中编码并写入,编码写入的同时读取下一批,内存中最多只有两批数据.
+        没有数据时不写入CSV的表头.
+        eg: stats = await db.session.export(db.query.model(User).select_query(), "/tmp/users.csv")
+        Args:
+            query: Query查询类、PreparedQuery查询模板、sqlalchemy表达式或者SQL字符串
+            sink: 文件路径或者有write方法的类文件对象,文本文件写入str,其他写入bytes
+            params: 查询模板、sqlalchemy表达式或者SQL字符串中的参数值
+            export_format: 导出格式,csv或者ndjson
+            batch_size: 每批读取和写入的行数
+            header: CSV是否写入表头
+            encoding: 编码
+            csv_options: csv.writer的参数,比如delimiter、quoting
+            progress: 每批写入后的回调,参数为当前的统计信息,可以是协程函数
+        Returns:
+            {"rows": 行数, "bytes": 字节数, "elapsed": 耗时秒数, "rows_per_second": 每秒行数,
+             "bytes_per_second": 每秒字节数}
+        """
+        writer = ExportWriter(sink, export_format, header=header, encoding=encoding,
+                              row_values=methodcaller("as_tuple"), csv_options=csv_options, progress=progress)
+        loop = asyncio.get_event_loop()
+        rows = self.stream(query, params, batch_size=batch_size)
+        pending: Optional[asyncio.Future] = None
+
+        async def wait_pending():
+            progress_result = await pending
+            if inspect.isawaitable(progress_result):
+                await progress_result
+
+        try:
+            batch: List[RowProxy] = []
+            async for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    if pending is not None:
+                        await wait_pending()
+                    pending, batch = loop.run_in_executor(None, writer.write_rows, batch), []
+            if pending is not None:
+                await wait_pending()
+            pending = loop.run_in_executor(None, writer.write_rows, batch)
+            await wait_pending()
+        finally:
+            # 出错时等待正在写入的一批完成后再关闭文件
+            if pending is not None and not pending.done():
+                await asyncio.wait([pending])
+            await rows.aclose()
+            stats = writer.close()
+        return stats
 
     async def find_count(self, query: Query) -> RowProxy:
         """
@@ -254,7 +636,7 @@ class SessionReader(BaseSession):
         if not isinstance(query, Query):
             raise FuncArgsError("query type error!")
 
-        cursor = await self._query_execute(query._query_count_obj)
+        cursor = await self._query_execute(query._count_query())
         return await cursor.first()
 
 
@@ -264,12 +646,29 @@ class SessionWriter(BaseSession):
     query session writer
     """
 
-    async def _execute(self, query: Union[Insert, Update, str], params: Union[List[Dict], Dict], msg_code: int
-                       ) -> ResultProxy:
+    @staticmethod
+    async def _execute_literal(conn: SAConnection, query: bytes) -> Cursor:
+        """
+        执行已经转义好参数值的语句
+        Args:
+            conn: SAConnection
+            query: 编码后的SQL语句,不再做参数替换
+        Returns:
+            执行后已经关闭的游标
+        """
+        cursor = await conn.connection.cursor()
+        try:
+            await cursor.execute(query)
+        finally:
+            await cursor.close()
+        return cursor
+
+    async def _execute(self, query: Union[Insert, Update, str, bytes], params: Union[List[Dict], Dict],
+                       msg_code: int) -> Union[ResultProxy, Cursor]:
         """
         插入数据，更新或者删除数据
         Args:
-            query: SQL的查询字符串或者sqlalchemy表达式
+            query: SQL的查询字符串、sqlalchemy表达式或者转义好参数值的SQL语句
             params: 执行的参数值,可以是单个对象的字典也可以是多个对象的列表
             msg_code: 消息提示编码
         Returns:
@@ -280,7 +679,10 @@ class SessionWriter(BaseSession):
             await conn.connection.autocommit(False)
             async with conn.begin() as trans:
                 try:
-                    cursor = await conn.execute(query, params)
+                    if isinstance(query, bytes):
+                        cursor = await self._execute_literal(conn, query)
+                    else:
+                        cursor = await conn.execute(query, params)
                 except IntegrityError as e:
                     await trans.rollback()
                     aelog.exception(e)
@@ -297,6 +699,8 @@ class SessionWriter(BaseSession):
                     aelog.exception(e)
                     raise HttpError(400, message=self.message[msg_code][self.msg_zh])
 
+        # 提交后写入表的分页总数缓存失效
+        self.count_cache.invalidate_write(self.bind, query)
         return cursor
 
     async def _delete_execute(self, query: Union[Delete, str]) -> int:
@@ -322,6 +726,7 @@ class SessionWriter(BaseSession):
                     aelog.exception(e)
                     raise HttpError(400, message=self.message[3][self.msg_zh])
 
+        self.count_cache.invalidate_write(self.bind, query)
         return cursor.rowcount
 
     async def execute(self, query: Union[TextClause, str], params: Union[List[Dict], Dict]) -> int:
@@ -371,6 +776,160 @@ class SessionWriter(BaseSession):
         cursor = await self._execute(query._query_obj, query._insert_data, 1)
         return cursor.rowcount
 
+    async def insert_batch(self, query: Query, concurrency: int = 2) -> int:
+        """
+        批量插入数据,多行VALUES分块插入
+
+        数据按照query中的max_packet_size分块生成多行INSERT语句,每个分块在单独的事务中执行,最多concurrency个分块同时执行,
+        待执行的分块达到concurrency个时暂停读取数据,所以异步迭代器的数据不会全部加载到内存中.
+        某个分块失败后不再执行后续的分块并抛出异常,已经提交的分块不会回滚.
+
+        eg: await db.session.insert_batch(db.query.model(User).insert_batch_query(read_rows()), concurrency=4)
+        Args:
+            query: Query 查询类,由insert_batch_query生成
+            concurrency: 同时执行的分块数
+        Returns:
+            插入的条数
+        """
+        if not isinstance(query, Query):
+            raise FuncArgsError("query type error!")
+        if query._insert_rows is None:
+            raise FuncArgsError("query insert rows type error!")
+        if concurrency < 1:
+            raise FuncArgsError("concurrency value error!")
+
+        # 同一个连接池的字符集和sql_mode相同,转义函数只依赖这两者
+        async with self.aio_engine.acquire() as conn:
+            literal, encoding = conn.connection.escape, conn.connection.encoding
+
+        chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+        rowcounts: List[int] = []
+        errors: List[Exception] = []
+
+        async def insert_worker():
+            """
+            执行分块,出错后继续取出剩余的分块但不再执行,防止生产者阻塞
+            """
+            while True:
+                statement = await chunk_queue.get()
+                if statement is None:
+                    break
+                if errors:
+                    continue
+                try:
+                    cursor = await self._execute(statement, {}, 1)
+                except Exception as e:
+                    errors.append(e)
+                else:
+                    rowcounts.append(cursor.rowcount)
+
+        workers = [asyncio.ensure_future(insert_worker()) for _ in range(concurrency)]
+        try:
+            async for _, statement in query._gen_insert_chunks(literal, encoding):
+                if errors:
+                    break
+                await chunk_queue.put(statement)
+            for _ in workers:
+                await chunk_queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            raise
+
+        if errors:
+            raise errors[0]
+        return sum(rowcounts)
+
+    async def upsert_many(self, query: Query) -> Tuple[int, int]:
+        """
+        批量插入或更新数据
+
+        每个分块在单独的事务中执行,某个分块失败后抛出异常,已经提交的分块不会回滚.
+        eg: await db.session.upsert_many(db.query.model(User).upsert_query(rows, update_columns=["name"]))
+        Args:
+            query: Query 查询类,由upsert_query生成
+        Returns:
+            (插入的条数, 重复后更新的条数)
+        """
+        if not isinstance(query, Query):
+            raise FuncArgsError("query type error!")
+
+        inserted = updated = 0
+        for row_count, upsert_query in query._upsert_queries:
+            cursor = await self._execute(upsert_query, {}, 1)
+            # 多行INSERT的info中有重复的行数
+            result = getattr(getattr(cursor, "_cursor", cursor), "_result", None)
+            chunk_inserted, chunk_updated = parse_upsert_result(
+                row_count, cursor.rowcount, getattr(result, "message", None))
+            inserted, updated = inserted + chunk_inserted, updated + chunk_updated
+        return inserted, updated
+
+    async def load_data(self, table_name: str, source: Union[str, os.PathLike, Iterable[Any]], *,
+                        columns: Union[Sequence[str], Mapping[Any, str], None] = None, fields_terminated: str = "\t",
+                        lines_terminated: str = "\n", escaped_by: str = "\\",
+                        chunk_size: int = DEFAULT_BULK_CHUNK_SIZE) -> Tuple[int, int]:
+        """
+        使用 LOAD DATA LOCAL INFILE 批量导入数据,所有数据在同一个事务中
+
+        需要 SanicMySQL(..., local_infile=True) 开启客户端的local_infile,服务端也需要开启local_infile.
+        数据行编码后通过命名管道流式发送,不写入临时文件;没有开启或者服务端拒绝时,改为分块执行多行的
+        INSERT IGNORE ... VALUES.重复键的行会被忽略并产生警告.
+        eg: await db.session.load_data("traffic", rows, columns=["IMEI", "count"])
+        Args:
+            table_name: 表名,可以为 库名.表名
+            source: 已经存在的文件路径,或者数据行的可迭代对象,行为字典或者字段值的序列
+            columns: 导入的字段,字段名列表或者{行中的字段名或者下标: 表的字段名},为None时使用第一行字典的字段名,
+                序列行和文件按位置导入表的所有字段
+            fields_terminated: 字段分隔符
+            lines_terminated: 行分隔符
+            escaped_by: 转义字符
+            chunk_size: 改为INSERT时每个分块的最大行数
+        Returns:
+            (导入的条数, 警告的条数)
+        """
+        data_format = LoadDataFormat(fields_terminated, lines_terminated, escaped_by)
+        loader = BulkLoader(table_name, source, columns, data_format, chunk_size)
+        if loader.empty:
+            return 0, 0
+
+        loaded = warnings = 0
+        conn: SAConnection = self.aio_engine.acquire()
+        async with conn as conn:
+            await conn.connection.autocommit(False)
+            async with conn.begin() as trans:
+                cursor: Cursor = await conn.connection.cursor()
+                try:
+                    loaded_local = False
+                    if loader.can_load_local(conn.connection):
+                        with loader.local_file() as path:
+                            try:
+                                loaded = await cursor.execute(loader.load_sql(path))
+                                loaded_local = True
+                            except MySQLError as e:
+                                if not is_local_infile_rejected(e):
+                                    raise
+                                aelog.warning(f"LOAD DATA LOCAL INFILE is rejected, use INSERT instead: {e}")
+                    if loaded_local:
+                        warnings = cursor._result.warning_count
+                    else:
+                        for _, sql, args in loader.insert_sql():
+                            loaded += await cursor.execute(sql, args)
+                            warnings += cursor._result.warning_count
+                except (MySQLError, Error) as e:
+                    await trans.rollback()
+                    aelog.exception(e)
+                    raise DBError(e)
+                except Exception as e:
+                    await trans.rollback()
+                    aelog.exception(e)
+                    raise HttpError(400, message=self.message[1][self.msg_zh])
+                finally:
+                    await cursor.close()
+
+        self.count_cache.invalidate_write(self.bind, tables=[loader.table_name.split(".")[-1]])
+        return loaded, warnings
+
     async def insert_from_select(self, query: Query) -> Tuple[int, str]:
         """
         查询并且插入数据, ``INSERT...FROM SELECT`` statement.
@@ -389,34 +948,102 @@ class SessionWriter(BaseSession):
         cursor = await self._execute(query._query_obj, {}, 1)
         return cursor.rowcount, cursor.lastrowid
 
-    async def update_data(self, query: Query) -> int:
+    async def _batch_write(self, writer: BatchWriter, msg_code: int) -> int:
+        """
+        分批删除或者更新,每批在单独的事务中执行,某一批失败后已经提交的批次不会回滚
+        Args:
+            writer: BatchWriter
+            msg_code: 消息提示编码
+        Returns:
+            累计删除或者更新的条数
+        """
+        while True:
+            start_time = time.monotonic()
+            # noinspection PyUnresolvedReferences
+            cursor = await self._query_execute(writer.select_query())
+            keys = await cursor.fetchall() if cursor.returns_rows else []
+            if not keys:
+                break
+            write_query = writer.write_query(keys)
+            if writer.values is None:
+                rowcount = await self._delete_execute(write_query)
+            else:
+                rowcount = (await self._execute(write_query, {}, msg_code)).rowcount
+            progress_result, delay = writer.finish_batch(rowcount, time.monotonic() - start_time)
+            if inspect.isawaitable(progress_result):
+                await progress_result
+            if len(keys) < writer.batch_size:
+                break
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return writer.rowcount
+
+    async def update_data(self, query: Query, *, batch_size: int = 0, pause: float = 0,
+                          max_rows_per_second: float = 0, progress: Optional[Callable[[int, int], Any]] = None
+                          ) -> int:
         """
         更新数据
 
         eg: where(User.c.id == bindparam("id")).values({"name": bindparam("name")})
          await conn.execute(sql, [{"id": 1, "name": "t1"}, {"id": 2, "name": "t2"}]
+
+        query由update_query(rows, bulk_key="id")生成时按照分块执行CASE更新语句
+
+        batch_size大于0时按照主键分批更新,每批在单独的事务中执行,只支持update_query(dict)生成的query
+        eg: await db.session.update_data(db.query.model(User).where(User.status == 0).update_query({"status": 1}),
+                                         batch_size=1000, max_rows_per_second=5000)
         Args:
             query: Query 查询类
+            batch_size: 分批更新时每批的最大行数,默认0一次更新
+            pause: 分批更新时每批之间暂停的秒数
+            max_rows_per_second: 分批更新时每秒最多更新的行数,默认0不限制
+            progress: 分批更新时每批执行后的回调,参数为(累计更新的行数, 本批更新的行数),可以是协程函数
         Returns:
-            返回更新的条数
+            返回更新的条数(MySQL默认返回值发生变化的条数)
         """
         if not isinstance(query, Query):
             raise FuncArgsError("query type error!")
 
+        if query._bulk_update_queries is not None:
+            # 批量更新的每个分块在单独的事务中执行,某个分块失败后已经提交的分块不会回滚
+            rowcount = 0
+            for bulk_query in query._bulk_update_queries:
+                cursor = await self._execute(bulk_query, {}, 2)
+                rowcount += cursor.rowcount
+            return rowcount
+        if batch_size > 0:
+            if not isinstance(query._update_data, MutableMapping):
+                raise FuncArgsError("batch update only supports dict update data!")
+            return await self._batch_write(BatchWriter(
+                query._model, query._whereclause, query._update_data, batch_size, pause, max_rows_per_second,
+                progress), 2)
         cursor = await self._execute(query._query_obj, query._update_data, 2)
         return cursor.rowcount
 
-    async def delete_data(self, query: Query) -> int:
+    async def delete_data(self, query: Query, *, batch_size: int = 0, pause: float = 0,
+                          max_rows_per_second: float = 0, progress: Optional[Callable[[int, int], Any]] = None
+                          ) -> int:
         """
         删除数据
+
+        batch_size大于0时按照主键分批删除,每批在单独的事务中执行,直到没有匹配的行
+        eg: await db.session.delete_data(db.query.model(Log).where(Log.created_time < expire_time).delete_query(),
+                                         batch_size=1000, pause=0.1)
         Args:
             query: Query 查询类
+            batch_size: 分批删除时每批的最大行数,默认0一次删除
+            pause: 分批删除时每批之间暂停的秒数
+            max_rows_per_second: 分批删除时每秒最多删除的行数,默认0不限制
+            progress: 分批删除时每批执行后的回调,参数为(累计删除的行数, 本批删除的行数),可以是协程函数
         Returns:
             返回删除的条数
         """
         if not isinstance(query, Query):
             raise FuncArgsError("query type error!")
 
+        if batch_size > 0:
+            return await self._batch_write(BatchWriter(
+                query._model, query._whereclause, None, batch_size, pause, max_rows_per_second, progress), 3)
         return await self._delete_execute(query._query_obj)
 
 
@@ -425,13 +1052,15 @@ class Session(SessionReader, SessionWriter):
     query session reader and writer
     """
 
-    def __init__(self, aio_engine: Engine, message: Dict[int, Dict[str, Any]], msg_zh: str):
+    def __init__(self, aio_engine: Engine, message: Dict[int, Dict[str, Any]], msg_zh: str,
+                 count_cache: Optional[CountCache] = None, bind: Optional[str] = None):
         """
             query session reader and writer
         Args:
-
+            count_cache: 分页总数的缓存
+            bind: session对应的bind,用于区分不同库中的同名表
         """
-        super().__init__(aio_engine, message, msg_zh)
+        super().__init__(aio_engine, message, msg_zh, count_cache, bind)
 
 
 class SanicMySQL(AlchemyMixIn, object):
@@ -454,6 +1083,10 @@ class SanicMySQL(AlchemyMixIn, object):
             dbname: database name
             pool_size: mysql pool size
             pool_recycle: pool recycle time, type int
+            compiled_cache_size: 编译SQL缓存的最大条数
+            count_cache_ttl: 分页总数缓存的过期时间,单位秒,默认0不缓存
+            count_cache_size: 分页总数缓存的最大条数
+            count_cache_invalidate: 写入表后是否使表的分页总数缓存失效,默认True
             init_command: 初始执行的SQL
             connect_timeout: 连接超时时间
             autocommit: 是否自动commit,默认false
@@ -478,6 +1111,13 @@ class SanicMySQL(AlchemyMixIn, object):
         # other info
         self.pool_recycle: int = kwargs.pop("pool_recycle", 3600)  # free close time
         self.charset: str = "utf8mb4"
+        # 编译SQL缓存,所有的Query共用,可以通过compiled_cache.stats()查看命中情况
+        self.compiled_cache: CompiledCache = compiled_cache
+        self.compiled_cache_size: int = kwargs.pop("compiled_cache_size", compiled_cache.max_size)
+        # 分页总数缓存,所有的session共用,可以通过count_cache.stats()查看命中情况
+        self.count_cache: CountCache = CountCache(kwargs.pop("count_cache_ttl", 0),
+                                                  kwargs.pop("count_cache_size", 1024),
+                                                  kwargs.pop("count_cache_invalidate", True))
         self.fessql_binds: Dict[str, Dict[str, Any]] = {}  # kwargs.pop("fessql_binds", {})  # binds config
         self.message = kwargs.pop("message", {})
         self.use_zh = kwargs.pop("use_zh", True)
@@ -507,6 +1147,11 @@ class SanicMySQL(AlchemyMixIn, object):
         self.pool_size = app.config.get("FESSQL_MYSQL_POOL_SIZE", None) or self.pool_size
 
         self.pool_recycle = app.config.get("FESSQL_POOL_RECYCLE", None) or self.pool_recycle
+        self.compiled_cache_size = app.config.get("FESSQL_COMPILED_CACHE_SIZE", None) or self.compiled_cache_size
+        self._resize_compiled_cache()
+        self._config_count_cache(app.config.get("FESSQL_COUNT_CACHE_TTL", None),
+                                 app.config.get("FESSQL_COUNT_CACHE_SIZE", None),
+                                 app.config.get("FESSQL_COUNT_CACHE_INVALIDATE", None))
 
         message = app.config.get("FESSQL_MYSQL_MESSAGE", None) or self.message
         use_zh = app.config.get("FESSQL_MYSQL_MSGZH", None) or self.use_zh
@@ -573,6 +1218,10 @@ class SanicMySQL(AlchemyMixIn, object):
         self.pool_size = pool_size or self.pool_size
 
         self.pool_recycle = kwargs.pop("pool_recycle", None) or self.pool_recycle
+        self.compiled_cache_size = kwargs.pop("compiled_cache_size", None) or self.compiled_cache_size
+        self._resize_compiled_cache()
+        self._config_count_cache(kwargs.pop("count_cache_ttl", None), kwargs.pop("count_cache_size", None),
+                                 kwargs.pop("count_cache_invalidate", None))
 
         message = kwargs.pop("message", None) or self.message
         use_zh = kwargs.pop("use_zh", None) or self.use_zh
@@ -616,6 +1265,32 @@ class SanicMySQL(AlchemyMixIn, object):
         loop.run_until_complete(open_connection())
         atexit.register(lambda: loop.run_until_complete(close_connection()))
 
+    def _resize_compiled_cache(self, ):
+        """
+        按照配置更改编译SQL缓存的大小
+        Args:
+
+        Returns:
+
+        """
+        if self.compiled_cache_size != self.compiled_cache.max_size:
+            self.compiled_cache.resize(self.compiled_cache_size)
+
+    def _config_count_cache(self, ttl: Optional[float], max_size: Optional[int], invalidate_on_write: Optional[bool]):
+        """
+        按照配置更改分页总数缓存,为None的配置保持不变
+        Args:
+            ttl: 缓存的过期时间,单位秒
+            max_size: 缓存的最大条数
+            invalidate_on_write: 写入表后是否使表的缓存失效
+        Returns:
+
+        """
+        count_cache = self.count_cache
+        self.count_cache = CountCache(count_cache.ttl if ttl is None else ttl, max_size or count_cache.max_size,
+                                      count_cache.invalidate_on_write if invalidate_on_write is None
+                                      else invalidate_on_write)
+
     def _verify_sanic_app(self, ):
         """
         校验APP类型是否正确
@@ -677,7 +1352,7 @@ class SanicMySQL(AlchemyMixIn, object):
         if None not in self.engine_pool:
             raise ValueError("Default bind is not exist.")
         if None not in self.session_pool:
-            self.session_pool[None] = Session(self.engine_pool[None], self.message, self.msg_zh)
+            self.session_pool[None] = Session(self.engine_pool[None], self.message, self.msg_zh, self.count_cache)
         return self.session_pool[None]
 
     async def gen_session(self, bind: str) -> Session:
@@ -690,5 +1365,210 @@ class SanicMySQL(AlchemyMixIn, object):
         """
         await self._create_engine(bind)
         if bind not in self.session_pool:
-            self.session_pool[bind] = Session(self.engine_pool[bind], self.message, self.msg_zh)
+            self.session_pool[bind] = Session(self.engine_pool[bind], self.message, self.msg_zh, self.count_cache,
+                                              bind)
         return self.session_pool[bind]
+
+    async def _shard_session(self, bind: Optional[str]) -> Session:
+        """
+        分表所在bind的session,bind为None时为默认的session
+        """
+        return self.session if bind is None else await self.gen_session(bind)
+
+    async def _scatter(self, query: Query, targets: Sequence[Tuple[Optional[str], DeclarativeMeta]], *,
+                       concurrency: int = 8, limit: Optional[int] = None, offset: Optional[int] = None,
+                       row_format: str = ROW_PROXY) -> List[Union[RowProxy, CompactRow]]:
+        """
+        在多个分表上并发执行同一个查询并合并结果
+        Args:
+            query: 原model上的Query 查询类
+            targets: [(bind, 分表model)]
+            concurrency: 同时查询的分表数
+            limit: 合并后返回的最大行数,为None时使用query中分页的limit
+            offset: 合并后跳过的行数,为None时使用query中分页的offset
+            row_format: 行格式
+        Returns:
+            合并后的结果
+        """
+        if not isinstance(query, Query):
+            raise FuncArgsError("query type error!")
+        query._verify_model()
+        if query._keyset_order is not None:
+            raise FuncArgsError("scatter query does not support keyset paginate!")
+        verify_row_format(row_format)
+        merger = ShardMerger(query._order_by, query._limit_clause if limit is None else limit,
+                             (query._offset_clause or 0) if offset is None else offset)
+
+        # limit下推到每个分表,合并后再跳过offset
+        base_query = query._clone()
+        base_query._limit_clause, base_query._offset_clause = merger.shard_limit, None
+        statement = base_query._build_select()._query_obj
+
+        async def find_shard(bind: Optional[str], model: DeclarativeMeta) -> List[Union[RowProxy, CompactRow]]:
+            session = await self._shard_session(bind)
+            cursor = await session._query_execute(shard_statement(statement, query._model, model))
+            return await session._fetch_all(cursor, row_format=row_format)
+
+        results = await _gather_limited(
+            [lambda bind=bind, model=model: find_shard(bind, model) for bind, model in targets], concurrency)
+        return merger.merge(results)
+
+    async def scatter_all(self, query: Query, models: Optional[Sequence[DeclarativeMeta]] = None,
+                          binds: Optional[Sequence[Optional[str]]] = None, *, concurrency: int = 8,
+                          limit: Optional[int] = None, offset: Optional[int] = None, row_format: str = ROW_PROXY
+                          ) -> List[Union[RowProxy, CompactRow]]:
+        """
+        在多个分表或者多个bind上并发执行同一个查询并合并结果
+
+        查询按照原model组织,执行时替换为每个分表的表名;有排序时各分表的有序结果按照排序做k路归并,
+        limit下推到每个分表,每个分表最多返回 offset + limit 行,跨分表的top-N只需要一次分表查询的耗时.
+        group_by等聚合查询的结果只会拼接,不会合并.
+        eg: orders = [db.gen_model(Order, table_suffix=f"{index:02d}") for index in range(64)]
+            query = db.query.model(Order).where(Order.status == 1).order_by(Order.created_time.desc())
+            rows = await db.scatter_all(query, orders, limit=20)
+        Args:
+            query: 原model上的Query 查询类,可以由paginate_query分页
+            models: 分表model,为None时为query中的model
+            binds: 在每个bind上查询所有的分表,None为默认的bind,为None时只查询默认的bind
+            concurrency: 同时查询的分表数
+            limit: 合并后返回的最大行数,为None时使用query中分页的limit
+            offset: 合并后跳过的行数,为None时使用query中分页的offset
+            row_format: 行格式,proxy返回RowProxy;compact返回CompactRow
+        Returns:
+            合并后的结果
+        """
+        if not isinstance(query, Query):
+            raise FuncArgsError("query type error!")
+        models = models or [query._model]
+        targets = [(bind, model) for bind in (binds or [None]) for model in models]
+        return await self._scatter(query, targets, concurrency=concurrency, limit=limit, offset=offset,
+                                   row_format=row_format)
+
+    async def aggregate_all(self, query: Query, models: Optional[Sequence[DeclarativeMeta]] = None,
+                            binds: Optional[Sequence[Optional[str]]] = None, *, concurrency: int = 8,
+                            limit: Optional[int] = None, offset: Optional[int] = None) -> List[CompactRow]:
+        """
+        在多个分表或者多个bind上并发执行聚合查询并合并为一个结果
+
+        查询的字段为分组字段和带label的count、sum、min、max、avg聚合,每个分表上执行部分聚合,
+        AVG拆分为SUM和COUNT,各分表的分组结果在内存中合并;排序和分页在合并后执行,不支持having.
+        eg: orders = [db.gen_model(Order, table_suffix=f"{index:02d}") for index in range(64)]
+            total = func.count(Order.id).label("total")
+            query = db.query.model(Order).columns(Order.status, total, func.avg(Order.amount).label("avg_amount")
+                                                  ).group_by(Order.status).order_by(total.desc())
+            rows = await db.aggregate_all(query, orders)
+        Args:
+            query: 原model上的Query 查询类
+            models: 分表model,为None时为query中的model
+            binds: 在每个bind上查询所有的分表,None为默认的bind,为None时只查询默认的bind
+            concurrency: 同时查询的分表数
+            limit: 合并后返回的最大行数,为None时使用query中分页的limit
+            offset: 合并后跳过的行数,为None时使用query中分页的offset
+        Returns:
+            合并后的CompactRow,字段顺序和query中的columns一致
+        """
+        if not isinstance(query, Query):
+            raise FuncArgsError("query type error!")
+        query._verify_model()
+        if query._having or query._distinct:
+            raise FuncArgsError("shard aggregate does not support having or distinct!")
+        if query._keyset_order is not None:
+            raise FuncArgsError("shard aggregate does not support keyset paginate!")
+        aggregator = ShardAggregator(query._columns)
+        merger = ShardMerger(query._order_by, query._limit_clause if limit is None else limit,
+                             (query._offset_clause or 0) if offset is None else offset)
+
+        # 排序和分页只能在合并后执行
+        base_query = query._clone()
+        base_query._columns = aggregator.partial_columns
+        base_query._order_by, base_query._limit_clause, base_query._offset_clause = [], None, None
+        # count(*)等字段中没有表时也需要从分表中查询
+        statement = base_query._build_select()._query_obj.select_from(query._model.__table__)
+
+        async def aggregate_shard(bind: Optional[str], model: DeclarativeMeta) -> List[Tuple[Any, ...]]:
+            session = await self._shard_session(bind)
+            cursor = await session._query_execute(shard_statement(statement, query._model, model))
+            return [tuple(row) for row in await session._fetch_all(cursor, row_format=ROW_COMPACT)]
+
+        models = models or [query._model]
+        targets = [(bind, model) for bind in (binds or [None]) for model in models]
+        results = await _gather_limited(
+            [lambda bind=bind, model=model: aggregate_shard(bind, model) for bind, model in targets], concurrency)
+        rows = make_compact_rows(aggregator.names, None, aggregator.merge(results))
+        if merger.names:
+            rows.sort(key=merger.sort_key())
+        return merger.merge([rows])
+
+    async def find_by_keys(self, router: ShardRouter, query: Query, keys: Iterable[Any], *, concurrency: int = 8,
+                           row_format: str = ROW_PROXY) -> List[Union[RowProxy, CompactRow]]:
+        """
+        按照分片键的多个值查询,值按照分片分组后每个分片只查询一次,多个分片并发查询
+
+        eg: router = ShardRouter(db, Order, "uid", 64)
+            rows = await db.find_by_keys(router, db.query.model(Order).where(Order.status == 1), uids)
+        Args:
+            router: 分片路由
+            query: 原model上的Query 查询类,分片键的IN条件自动追加
+            keys: 分片键的值
+            concurrency: 同时查询的分表数
+            row_format: 行格式,proxy返回RowProxy;compact返回CompactRow
+        Returns:
+            所有分片的结果,有排序时按照排序合并
+        """
+        if not isinstance(query, Query):
+            raise FuncArgsError("query type error!")
+        if query._model is not router.model_cls:
+            raise FuncArgsError("query model must be the model of the router!")
+        verify_row_format(row_format)
+        merger = ShardMerger(query._order_by)
+        key_column = getattr(query._model, router.shard_key)
+
+        async def find_shard(target: ShardTarget, values: List[Any]) -> List[Union[RowProxy, CompactRow]]:
+            session = await self._shard_session(target.bind)
+            statement = query.copy().where(key_column.in_(values)).select_query()._query_obj
+            cursor = await session._query_execute(shard_statement(statement, query._model, target.model))
+            return await session._fetch_all(cursor, row_format=row_format)
+
+        results = await _gather_limited(
+            [lambda target=target, values=values: find_shard(target, values)
+             for target, values in router.group(keys).items()], concurrency)
+        return merger.merge(results)
+
+    async def scatter_partitions(self, router: TimePartitionRouter, query: Query, *, start: Optional[Any] = None,
+                                 end: Optional[Any] = None, concurrency: int = 8, limit: Optional[int] = None,
+                                 offset: Optional[int] = None, row_format: str = ROW_PROXY
+                                 ) -> List[Union[RowProxy, CompactRow]]:
+        """
+        按时间分表的查询,只并发查询和分区字段范围重叠并且存在的分表
+
+        分区字段的范围从查询条件中获取,没有下限或者上限时使用已经存在的最早或者最晚的分表.
+        没有排序时按照分区的时间顺序拼接,有排序时按照排序合并,limit下推到每个分表.
+        eg: router = TimePartitionRouter(db, Log, "created_time", PARTITION_MONTH, "%Y%m")
+            query = db.query.model(Log).where(Log.created_time >= start, Log.created_time < end)
+            rows = await db.scatter_partitions(router, query, limit=100)
+        Args:
+            router: 时间分区路由
+            query: 原model上的Query 查询类
+            start: 开始时间,和查询条件中的范围取交集
+            end: 结束时间(包含),和查询条件中的范围取交集
+            concurrency: 同时查询的分表数
+            limit: 合并后返回的最大行数,为None时使用query中分页的limit
+            offset: 合并后跳过的行数,为None时使用query中分页的offset
+            row_format: 行格式,proxy返回RowProxy;compact返回CompactRow
+        Returns:
+            合并后的结果
+        """
+        if not isinstance(query, Query):
+            raise FuncArgsError("query type error!")
+        if query._model is not router.model_cls:
+            raise FuncArgsError("query model must be the model of the router!")
+        if router.tables_expired():
+            session = await self._shard_session(router.bind)
+            rows = await session.query_execute(*router.tables_sql())
+            router.update_tables(row[0] for row in rows)
+
+        targets = [(target.bind, target.model) for target in router.targets(query._whereclause, start, end)]
+        if not targets:
+            return []
+        return await self._scatter(query, targets, concurrency=concurrency, limit=limit, offset=offset,
+                                   row_format=row_format)
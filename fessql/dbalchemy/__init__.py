@@ -16,7 +16,7 @@ from .app_alchemy import *
 __all__ = (
     "DialectDriver",
 
-    "FesPagination", "FesQuery",
+    "FesPagination", "FesQuery", "FesPreparedQuery",
 
     "FesSession", "FesMgrSession",
 
@@ -6,15 +6,31 @@
 @software: PyCharm
 @time: 2021/3/19 下午6:50
 """
+import time
 from contextlib import contextmanager
 from math import ceil
-from typing import Generator, List
+from typing import Any, Callable, Dict, Generator, IO, List, Mapping, Optional, Tuple, Union
 
+import aelog
 from sqlalchemy import orm
 from sqlalchemy.engine.result import RowProxy
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import UnmappedInstanceError
+from sqlalchemy.sql import Select, delete, update
+from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.sql.schema import Table
 
-__all__ = ("FesPagination", "FesQuery",)
+from fessql._bulk import BatchWriter, DEFAULT_BULK_CHUNK_SIZE, gen_case_updates
+from fessql._cachelru import LRU
+from fessql._columnar import fetch_columnar
+from fessql._count import (COUNT_ESTIMATE, COUNT_EXACT, DEFAULT_COUNT_THRESHOLD, gen_table_rows_sql, is_estimable,
+                           parse_explain_rows, parse_table_rows, verify_count_strategy)
+from fessql._keyset import KeysetOrder
+from fessql._rows import ROW_COMPACT, fetch_compact, verify_row_format
+from fessql._shard_table import ShardModel
+from fessql.err import FuncArgsError
+
+__all__ = ("FesPagination", "FesQuery", "FesPreparedQuery")
 
 
 class FesPagination(object):
@@ -25,7 +41,10 @@ class FesPagination(object):
     no longer work.
     """
 
-    def __init__(self, query: 'FesQuery', page: int, per_page: int, total: int, items: List[RowProxy]):
+    def __init__(self, query: 'FesQuery', page: int, per_page: int, total: int, items: List[RowProxy], *,
+                 keyset: bool = False, prev_cursor: Optional[str] = None, next_cursor: Optional[str] = None,
+                 approximate: bool = False, count_strategy: str = COUNT_EXACT,
+                 count_threshold: int = DEFAULT_COUNT_THRESHOLD):
         #: the unlimited query object that was used to create this
         #: pagination object.
         self.query: FesQuery = query
@@ -37,6 +56,16 @@ class FesPagination(object):
         self.total: int = total
         #: the items for the current page
         self.items: List[RowProxy] = items
+        #: 是否为keyset分页
+        self.keyset: bool = keyset
+        #: keyset分页上一页和下一页的游标,没有上一页或者下一页时为None
+        self.prev_cursor: Optional[str] = prev_cursor
+        self.next_cursor: Optional[str] = next_cursor
+        #: total是否为估算的总数
+        self.approximate: bool = approximate
+        # 翻页时使用相同的统计策略
+        self.count_strategy: str = count_strategy
+        self.count_threshold: int = count_threshold
 
     @property
     def pages(self):
@@ -55,18 +84,23 @@ class FesPagination(object):
         assert (
                 self.query is not None
         ), "a query object is required for this method to work"
-        return self.query.paginate(page=self.page - 1, per_page=self.per_page, primary_order=primary_order)
+        if self.keyset:
+            return self._keyset_page(self.prev_cursor, primary_order)
+        return self.query.paginate(page=self.page - 1, per_page=self.per_page, primary_order=primary_order,
+                                   count_strategy=self.count_strategy, count_threshold=self.count_threshold)
 
     @property
     def prev_num(self):
         """Number of the previous page."""
-        if not self.has_prev:
+        if not self.has_prev or self.keyset:
             return None
         return self.page - 1
 
     @property
     def has_prev(self):
         """True if a previous page exists"""
+        if self.keyset:
+            return self.prev_cursor is not None
         return self.page > 1
 
     def next(self, primary_order: bool = True):
@@ -77,20 +111,74 @@ class FesPagination(object):
         assert (
                 self.query is not None
         ), "a query object is required for this method to work"
-        return self.query.paginate(page=self.page + 1, per_page=self.per_page, primary_order=primary_order)
+        if self.keyset:
+            return self._keyset_page(self.next_cursor, primary_order)
+        return self.query.paginate(page=self.page + 1, per_page=self.per_page, primary_order=primary_order,
+                                   count_strategy=self.count_strategy, count_threshold=self.count_threshold)
 
     @property
     def has_next(self):
         """True if a next page exists."""
+        if self.keyset:
+            return self.next_cursor is not None
         return self.page < self.pages
 
     @property
     def next_num(self):
         """Number of the next page"""
-        if not self.has_next:
+        if not self.has_next or self.keyset:
             return None
         return self.page + 1
 
+    def _keyset_page(self, cursor: Optional[str], primary_order: bool) -> 'FesPagination':
+        """
+        按照游标查询keyset分页,游标为None时证明没有这一页,直接返回空的分页
+        """
+        if cursor is None:
+            return FesPagination(self.query, self.page, self.per_page, self.total, [], keyset=True,
+                                 approximate=self.approximate, count_strategy=self.count_strategy,
+                                 count_threshold=self.count_threshold)
+        return self.query.paginate(per_page=self.per_page, primary_order=primary_order, cursor=cursor,
+                                   count_strategy=self.count_strategy, count_threshold=self.count_threshold)
+
+
+def _keyset_row_value(row: Any, column: ColumnElement) -> Any:
+    """
+    从查询结果中获取keyset分页排序字段的值,查询结果可能是model实例或者查询字段的行
+    """
+    try:
+        mapper = orm.object_mapper(row)
+    except UnmappedInstanceError:
+        return getattr(row, column.key)
+    return getattr(row, mapper.get_property_by_column(column).key)
+
+
+class FesPreparedQuery(object):
+    """
+    预编译的查询模板
+
+    由FesQuery.prepare()生成,语句在生成时就已经固定,之后不可更改,可以在模块级别定义后在多个请求中并发使用.
+    编译的结果缓存在模板中,通过FesMgrSession.query_execute执行时只需要传入bindparam对应的参数值.
+
+    eg: user_tpl = db.session.query(User).filter(User.id == bindparam("id")).prepare()
+        db.session.query_execute(user_tpl, {"id": 1}, size=1)
+    """
+
+    __slots__ = ("statement", "compiled_cache")
+
+    def __init__(self, statement: Select):
+        """
+            预编译的查询模板
+        Args:
+            statement: 查询的select语句
+        """
+        object.__setattr__(self, "statement", statement)
+        # sqlalchemy的compiled_cache,key中包含方言和参数的key,所以同一个模板也可能有多个编译结果
+        object.__setattr__(self, "compiled_cache", LRU(max_size=16))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__class__.__name__} object is immutable")
+
 
 class FesQuery(orm.Query):
     """
@@ -119,12 +207,19 @@ class FesQuery(orm.Query):
 
          :param mgr_session: a instance of FesMgrSession object.
         """
-        super().__init__(entities, sessfes)
+        # ShardModel按照分表查询,批量更新、删除时使用第一个ShardModel
+        entities = entities if isinstance(entities, (list, tuple)) else [entities]
+        self._shard_model: Optional[ShardModel] = next(
+            (entity for entity in entities if isinstance(entity, ShardModel)), None)
+        super().__init__([entity.__table__ if isinstance(entity, ShardModel) else entity for entity in entities],
+                         sessfes)
         self.mgr_session = mgr_session
         self.other_sessions = []  # 包含其他FesQuery的中的session,只要用于union等的操作
 
     # noinspection DuplicatedCode
-    def paginate(self, page: int = 1, per_page: int = 20, primary_order: bool = True) -> FesPagination:
+    def paginate(self, page: int = 1, per_page: int = 20, primary_order: bool = True, *,
+                 keyset: bool = False, cursor: Optional[str] = None, count_strategy: str = COUNT_EXACT,
+                 count_threshold: int = DEFAULT_COUNT_THRESHOLD) -> FesPagination:
         """Returns ``per_page`` items from page ``page``.
 
         If ``page`` or ``per_page`` are ``None``, they will be retrieved from
@@ -135,6 +230,12 @@ class FesQuery(orm.Query):
         * ``page`` is less than 1, or ``per_page`` is negative.
         * ``page`` or ``per_page`` are not ints.
         * primary_order: 默认启用主键ID排序的功能，在大数据查询时可以关闭此功能，在90%数据量不大的情况下可以加快分页的速度
+        * keyset: 是否使用keyset分页,按照上一页边界行的排序字段值定位,不再使用OFFSET,page参数无效,
+          排序只支持字段以及字段的asc()、desc(),排序中没有主键时自动追加主键
+        * cursor: keyset分页的游标,来自FesPagination的next_cursor和prev_cursor,传入游标时自动使用keyset分页
+        * count_strategy: 总数的统计策略,exact精确统计;estimate估算总数;auto估算的总数小于count_threshold时精确统计,
+          否则使用估算的总数;无法估算时都是精确统计,FesPagination.approximate标识total是否为估算的总数
+        * count_threshold: auto策略时的阈值
 
         ``page`` and ``per_page`` default to 1 and 20 respectively.
 
@@ -157,6 +258,8 @@ class FesQuery(orm.Query):
         if per_page < 0:
             per_page = 20
 
+        verify_count_strategy(count_strategy)
+
         if primary_order is True:
 
             # 如果分页获取的时候没有进行排序,并且model中有id字段,则增加用id字段的升序排序
@@ -171,6 +274,8 @@ class FesQuery(orm.Query):
         # 判断是否关闭,关闭后赋予新的session
         if self.session.is_closed:
             self.with_session(self.mgr_session.sessfes())
+        if keyset is True or cursor is not None:
+            return self._keyset_paginate(per_page, cursor, count_strategy, count_threshold)
         # 如果per_page为0,则证明要获取所有的数据,这里最大返回1000条数据，否则还是通常的逻辑
         if per_page != 0:
             items = self.limit(per_page).offset((page - 1) * per_page).all(False)
@@ -179,14 +284,122 @@ class FesQuery(orm.Query):
 
         # No need to count if we're on the first page and there are fewer
         # items than we expected.
+        approximate = False
         if page == 1 and len(items) < per_page:
             total = len(items)
         else:
-            total = self.order_by(None).count(False)
+            total, approximate = self._count_total(count_strategy, count_threshold)
         # 查询完后,关闭session
         self.session.close()
 
-        return FesPagination(self, page, per_page, total, items)
+        return FesPagination(self, page, per_page, total, items, approximate=approximate,
+                             count_strategy=count_strategy, count_threshold=count_threshold)
+
+    def _estimate_count(self, ) -> Optional[int]:
+        """
+        估算查询的总数
+
+        没有查询条件时使用information_schema.TABLES中的TABLE_ROWS,否则使用EXPLAIN中的rows估算
+        Returns:
+            估算的总数,无法估算时为None
+        """
+        statement = self.order_by(None).statement
+        estimable, table = is_estimable(statement)
+        if not estimable:
+            return None
+        try:
+            conn = self.session.connection()
+            if table is not None:
+                (sql, params), parse_rows = gen_table_rows_sql(table), parse_table_rows
+            else:
+                compiled = statement.compile(dialect=conn.dialect)
+                params = {key: compiled._bind_processors[key](val) if key in compiled._bind_processors else val
+                          for key, val in compiled.construct_params().items()}
+                sql, parse_rows = f"EXPLAIN {compiled}", parse_explain_rows
+            rows = [dict(row.items()) for row in conn.execute(sql, params).fetchall()]
+        except SQLAlchemyError as e:
+            # 估算失败时使用精确统计
+            aelog.exception("Estimate count failed, {}".format(e))
+            return None
+        return parse_rows(rows)
+
+    def _count_total(self, count_strategy: str, count_threshold: int) -> Tuple[int, bool]:
+        """
+        按照统计策略获取分页的总数
+        Args:
+            count_strategy: 统计策略
+            count_threshold: auto策略时的阈值
+        Returns:
+            (总数, 是否为估算的总数)
+        """
+        count_cache = getattr(self.mgr_session, "count_cache", None)
+        if count_cache is None or not count_cache.enabled:
+            return self._query_total(count_strategy, count_threshold)
+
+        # 相同的model和查询条件生成的SQL以及参数相同,作为缓存的key
+        statement = self.order_by(None).statement
+        compiled = statement.compile(dialect=self.session.get_bind().dialect)
+        cache_key = count_cache.gen_key(str(compiled), compiled.construct_params(), count_strategy, count_threshold)
+        bind_key = self.mgr_session.bind_key
+        # 版本号在查询之前获取,查询期间的写入使这次查询的总数不会命中
+        versions = count_cache.versions(bind_key, count_cache.statement_tables(statement))
+        total = count_cache.get(bind_key, cache_key, versions)
+        if total is None:
+            total = self._query_total(count_strategy, count_threshold)
+            count_cache.set(bind_key, cache_key, versions, total)
+        return total
+
+    def _query_total(self, count_strategy: str, count_threshold: int) -> Tuple[int, bool]:
+        """
+        从数据库中查询分页的总数
+        Args:
+            count_strategy: 统计策略
+            count_threshold: auto策略时的阈值
+        Returns:
+            (总数, 是否为估算的总数)
+        """
+        if count_strategy != COUNT_EXACT:
+            estimate = self._estimate_count()
+            if estimate is not None and (count_strategy == COUNT_ESTIMATE or estimate >= count_threshold):
+                return estimate, True
+        return self.order_by(None).count(False), False
+
+    def _keyset_paginate(self, per_page: int, cursor: Optional[str], count_strategy: str,
+                         count_threshold: int) -> FesPagination:
+        """
+        keyset分页,生成 WHERE (k1, k2) > (:a, :b) ORDER BY k1, k2 LIMIT n,多查询一行用来判断是否还有下一页
+        Args:
+            per_page: 每页的条数,为0时最多返回1000条
+            cursor: keyset分页的游标
+            count_strategy: 统计策略
+            count_threshold: auto策略时的阈值
+        Returns:
+            Returns a :class:`FesPagination` object.
+        """
+        mapper = getattr(self._primary_entity, "mapper", None)
+        order_by = self._order_by if self._order_by else []  # type: ignore
+        keyset_order = KeysetOrder(order_by, mapper.primary_key if mapper is not None else ())
+        if cursor is not None:
+            values, backward = keyset_order.decode_cursor(cursor)
+            query = self.filter(keyset_order.where(values, backward))
+        else:
+            query, backward = self, False
+        limit = per_page or 1000
+        rows = query.order_by(None).order_by(*keyset_order.order_by(backward)).limit(limit + 1).all(False)
+        items, prev_cursor, next_cursor = keyset_order.split_page(
+            rows, limit, backward, cursor is not None, _keyset_row_value)
+
+        approximate = False
+        if cursor is None and len(rows) < per_page:
+            total = len(rows)
+        else:
+            total, approximate = self._count_total(count_strategy, count_threshold)
+        # 查询完后,关闭session
+        self.session.close()
+
+        return FesPagination(self, 1, per_page, total, items, keyset=True, prev_cursor=prev_cursor,
+                             next_cursor=next_cursor, approximate=approximate, count_strategy=count_strategy,
+                             count_threshold=count_threshold)
 
     def filter(self, *criterion) -> 'FesQuery':
         """
@@ -362,6 +575,19 @@ class FesQuery(orm.Query):
         """
         return super().add_entity(entity, alias)
 
+    def prepare(self, ) -> FesPreparedQuery:
+        """
+        生成预编译的查询模板
+
+        查询条件中需要变化的值使用bindparam命名,生成模板后每次执行只需要传入参数值,不再重复生成和编译select语句,
+        执行返回的是RowProxy,而不是model的实例
+
+        eg: db.session.query(User).filter(User.id == bindparam("id")).order_by(User.id).prepare()
+        Returns:
+            FesPreparedQuery
+        """
+        return FesPreparedQuery(self.statement)
+
     @contextmanager
     def close_session(self, is_closed: bool = True) -> Generator[None, None, None]:
         """
@@ -398,13 +624,26 @@ class FesQuery(orm.Query):
         with self.close_session(is_closed):
             return super().first()
 
-    def all(self, is_closed: bool = True):
+    def all(self, is_closed: bool = True, *, columnar: bool = False, row_format: Optional[str] = None):
         """Return the results represented by this :class:`_query.Query`
         as a list.
 
         This results in an execution of the underlying SQL statement.
+
+        columnar为True时执行查询的select语句并按列返回{字段名: 字段数据},不生成model实例和每行的RowProxy,
+        数值字段为array.array或者numpy数组,其他字段为列表
+
+        row_format为compact时执行查询的select语句并返回紧凑行CompactRow,不生成model实例,
+        为proxy时返回RowProxy,默认返回查询的实体
         """
+        if row_format is not None:
+            verify_row_format(row_format)
         with self.close_session(is_closed):
+            if columnar or row_format is not None:
+                result = self.session.execute(self.statement, mapper=self._bind_mapper())
+                if columnar:
+                    return fetch_columnar(result)
+                return fetch_compact(result) if row_format == ROW_COMPACT else result.fetchall()
             return super().all()
 
     def count(self, is_closed: bool = True):
@@ -442,7 +681,91 @@ class FesQuery(orm.Query):
         with self.close_session(is_closed):
             return super().scalar()
 
-    def delete(self, synchronize_session=False) -> int:
+    def stream(self, batch_size: int = 1000) -> Generator[Any, None, None]:
+        """
+        流式查询数据
+
+        使用yield_per和stream_results的服务端游标每次读取batch_size行并生成model实例,不缓存整个结果集.
+        迭代期间占用连接池中的一个连接,迭代完成后关闭session归还连接;中途调用close()或者生成器被回收时连接失效并关闭,
+        不再读取剩余的数据.和yield_per一样,不能和集合的joinedload、subqueryload一起使用.
+        eg: for user in session.query(User).filter(User.status == 1).order_by(User.id).stream(2000):
+                ...
+        Args:
+            batch_size: 每次从服务端读取的行数
+        Returns:
+            生成器,每次返回一行查询结果
+        """
+        if not isinstance(batch_size, int) or batch_size <= 0:
+            raise FuncArgsError("batch_size must be a positive integer!")
+        finished = False
+        with self.close_session():
+            # 和查询执行时使用的是session中同一个连接
+            conn = self.session.connection(mapper=self._bind_mapper())
+            try:
+                yield from self.yield_per(batch_size)
+                finished = True
+            finally:
+                if not finished:
+                    # 未读取完的服务端游标关闭时需要读取剩余的数据,所以直接使连接失效,连接池会丢弃此连接
+                    conn.invalidate()
+
+    def export(self, sink: Union[str, IO], **kwargs) -> Dict[str, float]:
+        """
+        流式导出查询结果为CSV或者NDJSON,参数和FesMgrSession.export一致
+
+        eg: stats = session.query(User.id, User.name).filter(User.status == 1).export("/tmp/users.csv")
+        Args:
+            sink: 文件路径或者有write方法的类文件对象
+            kwargs: FesMgrSession.export的参数
+        Returns:
+            导出的统计信息
+        """
+        if self.mgr_session is None:
+            raise FuncArgsError("export query must be created by FesMgrSession.query!")
+        return self.mgr_session.export(self, sink, **kwargs)
+
+    def _bulk_model(self, ) -> Any:
+        """
+        批量操作的model类
+        """
+        mapper = self._mapper_zero()
+        if mapper is None:
+            if self._shard_model is not None:
+                return self._shard_model
+            raise FuncArgsError("bulk query must be a model query!")
+        return mapper.class_
+
+    def _batch_write(self, writer: BatchWriter) -> int:
+        """
+        分批删除或者更新,每批执行后提交,某一批失败后已经提交的批次不会回滚
+        Args:
+            writer: BatchWriter
+        Returns:
+            累计删除或者更新的条数
+        """
+        while True:
+            start_time = time.monotonic()
+            keys = self.session.execute(writer.select_query()).fetchall()
+            if not keys:
+                break
+            try:
+                rowcount = self.session.execute(writer.write_query(keys)).rowcount
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+            _, delay = writer.finish_batch(rowcount, time.monotonic() - start_time)
+            if len(keys) < writer.batch_size:
+                break
+            if delay > 0:
+                time.sleep(delay)
+        if self.mgr_session is not None and writer.rowcount:
+            # 每批都已经提交,结束后写入表的分页总数缓存失效
+            self.mgr_session.count_cache.invalidate_write(self.mgr_session.bind_key, delete(writer.model))
+        return writer.rowcount
+
+    def delete(self, synchronize_session=False, *, batch_size: int = 0, pause: float = 0,
+               max_rows_per_second: float = 0, progress: Optional[Callable[[int, int], Any]] = None) -> int:
         """Perform a bulk delete query.
 
         Deletes rows matched by this query from the database.
@@ -478,13 +801,34 @@ class FesQuery(orm.Query):
         The expression evaluator currently doesn't account for differing
         string collations between the database and Python.
 
+        :param batch_size: 大于0时按照主键分批删除,每批执行后提交,直到没有匹配的行,eg::
+
+            sess.query(Log).filter(Log.created_time < expire_time).delete(batch_size=1000, pause=0.1)
+
+        :param pause: 分批删除时每批之间暂停的秒数
+
+        :param max_rows_per_second: 分批删除时每秒最多删除的行数,默认0不限制
+
+        :param progress: 分批删除时每批执行后的回调,参数为(累计删除的行数, 本批删除的行数)
+
         :return: the count of rows matched as returned by the database's
           "row count" feature.
 
         """
+        if batch_size > 0:
+            whereclause = [self.whereclause] if self.whereclause is not None else []
+            return self._batch_write(BatchWriter(self._bulk_model(), whereclause, None, batch_size, pause,
+                                                 max_rows_per_second, progress))
+        if self._shard_model is not None:
+            query = delete(self._shard_model)
+            if self.whereclause is not None:
+                query = query.where(self.whereclause)
+            return self.session.execute(query).rowcount
         return super().delete(synchronize_session)
 
-    def update(self, values, synchronize_session=False, update_args=None) -> int:
+    def update(self, values, synchronize_session=False, update_args=None, *, bulk_key: Optional[str] = None,
+               chunk_size: int = DEFAULT_BULK_CHUNK_SIZE, batch_size: int = 0, pause: float = 0,
+               max_rows_per_second: float = 0, progress: Optional[Callable[[int, int], Any]] = None) -> int:
         r"""Perform a bulk update query.
 
         Updates rows matched by this query in the database.
@@ -547,8 +891,44 @@ class FesQuery(orm.Query):
 
          .. versionadded:: 1.0.0
 
+        :param bulk_key: 批量更新时定位行的字段名,一般为主键.指定时values为多行数据的列表,
+         按照此字段排序后合并为分块的CASE更新语句,eg::
+
+            sess.query(User).update([{"id": 1, "age": 10}, {"id": 2, "age": 12}], bulk_key="id")
+
+         每个分块执行一条 UPDATE users SET age=CASE users.id WHEN 1 THEN 10 WHEN 2 THEN 12 ELSE users.age END
+         WHERE users.id IN (1, 2),和普通的update一样需要在外部提交,synchronize_session和update_args无效
+
+        :param chunk_size: 批量更新时每个分块的最大行数
+
+        :param batch_size: 大于0时按照主键分批更新,每批执行后提交,values只支持字典,eg::
+
+            sess.query(User).filter(User.status == 0).update({"status": 1}, batch_size=1000, pause=0.1)
+
+        :param pause: 分批更新时每批之间暂停的秒数
+
+        :param max_rows_per_second: 分批更新时每秒最多更新的行数,默认0不限制
+
+        :param progress: 分批更新时每批执行后的回调,参数为(累计更新的行数, 本批更新的行数)
+
         :return: the count of rows matched as returned by the database's
          "row count" feature.
 
         """
+        whereclause = [self.whereclause] if self.whereclause is not None else []
+        if bulk_key is not None and not isinstance(values, Mapping):
+            rowcount = 0
+            for bulk_query in gen_case_updates(self._bulk_model(), values, bulk_key, chunk_size, whereclause):
+                rowcount += self.session.execute(bulk_query).rowcount
+            return rowcount
+        if batch_size > 0:
+            if not isinstance(values, Mapping):
+                raise FuncArgsError("batch update only supports dict values!")
+            return self._batch_write(BatchWriter(self._bulk_model(), whereclause, values, batch_size, pause,
+                                                 max_rows_per_second, progress))
+        if self._shard_model is not None:
+            query = update(self._shard_model).values(values)
+            if self.whereclause is not None:
+                query = query.where(self.whereclause)
+            return self.session.execute(query).rowcount
         return super().update(values, synchronize_session, update_args)
@@ -11,21 +11,28 @@
 import atexit
 from collections import MutableMapping
 from contextlib import contextmanager
-from typing import Any, Dict, Generator, List, Optional, Type, Union
+from typing import Any, Callable, Dict, Generator, IO, List, Optional, Tuple, Type, Union
 
 import aelog
 import sqlalchemy
 from sqlalchemy import exc as sqlalchemy_err, orm, text
 # noinspection PyProtectedMember
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.engine.result import ResultProxy, RowProxy
 from sqlalchemy.engine.url import URL
 from sqlalchemy.exc import DatabaseError, IntegrityError
+from sqlalchemy.ext.declarative import DeclarativeMeta
 
 from fessql._alchemy import AlchemyMixIn
+from fessql._bulk import DEFAULT_BULK_CHUNK_SIZE, gen_upserts, parse_upsert_result
+from fessql._columnar import fetch_columnar
+from fessql._count import CountCache
 from fessql._err_msg import mysql_msg
+from fessql._export import EXPORT_CSV, ExportWriter
+from fessql._model_meta import model_registry
+from fessql._rows import ROW_COMPACT, ROW_PROXY, fetch_compact, verify_row_format
 from fessql.err import DBDuplicateKeyError, DBError, FuncArgsError, HttpError
-from ._query import FesQuery
+from ._query import FesPreparedQuery, FesQuery
 from .drivers import DialectDriver
 
 __all__ = ("FesSession", "FesMgrSession", "DBAlchemy")
@@ -78,14 +85,16 @@ class FesMgrSession(object):
     单个session的工厂管理类
     """
 
-    def __init__(self, scoped_session: orm.scoped_session, bind_key: Optional[str] = None):
+    def __init__(self, scoped_session: orm.scoped_session, bind_key: Optional[str] = None,
+                 count_cache: Optional[CountCache] = None):
         """
         单个session的工厂管理类
         Args:
-
+            count_cache: 分页总数的缓存
         """
         self._scoped_session: orm.scoped_session = scoped_session
         self.bind_key: Optional[str] = bind_key
+        self.count_cache: CountCache = count_cache if count_cache is not None else CountCache()
 
     def sessfes(self, ) -> FesSession:
         """
@@ -138,31 +147,98 @@ class FesMgrSession(object):
             aelog.exception(e)
             raise HttpError(400, message=mysql_msg[2]["msg_zh"], error=e)
         else:
+            # 提交后写入表的分页总数缓存失效
+            self.count_cache.invalidate_write(self.bind_key, query)
             return cursor.fetchone() if cursor.returns_rows else None
         finally:
             if cursor:
                 cursor.close()
             session.close()
 
-    def query_execute(self, query: Union[FesQuery, str], params: Optional[Dict[str, Any]] = None,
-                      size: Optional[int] = None) -> Union[List[RowProxy], RowProxy, None]:
+    def upsert_many(self, model: DeclarativeMeta, upsert_data: List[Dict[str, Any]], *,
+                    update_columns: Union[List[str], Dict[str, str], None] = None,
+                    chunk_size: int = DEFAULT_BULK_CHUNK_SIZE) -> Tuple[int, int]:
+        """
+        批量插入或更新数据
+
+        数据分块生成多行的 INSERT ... ON DUPLICATE KEY UPDATE 语句,所有分块在同一个事务中执行
+        eg: session.upsert_many(User, rows, update_columns={"name": "values", "login_count": "increment"})
+        Args:
+            model: model类
+            upsert_data: 值类型List[Dict],补充insert默认值后所有行的字段必须相同
+            update_columns: 重复时更新的字段,字段名列表时更新为插入的值;字典时为{字段名: 更新方式},
+                更新方式为values、increment或者keep;默认更新数据中除主键外的所有字段
+            chunk_size: 每个分块的最大行数
+        Returns:
+            (插入的条数, 重复后更新的条数)
+        """
+        upsert_queries = list(gen_upserts(model, list(upsert_data), update_columns, chunk_size,
+                                          model_registry.get(model).gen_onupdate_value()))
+        session: FesSession = self.sessfes()
+        inserted = updated = 0
+        try:
+            for row_count, upsert_query in upsert_queries:
+                cursor: ResultProxy = session.execute(upsert_query)
+                # 多行INSERT的info中有重复的行数
+                result = getattr(cursor.context.cursor, "_result", None)
+                chunk_inserted, chunk_updated = parse_upsert_result(
+                    row_count, cursor.rowcount, getattr(result, "message", None))
+                inserted, updated = inserted + chunk_inserted, updated + chunk_updated
+            session.commit()
+        except IntegrityError as e:
+            session.rollback()
+            aelog.exception(e)
+            raise DBError(e)
+        except DatabaseError as e:
+            session.rollback()
+            aelog.exception(e)
+            raise DBError(e)
+        except Exception as e:
+            session.rollback()
+            aelog.exception(e)
+            raise HttpError(400, message=mysql_msg[1]["msg_zh"], error=e)
+        finally:
+            session.close()
+
+        if upsert_queries:
+            self.count_cache.invalidate_write(self.bind_key, upsert_queries[0][1])
+        return inserted, updated
+
+    def query_execute(self, query: Union[FesQuery, FesPreparedQuery, str], params: Optional[Dict[str, Any]] = None,
+                      size: Optional[int] = None, *, columnar: bool = False, row_format: str = ROW_PROXY
+                      ) -> Union[List[RowProxy], RowProxy, Dict[str, Any], None]:
         """
         查询数据
         Args:
-            query: SQL的查询字符串或者sqlalchemy表达式
+            query: SQL的查询字符串、sqlalchemy表达式或者FesPreparedQuery查询模板
             params: SQL表达式中的参数
             size: 查询数据大小, 默认返回所有
+            columnar: 是否按列返回{字段名: 字段数据},数值字段为array.array或者numpy数组,其他字段为列表,
+                      size为最多读取的行数
+            row_format: 行格式,proxy返回RowProxy;compact返回紧凑行CompactRow,同一个查询的行共用字段名到下标的映射
             # cursor_close: 是否关闭游标，默认关闭，如果多次读取可以改为false，后面关闭的行为交给sqlalchemy处理
         Returns:
             List[RowProxy] or RowProxy or None
         """
+        verify_row_format(row_format)
         params = dict(params) if isinstance(params, MutableMapping) else {}
 
         session: FesSession = self.sessfes()
         cursor: Optional[ResultProxy] = None
         try:
-            cursor = session.execute(query, params)
-            if size is None:
+            if isinstance(query, FesPreparedQuery):
+                # 使用模板中缓存的编译结果
+                conn = session.connection().execution_options(compiled_cache=query.compiled_cache)
+                cursor = conn.execute(query.statement, params)
+            else:
+                cursor = session.execute(query, params)
+            if columnar:
+                resp = fetch_columnar(cursor, size=size)
+            elif row_format == ROW_COMPACT:
+                resp = fetch_compact(cursor, size)
+                if size == 1:
+                    resp = resp[0] if resp else None
+            elif size is None:
                 resp = cursor.fetchall() if cursor.returns_rows else []
             elif size == 1:
                 resp = cursor.fetchone() if cursor.returns_rows else None
@@ -175,6 +251,90 @@ class FesMgrSession(object):
 
         return resp
 
+    def stream(self, query: Union[FesQuery, FesPreparedQuery, str], params: Optional[Dict[str, Any]] = None, *,
+               batch_size: int = 1000) -> Generator[RowProxy, None, None]:
+        """
+        流式查询数据
+
+        使用stream_results的服务端游标每次读取batch_size行,不缓存整个结果集,适用于批处理任务中大结果集的扫描.
+        迭代期间占用连接池中的一个连接,迭代完成后归还;中途调用close()或者生成器被回收时连接失效并关闭,
+        不再读取剩余的数据.
+        eg: for row in session.stream("SELECT id, name FROM users WHERE status = :status", {"status": 1}):
+                ...
+        Args:
+            query: SQL的查询字符串、sqlalchemy表达式或者FesPreparedQuery查询模板
+            params: SQL表达式中的参数
+            batch_size: 每次从服务端读取的行数
+        Returns:
+            生成器,每次返回一行RowProxy
+        """
+        if not isinstance(batch_size, int) or batch_size <= 0:
+            raise FuncArgsError("batch_size must be a positive integer!")
+        params = dict(params) if isinstance(params, MutableMapping) else {}
+
+        session: FesSession = self.sessfes()
+        conn: Optional[Connection] = None
+        finished = False
+        try:
+            conn = session.connection(execution_options={"stream_results": True})
+            if isinstance(query, FesPreparedQuery):
+                cursor = conn.execution_options(compiled_cache=query.compiled_cache).execute(query.statement, params)
+            else:
+                cursor = session.execute(query, params)
+            while cursor.returns_rows:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+            cursor.close()
+            finished = True
+        finally:
+            if not finished and conn is not None:
+                # 未读取完的服务端游标关闭时需要读取剩余的数据,所以直接使连接失效,连接池会丢弃此连接
+                conn.invalidate()
+            session.close()
+
+    def export(self, query: Union[FesQuery, FesPreparedQuery, str], sink: Union[str, IO], *,
+               params: Optional[Dict[str, Any]] = None, export_format: str = EXPORT_CSV, batch_size: int = 1000,
+               header: bool = True, encoding: str = "utf-8", csv_options: Optional[Dict[str, Any]] = None,
+               progress: Optional[Callable[[Dict[str, float]], Any]] = None) -> Dict[str, float]:
+        """
+        流式导出查询结果为CSV或者NDJSON
+
+        通过stream分批读取,每批编码后写入,内存中只有一批数据.FesQuery按照查询的select语句导出字段,不生成model实例.
+        没有数据时不写入CSV的表头.
+        eg: stats = session.export(session.query(User).filter(User.status == 1), "/tmp/users.ndjson",
+                                   export_format="ndjson")
+        Args:
+            query: FesQuery、SQL的查询字符串、sqlalchemy表达式或者FesPreparedQuery查询模板
+            sink: 文件路径或者有write方法的类文件对象,文本文件写入str,其他写入bytes
+            params: SQL表达式中的参数
+            export_format: 导出格式,csv或者ndjson
+            batch_size: 每批读取和写入的行数
+            header: CSV是否写入表头
+            encoding: 编码
+            csv_options: csv.writer的参数,比如delimiter、quoting
+            progress: 每批写入后的回调,参数为当前的统计信息
+        Returns:
+            {"rows": 行数, "bytes": 字节数, "elapsed": 耗时秒数, "rows_per_second": 每秒行数,
+             "bytes_per_second": 每秒字节数}
+        """
+        writer = ExportWriter(sink, export_format, header=header, encoding=encoding, csv_options=csv_options,
+                              progress=progress)
+        rows = self.stream(query.statement if isinstance(query, FesQuery) else query, params, batch_size=batch_size)
+        try:
+            batch: List[RowProxy] = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    writer.write_rows(batch)
+                    batch = []
+            writer.write_rows(batch)
+        finally:
+            rows.close()
+            stats = writer.close()
+        return stats
+
 
 class DBAlchemy(AlchemyMixIn, object):
     """
@@ -210,6 +370,10 @@ class DBAlchemy(AlchemyMixIn, object):
             echo: 是否显示sqlalchemy的日志,默认false
             connect_args: 实际建立连接的连接参数,connect_timeout: 连接超时时间，默认60秒
 
+            count_cache_ttl: 分页总数缓存的过期时间,单位秒,默认0不缓存
+            count_cache_size: 分页总数缓存的最大条数
+            count_cache_invalidate: 写入表后是否使表的分页总数缓存失效,默认True
+
             fessql_binds: binds config, eg:{"first":{"fessql_mysql_host":"127.0.0.1",
                                                     "fessql_mysql_port":3306,
                                                     "fessql_mysql_username":"root",
@@ -239,6 +403,10 @@ class DBAlchemy(AlchemyMixIn, object):
         self._set_engine_opts()  # 更新默认参数
         # other binds
         self.fessql_binds: Dict[str, Dict] = fessql_binds or {}  # binds config
+        # 分页总数缓存,所有的session共用,可以通过count_cache.stats()查看命中情况
+        self.count_cache: CountCache = CountCache(kwargs.get("count_cache_ttl", 0),
+                                                  kwargs.get("count_cache_size", 1024),
+                                                  kwargs.get("count_cache_invalidate", True))
 
         if app is not None:
             self.init_app(app)
@@ -345,11 +513,28 @@ class DBAlchemy(AlchemyMixIn, object):
         self._apply_engine_opts(config, self.engine_options)
         self.fessql_binds = config.get("FESSQL_BINDS") or self.fessql_binds
         self.verify_binds()
+        self._config_count_cache(config.get("FESSQL_COUNT_CACHE_TTL"), config.get("FESSQL_COUNT_CACHE_SIZE"),
+                                 config.get("FESSQL_COUNT_CACHE_INVALIDATE"))
 
         # engine
         self.engine_pool[None] = self._create_engine(self.db_uri, self.engine_options)
         self.sessionmaker_pool[None] = self._create_scoped_sessionmaker(self.engine_pool[None])
 
+    def _config_count_cache(self, ttl: Optional[float], max_size: Optional[int], invalidate_on_write: Optional[bool]):
+        """
+        按照配置更改分页总数缓存,为None的配置保持不变
+        Args:
+            ttl: 缓存的过期时间,单位秒
+            max_size: 缓存的最大条数
+            invalidate_on_write: 写入表后是否使表的缓存失效
+        Returns:
+
+        """
+        count_cache = self.count_cache
+        self.count_cache = CountCache(count_cache.ttl if ttl is None else ttl, max_size or count_cache.max_size,
+                                      count_cache.invalidate_on_write if invalidate_on_write is None
+                                      else invalidate_on_write)
+
     # noinspection DuplicatedCode
     def init_engine(self, *, username: str = "root", passwd: Optional[str] = "",
                     host: str = "127.0.0.1", port: int = 3306, dbname: str = "", **kwargs) -> None:
@@ -377,6 +562,8 @@ class DBAlchemy(AlchemyMixIn, object):
         self._apply_engine_opts(kwargs, self.engine_options)
         self.fessql_binds = kwargs.pop("fessql_binds", None) or self.fessql_binds
         self.verify_binds()
+        self._config_count_cache(kwargs.pop("count_cache_ttl", None), kwargs.pop("count_cache_size", None),
+                                 kwargs.pop("count_cache_invalidate", None))
 
         # engine
         self.engine_pool[None] = self._create_engine(self.db_uri, self.engine_options)
@@ -511,7 +698,7 @@ class DBAlchemy(AlchemyMixIn, object):
 
         """
 
-        return FesMgrSession(self._gen_sessionmaker(bind_key), bind_key)
+        return FesMgrSession(self._gen_sessionmaker(bind_key), bind_key, self.count_cache)
 
     @property
     def session(self, ) -> FesMgrSession:
@@ -527,6 +714,12 @@ class DBAlchemy(AlchemyMixIn, object):
 
         return self.gen_session()
 
+    def _shard_session(self, bind_key: Optional[str]) -> FesMgrSession:
+        """
+        分表所在bind的session,bind_key为None时为默认的session
+        """
+        return self.gen_session(bind_key)
+
     @staticmethod
     @contextmanager
     def insert_context(session: FesMgrSession) -> Generator[FesSession, None, None]:
@@ -541,6 +734,8 @@ class DBAlchemy(AlchemyMixIn, object):
         try:
             yield sessfes
             sessfes.commit()
+            # context中写入的表未知,整个bind的分页总数缓存失效
+            session.count_cache.invalidate_write(session.bind_key)
         except IntegrityError as e:
             sessfes.rollback()
             if "Duplicate" in str(e):
@@ -572,6 +767,8 @@ class DBAlchemy(AlchemyMixIn, object):
         try:
             yield sessfes
             sessfes.commit()
+            # context中写入的表未知,整个bind的分页总数缓存失效
+            session.count_cache.invalidate_write(session.bind_key)
         except IntegrityError as e:
             sessfes.rollback()
             if "Duplicate" in str(e):
@@ -603,6 +800,8 @@ class DBAlchemy(AlchemyMixIn, object):
         try:
             yield sessfes
             sessfes.commit()
+            # context中写入的表未知,整个bind的分页总数缓存失效
+            session.count_cache.invalidate_write(session.bind_key)
         except DatabaseError as e:
             sessfes.rollback()
             aelog.exception(e)
@@ -1,4 +1,5 @@
-from typing import Any, ContextManager, Dict, List, Optional, Sequence, Type, Union
+from typing import (Any, Callable, ContextManager, Dict, Generator, IO, Iterable, List, Optional, Sequence, Tuple,
+                    Type, Union)
 
 from sqlalchemy import orm
 # noinspection PyProtectedMember
@@ -8,7 +9,9 @@ from sqlalchemy.engine.url import URL
 from sqlalchemy.ext.declarative import DeclarativeMeta
 
 from fessql._alchemy import AlchemyMixIn
-from ._query import FesQuery
+from fessql._count import CountCache
+from fessql._shard_table import ShardModel
+from ._query import FesPreparedQuery, FesQuery
 
 
 class FesSession(orm.Session):
@@ -29,8 +32,10 @@ class FesSession(orm.Session):
 class FesMgrSession:
     _scoped_session: orm.scoped_session
     bind_key: Optional[str]
+    count_cache: CountCache
 
-    def __init__(self, scoped_session: orm.scoped_session, bind_key: Optional[str] = ...) -> None: ...
+    def __init__(self, scoped_session: orm.scoped_session, bind_key: Optional[str] = ...,
+                 count_cache: Optional[CountCache] = ...) -> None: ...
 
     def sessfes(self) -> FesSession: ...
 
@@ -38,8 +43,21 @@ class FesMgrSession:
 
     def execute(self, query: Union[FesQuery, str], params: Optional[Dict[str, Any]] = ...) -> Optional[RowProxy]: ...
 
-    def query_execute(self, query: Union[FesQuery, str], params: Optional[Dict[str, Any]] = ...,
-                      size: Optional[int] = ...) -> Union[List[RowProxy], RowProxy, None]: ...
+    def upsert_many(self, model: DeclarativeMeta, upsert_data: List[Dict[str, Any]], *,
+                    update_columns: Union[List[str], Dict[str, str], None] = ...,
+                    chunk_size: int = ...) -> Tuple[int, int]: ...
+
+    def query_execute(self, query: Union[FesQuery, FesPreparedQuery, str], params: Optional[Dict[str, Any]] = ...,
+                      size: Optional[int] = ..., *, columnar: bool = ..., row_format: str = ...
+                      ) -> Union[List[RowProxy], RowProxy, Dict[str, Any], None]: ...
+
+    def stream(self, query: Union[FesQuery, FesPreparedQuery, str], params: Optional[Dict[str, Any]] = ..., *,
+               batch_size: int = ...) -> Generator[RowProxy, None, None]: ...
+
+    def export(self, query: Union[FesQuery, FesPreparedQuery, str], sink: Union[str, IO], *,
+               params: Optional[Dict[str, Any]] = ..., export_format: str = ..., batch_size: int = ...,
+               header: bool = ..., encoding: str = ..., csv_options: Optional[Dict[str, Any]] = ...,
+               progress: Optional[Callable[[Dict[str, float]], Any]] = ...) -> Dict[str, float]: ...
 
 
 class DBAlchemy(AlchemyMixIn):
@@ -65,6 +83,7 @@ class DBAlchemy(AlchemyMixIn):
     engine_options: Dict[str, Any]
     # other binds
     fessql_binds: Dict[str, Dict]
+    count_cache: CountCache
 
     def __init__(self, app=..., *, username: str = ..., passwd: str = ..., host: str = ...,
                  port: int = ..., dbname: str = ..., dialect: str = ..., fessql_binds: Optional[Dict[str, Dict]] = ...,
@@ -85,6 +104,9 @@ class DBAlchemy(AlchemyMixIn):
 
     def _init_app(self, config: Dict[str, Any]) -> None: ...
 
+    def _config_count_cache(self, ttl: Optional[float], max_size: Optional[int],
+                            invalidate_on_write: Optional[bool]) -> None: ...
+
     def init_engine(self, *, username: str = ..., passwd: Optional[str] = ..., host: str = ..., port: int = ...,
                     dbname: str = ..., **kwargs) -> None: ...
 
@@ -108,6 +130,8 @@ class DBAlchemy(AlchemyMixIn):
     @property
     def session(self) -> FesMgrSession: ...
 
+    def _shard_session(self, bind_key: Optional[str]) -> FesMgrSession: ...
+
     @staticmethod
     def insert_context(session: FesMgrSession) -> ContextManager[FesSession]: ...
 
@@ -121,4 +145,15 @@ class DBAlchemy(AlchemyMixIn):
 
     def gen_model(self, model_cls: DeclarativeMeta, class_suffix: str = ..., table_suffix: str = ...,
                   table_name: Optional[str] = ..., field_mapping: Optional[Dict[str, str]] = ...,
-                  fields: Optional[Sequence[str]] = ...): ...
+                  fields: Optional[Sequence[str]] = ...) -> DeclarativeMeta: ...
+
+    def _create_model(self, model_cls: DeclarativeMeta, class_suffix: str, table_suffix: str,
+                      table_name: Optional[str], field_mapping: Optional[Dict[str, str]],
+                      fields: Optional[Sequence[str]]) -> DeclarativeMeta: ...
+
+    def shard_model(self, model_cls: DeclarativeMeta, table_suffix: str, table_name: Optional[str] = ...
+                    ) -> ShardModel: ...
+
+    def warm_models(self, model_cls: DeclarativeMeta, suffixes: Iterable[str], *, table_name: Optional[str] = ...,
+                    field_mapping: Optional[Dict[str, str]] = ..., fields: Optional[Sequence[str]] = ...
+                    ) -> List[DeclarativeMeta]: ...
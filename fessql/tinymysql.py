@@ -6,12 +6,17 @@
 @software: PyCharm
 @time: 19-4-2 上午9:04
 """
-from typing import Any, Dict, List, Optional, Tuple, Union
+import os
+from typing import Any, Dict, Generator, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
 
 import aelog
 import pymysql
 from pymysql.connections import Connection
-from pymysql.cursors import DictCursor
+from pymysql.cursors import DictCursor, SSCursor, SSDictCursor
+
+from ._bulk import DEFAULT_BULK_CHUNK_SIZE, gen_upsert_sql, parse_upsert_result
+from ._loaddata import BulkLoader, LoadDataFormat, is_local_infile_rejected
+from .err import FuncArgsError
 
 __all__ = ("TinyMysql",)
 
@@ -26,7 +31,7 @@ class TinyMysql(object):
     """
 
     def __init__(self, db_user: str, db_pwd: str, db_host: str = "127.0.0.1", db_port: int = 3306,
-                 db_name: Optional[str] = None):
+                 db_name: Optional[str] = None, local_infile: bool = False):
         """
             pymysql 操作数据库的各种方法
         Args:
@@ -35,6 +40,7 @@ class TinyMysql(object):
             db_host: host
             db_port: port
             db_name: 数据库名称
+            local_infile: 是否允许 LOAD DATA LOCAL INFILE,load_data需要开启,服务端也需要开启local_infile
         Returns:
 
         """
@@ -44,6 +50,7 @@ class TinyMysql(object):
         self.db_user = db_user
         self.db_pwd = db_pwd
         self.db_name = db_name
+        self.local_infile = local_infile
 
     def __enter__(self):
         return self
@@ -60,7 +67,8 @@ class TinyMysql(object):
 
         def _get_connection() -> Connection:
             return pymysql.connect(host=self.db_host, port=self.db_port, db=self.db_name, user=self.db_user,
-                                   passwd=self.db_pwd, charset="utf8mb4", cursorclass=DictCursor)
+                                   passwd=self.db_pwd, charset="utf8mb4", cursorclass=DictCursor,
+                                   local_infile=self.local_infile)
 
         if self._conn is None:
             self._conn = _get_connection()
@@ -114,6 +122,105 @@ class TinyMysql(object):
             self.conn.commit()
         return count
 
+    def upsert_many(self, table_name: str, rows: List[Dict[str, Any]],
+                    update_columns: Union[List[str], Dict[str, str], None] = None,
+                    chunk_size: int = DEFAULT_BULK_CHUNK_SIZE) -> Tuple[int, int]:
+        """
+            批量插入或更新数据,分块执行多行的 INSERT ... ON DUPLICATE KEY UPDATE,所有分块在同一个事务中
+        Args:
+            table_name: 表名,可以为 库名.表名
+            rows: 插入的数据,所有行的字段必须相同
+            update_columns: 重复时更新的字段,字段名列表时更新为插入的值;字典时为{字段名: 更新方式},
+                更新方式为values、increment或者keep;默认更新所有字段
+            chunk_size: 每个分块的最大行数
+        Returns:
+            (插入的条数, 重复后更新的条数),失败时为(0, 0)
+        INSERT INTO `traffic` (`IMEI`,`count`) VALUES (%s,%s),(%s,%s)
+        ON DUPLICATE KEY UPDATE `count` = `count` + VALUES(`count`)
+
+        """
+
+        inserted = updated = 0
+        try:
+            with self.conn.cursor() as cursor:
+                for row_count, sql, args in gen_upsert_sql(table_name, rows, update_columns, chunk_size):
+                    affected_rows = cursor.execute(sql, args)
+                    # 多行INSERT的info中有重复的行数
+                    chunk_inserted, chunk_updated = parse_upsert_result(
+                        row_count, affected_rows, getattr(cursor._result, "message", None))
+                    inserted, updated = inserted + chunk_inserted, updated + chunk_updated
+        except pymysql.Error as e:
+            self.conn.rollback()
+            aelog.exception(e)
+            return 0, 0
+        except Exception as e:
+            self.conn.rollback()
+            aelog.exception(e)
+            return 0, 0
+        else:
+            self.conn.commit()
+        return inserted, updated
+
+    def load_data(self, table_name: str, source: Union[str, os.PathLike, Iterable[Any]], *,
+                  columns: Union[Sequence[str], Mapping[Any, str], None] = None, fields_terminated: str = "\t",
+                  lines_terminated: str = "\n", escaped_by: str = "\\",
+                  chunk_size: int = DEFAULT_BULK_CHUNK_SIZE) -> Tuple[int, int]:
+        """
+            使用 LOAD DATA LOCAL INFILE 批量导入数据,所有数据在同一个事务中
+
+        数据行编码后通过命名管道流式发送,不写入临时文件;客户端没有开启local_infile或者服务端拒绝时,
+        改为分块执行多行的 INSERT IGNORE ... VALUES.重复键的行会被忽略并产生警告,可以通过 SHOW WARNINGS 查看.
+        Args:
+            table_name: 表名,可以为 库名.表名
+            source: 已经存在的文件路径,或者数据行的可迭代对象,行为字典或者字段值的序列
+            columns: 导入的字段,字段名列表或者{行中的字段名或者下标: 表的字段名},为None时使用第一行字典的字段名,
+                序列行和文件按位置导入表的所有字段
+            fields_terminated: 字段分隔符
+            lines_terminated: 行分隔符
+            escaped_by: 转义字符
+            chunk_size: 改为INSERT时每个分块的最大行数
+        Returns:
+            (导入的条数, 警告的条数),失败时为(0, 0)
+        LOAD DATA LOCAL INFILE '/tmp/fessql_x/rows.fifo' INTO TABLE `traffic` CHARACTER SET utf8mb4
+        FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (`IMEI`, `count`)
+
+        """
+        data_format = LoadDataFormat(fields_terminated, lines_terminated, escaped_by)
+        loader = BulkLoader(table_name, source, columns, data_format, chunk_size)
+        if loader.empty:
+            return 0, 0
+
+        loaded = warnings = 0
+        try:
+            with self.conn.cursor() as cursor:
+                loaded_local = False
+                if loader.can_load_local(self.conn):
+                    with loader.local_file() as path:
+                        try:
+                            loaded = cursor.execute(loader.load_sql(path))
+                            loaded_local = True
+                        except pymysql.Error as e:
+                            if not is_local_infile_rejected(e):
+                                raise
+                            aelog.warning(f"LOAD DATA LOCAL INFILE is rejected, use INSERT instead: {e}")
+                if loaded_local:
+                    warnings = cursor._result.warning_count
+                else:
+                    for _, sql, args in loader.insert_sql():
+                        loaded += cursor.execute(sql, args)
+                        warnings += cursor._result.warning_count
+        except pymysql.Error as e:
+            self.conn.rollback()
+            aelog.exception(e)
+            return 0, 0
+        except Exception as e:
+            self.conn.rollback()
+            aelog.exception(e)
+            return 0, 0
+        else:
+            self.conn.commit()
+        return loaded, warnings
+
     def execute(self, sql: str, args_data: Optional[Union[Tuple, List, Dict[str, Any]]] = None) -> int:
         """
             执行单条记录，更新、插入或者删除
@@ -183,3 +290,56 @@ class TinyMysql(object):
         else:
             # noinspection PyTypeChecker
             return cursor.fetchall() if not size else cursor.fetchmany(size)
+
+    def iter_rows(self, sql: str, args: Optional[Union[Tuple, List, Dict[str, Any]]] = None, batch_size: int = 1000,
+                  *, as_tuple: bool = False, batched: bool = False
+                  ) -> Generator[Union[Dict[str, Any], Tuple, List[Union[Dict[str, Any], Tuple]]], None, None]:
+        """
+            流式查询数据
+
+        使用SSDictCursor或者SSCursor服务端游标每次读取batch_size行,不缓存整个结果集,适用于大表的数据修复脚本.
+        迭代期间不能使用同一个TinyMysql执行其他的SQL;中途退出时关闭连接,不再读取剩余的数据,之后的操作会重新连接.
+        查询或者读取时出错会关闭连接并抛出pymysql的异常,不会返回不完整的结果.
+        eg: for rows in mysql.iter_rows("SELECT id, name FROM users WHERE id > %s", (0,), 2000, batched=True):
+                ...
+        Args:
+            sql: sql 语句
+            args: 查询参数
+            batch_size: 每次从服务端读取的行数
+            as_tuple: 是否返回tuple的行,不再为每行生成dict,字段的顺序和SQL中的一致
+            batched: 是否按批返回,每次返回batch_size行的列表
+        Returns:
+            生成器,每次返回一行或者一批数据
+        """
+        if not isinstance(batch_size, int) or batch_size <= 0:
+            raise FuncArgsError("batch_size must be a positive integer!")
+
+        conn = self.conn
+        cursor = conn.cursor(SSCursor if as_tuple else SSDictCursor)
+        finished = False
+        try:
+            cursor.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if batched:
+                    yield rows
+                else:
+                    yield from rows
+            finished = True
+        except pymysql.Error as e:
+            # 中途断开或者超时时抛出异常,否则截断的结果会被当作完整的结果
+            aelog.exception(e)
+            raise
+        finally:
+            if finished:
+                cursor.close()
+            else:
+                # 未读取完的服务端游标关闭时需要读取剩余的数据,所以直接关闭连接
+                try:
+                    conn.close()
+                except pymysql.Error:
+                    pass
+                if self._conn is conn:
+                    self._conn = None
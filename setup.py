@@ -39,7 +39,7 @@ setup(name='fessql',
       packages=['fessql', 'fessql.aioalchemy', 'fessql.dbalchemy'],
       include_package_data=True,
       entry_points={},
-      install_requires=['aelog>=1.0.6,<=1.0.9', 'sqlalchemy>=1.2.12,<=1.3.23', ],
+      install_requires=['aelog>=1.0.6,<=1.0.9', 'sqlalchemy>=1.3.0,<=1.3.23', ],
       extras_require={
           "sanic": ['aiomysql>=0.0.20,<=0.0.22', ],
           "flask": ['PyMySQL<=0.9.3,>=0.9', ],
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午3:40
+
+宽表insert默认值的生成耗时,对比每次扫描model和从字段元数据注册表读取
+
+python tests/bench_model_meta.py
+"""
+import timeit
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+from fessql.aioalchemy import SanicMySQL
+
+mysql_db = SanicMySQL()
+
+
+def gen_wide_model(column_count: int):
+    """
+    生成有column_count个字段的宽表model,一半字段有默认值
+    """
+    fields = {"id": sa.Column(sa.Integer, primary_key=True)}
+    for index in range(column_count):
+        if index % 2:
+            fields[f"field_{index}"] = sa.Column(sa.String(32), default="", index=index % 10 == 1)
+        else:
+            fields[f"field_{index}"] = sa.Column(sa.DateTime, default=datetime.now, onupdate=datetime.now)
+    return type(f"Wide{column_count}Model", (mysql_db.Model,), {"__tablename__": f"bench_wide_{column_count}",
+                                                                **fields})
+
+
+def scan_default_value(model) -> dict:
+    """
+    注册表之前的实现,每次insert都扫描一次model
+    """
+    default_values = {}
+    for key, val in model.__dict__.items():
+        if not key.startswith("_") and isinstance(val, InstrumentedAttribute):
+            if val.default:
+                if val.default.is_callable:
+                    default_values[key] = val.default.arg.__wrapped__()
+                else:
+                    default_values[key] = val.default.arg
+    return default_values
+
+
+def main(number: int = 2000):
+    """
+    Args:
+        number: 每种情况执行的次数
+    """
+    print(f"{'columns':>8} {'scan(us)':>10} {'registry(us)':>13} {'speedup':>8}")
+    for column_count in (10, 50, 100, 200):
+        model = gen_wide_model(column_count)
+        query = mysql_db.query.model(model)
+        assert scan_default_value(model).keys() == query._get_model_default_value().keys()
+
+        scan_cost = timeit.timeit(lambda: scan_default_value(model), number=number) / number * 1e6
+        registry_cost = timeit.timeit(query._get_model_default_value, number=number) / number * 1e6
+        print(f"{column_count:>8} {scan_cost:>10.2f} {registry_cost:>13.2f} {scan_cost / registry_cost:>7.1f}x")
+    print(mysql_db.model_registry.stats())
+
+
+if __name__ == '__main__':
+    main()
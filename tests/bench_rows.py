@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 下午10:20
+
+大量查询结果行的内存占用,对比RowProxy和紧凑行CompactRow
+
+紧凑行在读取时就处理了字段值,sqlalchemy的RowProxy在访问字段时才处理,所以有处理函数的字段读取耗时会多一些
+
+python tests/bench_rows.py
+"""
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+import sqlalchemy as sa
+from aiomysql.sa.result import RowProxy as AioRowProxy
+
+from fessql._rows import fetch_compact, make_compact_rows
+
+metadata = sa.MetaData()
+bench_table = sa.Table("bench_rows", metadata,
+                       sa.Column("id", sa.Integer, primary_key=True),
+                       sa.Column("name", sa.String(32)),
+                       sa.Column("age", sa.Integer),
+                       sa.Column("score", sa.Float),
+                       sa.Column("created_time", sa.DateTime))
+
+
+def measure(load):
+    """
+    执行load并返回(结果, 占用的内存MB, 耗时ms),结果保持引用时统计
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    cost = (time.perf_counter() - start) * 1000
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 1024 / 1024, cost
+
+
+def main(row_count: int = 100000):
+    """
+    Args:
+        row_count: 行数
+    """
+    engine = sa.create_engine("sqlite://")
+    metadata.create_all(engine)
+    now = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(bench_table.insert(), [{"id": index, "name": f"name_{index}", "age": index % 80,
+                                             "score": index / 3, "created_time": now} for index in range(row_count)])
+
+    raw_rows = engine.execute(bench_table.select()).fetchall()
+    raw_rows = [tuple(row) for row in raw_rows]
+    keys = [column.name for column in bench_table.columns]
+    keymap = {key: (None, None, index) for index, key in enumerate(keys)}
+
+    with engine.connect() as conn:
+        cases = [
+            ("sqlalchemy RowProxy", lambda: conn.execute(bench_table.select()).fetchall()),
+            ("compact row(sqlalchemy)", lambda: fetch_compact(conn.execute(bench_table.select()))),
+            ("aiomysql RowProxy", lambda: [AioRowProxy(None, tuple(row), [None] * len(keys), keymap)
+                                           for row in raw_rows]),
+            ("compact row(raw tuple)", lambda: make_compact_rows(keys, None, [tuple(row) for row in raw_rows])),
+        ]
+        print(f"{'rows':>8} {'format':<26} {'memory(MB)':>11} {'time(ms)':>9}")
+        for name, load in cases:
+            rows, memory, cost = measure(load)
+            assert len(rows) == row_count
+            print(f"{row_count:>8} {name:<26} {memory:>11.2f} {cost:>9.1f}")
+            del rows
+
+    compact = make_compact_rows(keys, None, raw_rows[:1])[0]
+    assert compact.name == compact["name"] == dict(compact)["name"] == compact[1]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/17 下午5:10
+
+大量分表时每个分表的内存占用和生成耗时,对比gen_model生成的declarative类和shard_model生成的ShardModel
+
+统计时包含了生成分表后第一次编译select语句,ShardModel的字段代理在第一次访问时才生成
+
+python tests/bench_shard_models.py
+"""
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from fessql.aioalchemy import SanicMySQL
+
+mysql_db = SanicMySQL()
+
+
+class ShardOrderModel(mysql_db.Model):  # type:ignore
+    """
+    订单
+    """
+    __tablename__ = "bench_shard_order"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    order_code = sa.Column(sa.String(32), index=True, unique=True, nullable=False)
+    uid = sa.Column(sa.Integer, index=True)
+    status = sa.Column(sa.SmallInteger, default=0)
+    amount = sa.Column(sa.Numeric(10, 2))
+    remark = sa.Column(sa.String(255), default="")
+    created_time = sa.Column(sa.DateTime, default=datetime.now)
+    updated_time = sa.Column(sa.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+def measure(load):
+    """
+    执行load并返回(结果, 占用的内存MB, 耗时ms),结果保持引用时统计
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    cost = (time.perf_counter() - start) * 1000
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 1024 / 1024, cost
+
+
+def gen_models(shard_count: int, offset: int):
+    """
+    gen_model生成分表并编译一次查询
+    """
+    models = []
+    for index in range(offset, offset + shard_count):
+        model = mysql_db.gen_model(ShardOrderModel, table_suffix=f"{index:05d}")
+        str(mysql_db.query.model(model).where(model.uid == 1).select_query()._query_obj)
+        models.append(model)
+    return models
+
+
+def shard_models(shard_count: int, offset: int):
+    """
+    shard_model生成分表并编译一次查询
+    """
+    models = []
+    for index in range(offset, offset + shard_count):
+        model = mysql_db.shard_model(ShardOrderModel, f"{index:05d}")
+        str(mysql_db.query.model(model).where(model.uid == 1).select_query()._query_obj)
+        models.append(model)
+    return models
+
+
+def main():
+    """
+    Args:
+
+    """
+    mysql_db.model_cache.resize(100000)
+    print(f"{'shards':>8} {'model':<12} {'memory(MB)':>11} {'per shard(KB)':>14} {'time(ms)':>9} {'tables':>7}")
+    offset = 0
+    for shard_count in (1000, 5000):
+        for name, load in (("gen_model", gen_models), ("shard_model", shard_models)):
+            models, memory, cost = measure(lambda: load(shard_count, offset))
+            assert len(models) == shard_count
+            print(f"{shard_count:>8} {name:<12} {memory:>11.2f} {memory * 1024 / shard_count:>14.2f} "
+                  f"{cost:>9.1f} {len(mysql_db.Model.metadata.tables):>7}")
+            offset += shard_count
+            del models
+            # 清空后在相同的基础上统计,淘汰的model从metadata中删除
+            mysql_db.model_cache.clear()
+            gc.collect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午5:30
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from fessql._bulk import BatchWriter
+from fessql.aioalchemy import SanicMySQL
+from fessql.aioalchemy.sanic_mysql import Session
+from fessql.dbalchemy import FesMgrSession, FesQuery, FesSession
+from fessql.dbalchemy.dbalchemy import DBAlchemy
+from fessql.err import FuncArgsError
+
+mysql_db = SanicMySQL()
+sync_db = DBAlchemy()
+
+
+class LogModel(mysql_db.Model):  # type:ignore
+    """
+    日志
+    """
+    __tablename__ = "batch_log"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    status = sa.Column(sa.SmallInteger, default=0, doc='状态')
+
+
+class SyncLogModel(sync_db.Model):  # type:ignore
+    """
+    日志
+    """
+    __tablename__ = "batch_sync_log"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    status = sa.Column(sa.SmallInteger, default=0, doc='状态')
+
+
+class FakeCursor(object):
+    """
+    查询主键的游标
+    """
+    returns_rows = True
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetchall(self):
+        return self.rows
+
+
+class FakeSession(Session):
+    """
+    按照BatchWriter记录的最后一个主键从内存中的ids查询下一批,删除或者更新时从ids中移除
+    """
+
+    def __init__(self, writer, ids):
+        super().__init__(None, {}, "")
+        self.writer = writer
+        self.ids = sorted(ids)
+        self.selects = 0
+
+    async def _query_execute(self, query, params=None):
+        self.selects += 1
+        last_id = self.writer._last_key[0] if self.writer._last_key is not None else 0
+        column = self.writer._keys[0]
+        return FakeCursor([{column: one_id} for one_id in self.ids if one_id > last_id][:self.writer.batch_size])
+
+    async def _delete_execute(self, query):
+        ids = {value for name, value in query.compile().construct_params().items() if name.startswith("id_")}
+        self.ids = [one_id for one_id in self.ids if one_id not in ids]
+        return len(ids)
+
+
+class TestBatchWriter(unittest.TestCase):
+    """
+    测试异步session分批删除的结束条件、限速和进度回调
+    """
+
+    @staticmethod
+    def _batch_delete(ids, **kwargs):
+        writer = BatchWriter(LogModel, [LogModel.status == 1], **kwargs)
+        session = FakeSession(writer, ids)
+        delays = []
+
+        async def sleep(delay):
+            delays.append(delay)
+
+        with mock.patch("fessql.aioalchemy.sanic_mysql.asyncio.sleep", new=sleep):
+            rowcount = asyncio.get_event_loop().run_until_complete(session._batch_write(writer, 3))
+        return rowcount, session, delays
+
+    def test_termination(self):
+        """
+            Args:
+        """
+        # 最后一批不满batch_size时不再查询下一批
+        rowcount, session, delays = self._batch_delete(range(1, 13), batch_size=5)
+        self.assertEqual((rowcount, session.ids, session.selects, delays), (12, [], 3, []))
+        # 正好整批时再查询一次,没有数据后结束
+        rowcount, session, _ = self._batch_delete(range(1, 11), batch_size=5)
+        self.assertEqual((rowcount, session.selects), (10, 3))
+        rowcount, session, _ = self._batch_delete([], batch_size=5)
+        self.assertEqual((rowcount, session.selects), (0, 1))
+
+    def test_throttle(self):
+        """
+            Args:
+        """
+        _, _, delays = self._batch_delete(range(1, 13), batch_size=5, pause=0.2)
+        self.assertEqual(delays, [0.2, 0.2])
+        # 每批5行,每秒最多10行时每批之后暂停0.5秒减去执行的时间,和pause取较大的值
+        _, _, delays = self._batch_delete(range(1, 13), batch_size=5, max_rows_per_second=10)
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(all(0.4 < delay <= 0.5 for delay in delays))
+        _, _, delays = self._batch_delete(range(1, 13), batch_size=5, pause=1, max_rows_per_second=10)
+        self.assertEqual(delays, [1, 1])
+
+    def test_progress(self):
+        """
+            Args:
+        """
+        progress = []
+
+        async def async_progress(total, rowcount):
+            progress.append((total, rowcount))
+
+        self._batch_delete(range(1, 13), batch_size=5, progress=async_progress)
+        self.assertEqual(progress, [(5, 5), (10, 5), (12, 2)])
+        writer = BatchWriter(LogModel, batch_size=5, progress=lambda total, rowcount: total * 10)
+        self.assertEqual(writer.finish_batch(5, 0), (50, 0))
+        self.assertEqual(writer.finish_batch(3, 0), (80, 0))
+        for kwargs in ({"batch_size": 0}, {"pause": -1}, {"max_rows_per_second": -1}):
+            with self.assertRaises(FuncArgsError):
+                BatchWriter(LogModel, **kwargs)
+
+
+class TestSyncBatchWrite(unittest.TestCase):
+    """
+    测试同步FesQuery分批删除和更新
+    """
+
+    def setUp(self):
+        """
+            Args:
+        """
+        engine = sa.create_engine("sqlite://")
+        sync_db.Model.metadata.create_all(engine, tables=[SyncLogModel.__table__])
+        engine.execute(SyncLogModel.__table__.insert(), [{"id": index, "status": index % 2} for index in range(1, 24)])
+        self.engine = engine
+        self.scoped_session = orm.scoped_session(orm.sessionmaker(bind=engine, class_=FesSession, query_cls=FesQuery))
+        self.session = FesMgrSession(self.scoped_session)
+
+    def tearDown(self):
+        """
+            Args:
+        """
+        self.scoped_session.remove()
+        self.engine.dispose()
+
+    def test_delete(self):
+        """
+            Args:
+        """
+        progress = []
+        with mock.patch("fessql.dbalchemy._query.time.sleep") as sleep:
+            rowcount = self.session.query(SyncLogModel).filter(SyncLogModel.status == 1).delete(
+                batch_size=5, pause=0.1, progress=lambda total, one_count: progress.append((total, one_count)))
+        # 12行分为5、5、2三批,最后一批之后不暂停
+        self.assertEqual(rowcount, 12)
+        self.assertEqual(progress, [(5, 5), (10, 5), (12, 2)])
+        self.assertEqual([call[0][0] for call in sleep.call_args_list], [0.1, 0.1])
+        self.assertEqual(self.engine.execute("SELECT count(*) FROM batch_sync_log").scalar(), 11)
+
+    def test_update(self):
+        """
+            Args:
+        """
+        with mock.patch("fessql.dbalchemy._query.time.sleep") as sleep:
+            rowcount = self.session.query(SyncLogModel).filter(SyncLogModel.status == 0).update(
+                {"status": 2}, batch_size=11, max_rows_per_second=10)
+        # 11行正好一批,再查询一次没有数据后结束
+        self.assertEqual(rowcount, 11)
+        self.assertEqual(sleep.call_count, 1)
+        self.assertTrue(1 < sleep.call_args[0][0] <= 1.1)
+        self.assertEqual(self.engine.execute("SELECT count(*) FROM batch_sync_log WHERE status = 2").scalar(), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午2:40
+"""
+import asyncio
+import unittest
+
+import sqlalchemy as sa
+from pymysql.converters import escape_item
+# noinspection PyProtectedMember
+from aiomysql.sa.engine import _dialect
+
+from fessql._bulk import MAX_BIND_PARAMS, gen_case_updates, parse_upsert_result
+from fessql.aioalchemy import SanicMySQL
+from fessql.err import FuncArgsError
+
+mysql_db = SanicMySQL()
+
+
+class GoodsModel(mysql_db.Model):  # type:ignore
+    """
+    商品
+    """
+    __tablename__ = "bulk_goods"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    price = sa.Column(sa.Integer, doc='价格')
+    stock = sa.Column(sa.Integer, doc='库存')
+    updated_time = sa.Column(sa.Integer, doc='更新时间')
+
+
+class TestCaseUpdates(unittest.TestCase):
+    """
+    测试批量更新合并的CASE语句
+    """
+
+    def test_chunk_size(self):
+        """
+            Args:
+        """
+        rows = [{"id": index, "price": index} for index in range(2500)]
+        self.assertEqual([len(query.compile(dialect=_dialect).construct_params())
+                          for query in gen_case_updates(GoodsModel, rows, chunk_size=1000)], [3000, 3000, 1500])
+
+    def test_max_bind_params(self):
+        """
+            Args:
+        """
+        # 每行2个字段时占用5个参数,另外有1个onupdate的参数
+        max_rows = (MAX_BIND_PARAMS - 1) // 5
+        rows = [{"id": index, "price": index, "stock": index} for index in range(max_rows + 10)]
+        queries = list(gen_case_updates(GoodsModel, rows, chunk_size=MAX_BIND_PARAMS,
+                                        onupdate_value={"updated_time": 1}))
+        param_counts = [len(query.compile(dialect=_dialect).construct_params()) for query in queries]
+        self.assertEqual(param_counts, [max_rows * 5 + 1, 10 * 5 + 1])
+        self.assertLessEqual(max(param_counts), MAX_BIND_PARAMS)
+
+    def test_merge_rows(self):
+        """
+            Args:
+        """
+        rows = [{"id": 2, "price": 1}, {"id": 1, "stock": 3}, {"id": 2, "price": 5}]
+        query, = gen_case_updates(GoodsModel, rows)
+        compiled = query.compile(dialect=_dialect)
+        # 按照key排序,key相同时后面的值覆盖前面的值
+        self.assertEqual(list(compiled.construct_params().values()), [2, 5, 1, 3, 1, 2])
+        with self.assertRaises(FuncArgsError):
+            list(gen_case_updates(GoodsModel, [{"price": 1}]))
+        with self.assertRaises(FuncArgsError):
+            list(gen_case_updates(GoodsModel, rows, chunk_size=0))
+
+
+class TestParseUpsertResult(unittest.TestCase):
+    """
+    测试解析INSERT ... ON DUPLICATE KEY UPDATE的插入和更新条数
+    """
+
+    def test_info(self):
+        """
+            Args:
+        """
+        self.assertEqual(parse_upsert_result(3, 4, b"Records: 3  Duplicates: 1  Warnings: 0"), (2, 1))
+        self.assertEqual(parse_upsert_result(3, 3, "Records: 3  Duplicates: 1  Warnings: 0"), (2, 1))
+        self.assertEqual(parse_upsert_result(2, 0, b"Records: 2  Duplicates: 2  Warnings: 0"), (0, 2))
+
+    def test_without_info(self):
+        """
+            Args:
+        """
+        self.assertEqual(parse_upsert_result(1, 1), (1, 0))
+        self.assertEqual(parse_upsert_result(1, 2), (0, 1))
+        self.assertEqual(parse_upsert_result(1, 0), (0, 1))
+        self.assertEqual(parse_upsert_result(3, 5), (1, 2))
+        self.assertEqual(parse_upsert_result(3, 9), (0, 3))
+        self.assertEqual(parse_upsert_result(3, 2, b""), (3, 0))
+
+
+class TestInsertChunks(unittest.TestCase):
+    """
+    测试批量插入按照语句字节数和行数分块
+    """
+
+    @staticmethod
+    def _chunks(insert_rows, **kwargs):
+        query = mysql_db.query.model(GoodsModel).insert_batch_query(insert_rows, **kwargs)
+
+        async def gen_chunks():
+            return [chunk async for chunk in query._gen_insert_chunks(lambda value: escape_item(value, "utf8"),
+                                                                      "utf8")]
+
+        return asyncio.get_event_loop().run_until_complete(gen_chunks())
+
+    def test_max_packet_size(self):
+        """
+            Args:
+        """
+        rows = [{"id": index, "price": index * 100, "stock": 1} for index in range(1000)]
+        chunks = self._chunks(rows, max_packet_size=1000)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(statement) <= 1000 for _, statement in chunks))
+        self.assertEqual(sum(row_count for row_count, _ in chunks), 1000)
+        # 再加上下一块的第一行就会超过限制
+        for (_, statement), (_, next_statement) in zip(chunks, chunks[1:]):
+            next_value = next_statement.partition(b" VALUES ")[2].split(b"),(")[0]
+            self.assertGreater(len(statement) + len(b",") + len(next_value) + len(b")"), 1000)
+        self.assertEqual(chunks[0][1][:chunks[0][1].index(b" VALUES ")],
+                         b"INSERT INTO bulk_goods (id, price, stock)")
+        self.assertEqual([row_count for row_count, _ in self._chunks(rows, max_rows=300)], [300, 300, 300, 100])
+
+    def test_oversized_row(self):
+        """
+            Args:
+        """
+        rows = [{"id": 1, "price": 1, "stock": 1}, {"id": 2, "price": 10 ** 20, "stock": 1},
+                {"id": 3, "price": 1, "stock": 1}]
+        # 超过限制的单行单独生成一块,不和其他行合并
+        chunks = self._chunks(rows, max_packet_size=len(b"INSERT INTO bulk_goods (id, price, stock) "
+                                                        b"VALUES (1,1,1)"))
+        self.assertEqual([row_count for row_count, _ in chunks], [1, 1, 1])
+        self.assertTrue(chunks[1][1].endswith(b"VALUES (2,100000000000000000000,1)"))
+
+    def test_async_iterator(self):
+        """
+            Args:
+        """
+        async def read_rows():
+            for index in range(5):
+                await asyncio.sleep(0)
+                yield {"id": index, "price": index, "stock": index}
+
+        chunks = self._chunks(read_rows(), max_rows=2)
+        self.assertEqual([row_count for row_count, _ in chunks], [2, 2, 1])
+        self.assertTrue(chunks[-1][1].endswith(b"VALUES (4,4,4)"))
+        with self.assertRaises(FuncArgsError):
+            self._chunks([{"id": 1, "price": 1}, {"id": 2, "stock": 1}])
+        with self.assertRaises(FuncArgsError):
+            mysql_db.query.model(GoodsModel).insert_batch_query({"id": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
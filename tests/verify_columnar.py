@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午6:30
+"""
+import unittest
+from array import array
+from decimal import Decimal
+from unittest import mock
+
+import sqlalchemy as sa
+
+from fessql import _columnar
+from fessql._columnar import ColumnarBuilder, fetch_columnar
+
+
+class TestColumnarBuilder(unittest.TestCase):
+    """
+    测试按列收集时数值字段的array类型和转换为列表
+    """
+
+    def setUp(self):
+        """
+            Args:
+        """
+        # 不依赖是否安装了numpy,数值字段都按照array校验
+        patcher = mock.patch.object(_columnar, "numpy", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _build(*batches, keys=("value",), processors=None):
+        builder = ColumnarBuilder(keys, processors)
+        for rows in batches:
+            builder.append(rows)
+        return builder.build()
+
+    def test_int_to_float(self):
+        """
+            Args:
+        """
+        column = self._build([(1,), (2,)])["value"]
+        self.assertEqual((column.typecode, column.tolist()), ("q", [1, 2]))
+        # 整数的array中追加浮点数时转换为浮点数的array,之后的整数也按照浮点数存储
+        column = self._build([(1,), (2,)], [(2.5,)], [(3,)])["value"]
+        self.assertEqual((column.typecode, column.tolist()), ("d", [1.0, 2.0, 2.5, 3.0]))
+        column = self._build([(1,), (0.5,)])["value"]
+        self.assertEqual((column.typecode, column.tolist()), ("d", [1.0, 0.5]))
+
+    def test_overflow(self):
+        """
+            Args:
+        """
+        self.assertEqual(self._build([(2 ** 63,), (1,)])["value"], [2 ** 63, 1])
+        # 之后的批次溢出时已有的数据也转换为列表
+        column = self._build([(1,), (2,)], [(2 ** 64,)])["value"]
+        self.assertIsInstance(column, list)
+        self.assertEqual(column, [1, 2, 2 ** 64])
+        column = self._build([(-2 ** 63,), (2 ** 63 - 1,)])["value"]
+        self.assertEqual((column.typecode, column.tolist()), ("q", [-2 ** 63, 2 ** 63 - 1]))
+
+    def test_none_decimal(self):
+        """
+            Args:
+        """
+        result = self._build([(1, Decimal("1.50"), "a"), (None, Decimal("2"), None)], keys=("id", "amount", "name"))
+        self.assertEqual(result, {"id": [1, None], "amount": [Decimal("1.50"), Decimal("2")], "name": ["a", None]})
+        # 数值字段之后出现NULL时转换为列表
+        self.assertEqual(self._build([(1,)], [(None,)], [(3,)])["value"], [1, None, 3])
+        self.assertEqual(self._build([(True,), (False,)])["value"], [True, False])
+        # 结果处理函数在判断类型之前执行
+        column = self._build([("1",), ("2",)], processors=[int])["value"]
+        self.assertEqual((column.typecode, column.tolist()), ("q", [1, 2]))
+
+    def test_empty(self):
+        """
+            Args:
+        """
+        self.assertEqual(self._build(keys=("id", "name")), {"id": [], "name": []})
+        self.assertEqual(self._build([], keys=("id", "name")), {"id": [], "name": []})
+        self.assertEqual(self._build(keys=()), {})
+
+    def test_fetch_columnar(self):
+        """
+            Args:
+        """
+        engine = sa.create_engine("sqlite://")
+        engine.execute("CREATE TABLE columnar_user (id INTEGER, name TEXT, score REAL)")
+        engine.execute("INSERT INTO columnar_user VALUES (1, 'a', 1.5), (2, 'b', NULL), (3, 'c', 2)")
+        result = fetch_columnar(engine.execute("SELECT id, name, score FROM columnar_user ORDER BY id"), batch_size=2)
+        self.assertEqual(result["id"], array("q", [1, 2, 3]))
+        self.assertEqual((result["name"], result["score"]), (["a", "b", "c"], [1.5, None, 2.0]))
+        result = fetch_columnar(engine.execute("SELECT id FROM columnar_user ORDER BY id"), batch_size=2, size=1)
+        self.assertEqual(result["id"].tolist(), [1])
+        self.assertEqual(fetch_columnar(engine.execute("SELECT id FROM columnar_user WHERE id > 3")), {"id": []})
+        self.assertEqual(fetch_columnar(engine.execute("DELETE FROM columnar_user")), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/16 上午11:20
+"""
+import unittest
+from datetime import datetime
+
+import sqlalchemy as sa
+# noinspection PyProtectedMember
+from aiomysql.sa.engine import _dialect
+from pymysql.converters import escape_item
+from sqlalchemy import bindparam, orm
+
+from fessql.aioalchemy import SanicMySQL
+from fessql.aioalchemy._compiled import CompiledCache
+from fessql.dbalchemy import FesMgrSession, FesPreparedQuery, FesQuery, FesSession
+from fessql.dbalchemy.dbalchemy import DBAlchemy
+
+mysql_db = SanicMySQL()
+sync_db = DBAlchemy()
+
+
+class OrderModel(mysql_db.Model):  # type:ignore
+    """
+    订单
+    """
+    __tablename__ = "cache_order"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    order_code = sa.Column(sa.String(32), index=True, unique=True, nullable=False, doc='订单编码')
+    amount = sa.Column(sa.Numeric(10, 2), doc='金额')
+    created_time = sa.Column(sa.DateTime, default=datetime(2020, 1, 1), nullable=False, doc='创建时间')
+
+
+class SyncOrderModel(sync_db.Model):  # type:ignore
+    """
+    订单
+    """
+    __tablename__ = "cache_sync_order"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    order_code = sa.Column(sa.String(32), doc='订单编码')
+
+
+class TestCompiledCache(unittest.TestCase):
+    """
+    测试编译SQL缓存生成的SQL和直接编译一致
+    """
+
+    @staticmethod
+    def _direct(statement):
+        compiled = statement.compile(dialect=_dialect)
+        return str(compiled), {key: compiled._bind_processors.get(key, lambda x: x)(val)
+                               for key, val in compiled.construct_params().items()}
+
+    def _assert_cached(self, gen_statement):
+        cache = CompiledCache(_dialect)
+        for value in (1, 2, 3):
+            compiled = cache.compile(gen_statement(value))
+            self.assertEqual((compiled.sql, compiled.construct_params()), self._direct(gen_statement(value)))
+        self.assertEqual(cache.stats()["miss_count"], 1)
+        self.assertEqual(cache.stats()["hit_count"], 2)
+
+    def test_select(self):
+        """
+            Args:
+        """
+        self._assert_cached(lambda v: mysql_db.query.model(OrderModel).where(
+            OrderModel.id > v, OrderModel.order_code.in_([str(v), "a"])).order_by(
+            OrderModel.id.desc()).paginate_query(page=v, per_page=10)._query_obj)
+
+    def test_select_count(self):
+        """
+            Args:
+        """
+        self._assert_cached(lambda v: mysql_db.query.model(OrderModel).where(
+            OrderModel.amount.between(v, v + 10)).select_query(is_count=True)._query_count_obj)
+
+    def test_insert(self):
+        """
+            Args:
+        """
+        self._assert_cached(lambda v: mysql_db.query.model(OrderModel).insert_query(
+            {"id": v, "order_code": str(v)})._query_obj)
+
+    def test_update(self):
+        """
+            Args:
+        """
+        self._assert_cached(lambda v: mysql_db.query.model(OrderModel).where(
+            OrderModel.id == v).update_query({"amount": OrderModel.amount + v})._query_obj)
+
+    def test_structure_differs(self):
+        """
+            Args:
+        """
+        cache = CompiledCache(_dialect)
+        first = cache.compile(sa.select([OrderModel]).where(OrderModel.id == 1))
+        second = cache.compile(sa.select([OrderModel]).where(OrderModel.id > 1))
+        self.assertNotEqual(first.sql, second.sql)
+        self.assertEqual(cache.stats()["miss_count"], 2)
+
+
+class TestPreparedQuery(unittest.TestCase):
+    """
+    测试查询模板和每次生成的查询SQL一致
+    """
+
+    @staticmethod
+    def _render(sql_params):
+        return sql_params["sql"] % {key: escape_item(value, "utf8") for key, value in sql_params["params"].items()}
+
+    def test_same_sql(self):
+        """
+            Args:
+        """
+        template = mysql_db.query.model(OrderModel).where(
+            OrderModel.id > bindparam("id"), OrderModel.order_code == bindparam("code"),
+            OrderModel.created_time.between(bindparam("start"), bindparam("end"))).order_by(
+            OrderModel.id.desc()).paginate_query(page=2, per_page=10).prepare()
+        for one_id, code, start in ((1, "a", datetime(2026, 1, 1)), (2, "b'c", datetime(2026, 2, 1))):
+            query = mysql_db.query.model(OrderModel).where(
+                OrderModel.id > one_id, OrderModel.order_code == code,
+                OrderModel.created_time.between(start, datetime(2026, 12, 31))).order_by(
+                OrderModel.id.desc()).paginate_query(page=2, per_page=10).select_query()
+            # 分页查询的sql()同时返回查询和数量查询的SQL
+            self.assertEqual(self._render(template.sql({"id": one_id, "code": code, "start": start,
+                                                        "end": datetime(2026, 12, 31)})),
+                             self._render(query.sql()[0]))
+
+    def test_count(self):
+        """
+            Args:
+        """
+        base_query = mysql_db.query.model(OrderModel).where(OrderModel.amount > bindparam("amount")).generative()
+        template = base_query.prepare(is_count=True)
+        for amount in (1, 20):
+            self.assertEqual(self._render(template.sql({"amount": amount})), self._render(
+                mysql_db.query.model(OrderModel).where(OrderModel.amount > amount).select_query(is_count=True).sql()))
+
+    def test_immutable(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(OrderModel).where(OrderModel.id == bindparam("id"))
+        template = query.prepare()
+        sql = template.sql({"id": 1})
+        # 生成模板之后修改查询不影响模板
+        query.where(OrderModel.amount > 1).order_by(OrderModel.id)
+        self.assertEqual(template.sql({"id": 1}), sql)
+        with self.assertRaises(AttributeError):
+            template._compiled = None
+
+    def test_sync_prepare(self):
+        """
+            Args:
+        """
+        engine = sa.create_engine("sqlite://")
+        sync_db.Model.metadata.create_all(engine, tables=[SyncOrderModel.__table__])
+        engine.execute(SyncOrderModel.__table__.insert(), [{"id": index, "order_code": f"code{index}"}
+                                                           for index in range(1, 6)])
+        scoped_session = orm.scoped_session(orm.sessionmaker(bind=engine, class_=FesSession, query_cls=FesQuery))
+        session = FesMgrSession(scoped_session)
+        template = session.query(SyncOrderModel.id, SyncOrderModel.order_code).filter(
+            SyncOrderModel.id > bindparam("id")).order_by(SyncOrderModel.id).prepare()
+        self.assertIsInstance(template, FesPreparedQuery)
+        for one_id in (1, 3):
+            self.assertEqual([tuple(row) for row in session.query_execute(template, {"id": one_id})],
+                             [tuple(row) for row in session.query(SyncOrderModel.id, SyncOrderModel.order_code).filter(
+                                 SyncOrderModel.id > one_id).order_by(SyncOrderModel.id).all()])
+        # 不同的参数值共用模板中缓存的编译结果
+        self.assertEqual(len(template.compiled_cache), 1)
+        with self.assertRaises(AttributeError):
+            template.statement = None
+        scoped_session.remove()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午4:00
+"""
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import pymysql
+import sqlalchemy as sa
+
+from fessql._count import (COUNT_AUTO, COUNT_ESTIMATE, COUNT_EXACT, CountCache, gen_table_rows_sql, is_estimable,
+                           parse_explain_rows, parse_table_rows, verify_count_strategy)
+from fessql.aioalchemy import SanicMySQL
+from fessql.aioalchemy.sanic_mysql import SessionReader
+from fessql.err import FuncArgsError
+
+mysql_db = SanicMySQL()
+
+
+class UserModel(mysql_db.Model):  # type:ignore
+    """
+    用户
+    """
+    __tablename__ = "count_user"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    status = sa.Column(sa.SmallInteger, default=0, doc='状态')
+
+
+class TestCountCache(unittest.TestCase):
+    """
+    测试分页总数缓存的版本号、过期和写入表的识别
+    """
+
+    def setUp(self):
+        """
+            Args:
+        """
+        self.cache = CountCache(ttl=60)
+        self.key = self.cache.gen_key("SELECT count(*) FROM count_user", {"status_1": 1}, "exact")
+
+    def _cache_total(self, bind=None, tables=("count_user",), total=(10, False)):
+        self.cache.set(bind, self.key, self.cache.versions(bind, tables), total)
+
+    def test_hit(self):
+        """
+            Args:
+        """
+        self._cache_total()
+        self.assertEqual(self.cache.get(None, self.key, self.cache.versions(None, ["count_user"])), (10, False))
+        self.assertIsNone(self.cache.get("other", self.key, self.cache.versions("other", ["count_user"])))
+        self.assertIsNone(self.cache.get(None, self.cache.gen_key("SELECT count(*) FROM count_user", {"status_1": 2},
+                                                                  "exact"), self.cache.versions(None, [])))
+        self.assertEqual((self.cache.hit_count, self.cache.miss_count), (1, 2))
+
+    def test_versions(self):
+        """
+            Args:
+        """
+        self._cache_total()
+        self.cache.invalidate_write(None, "UPDATE other_table SET status = 1")
+        self.assertEqual(self.cache.get(None, self.key, self.cache.versions(None, ["count_user"])), (10, False))
+        self.cache.invalidate_write(None, UserModel.__table__.update().values(status=1))
+        self.assertIsNone(self.cache.get(None, self.key, self.cache.versions(None, ["count_user"])))
+
+        # 无法获取写入的表时整个bind失效
+        self._cache_total()
+        self.cache.invalidate_write(None, "CALL fix_users()")
+        self.assertIsNone(self.cache.get(None, self.key, self.cache.versions(None, ["count_user"])))
+        self._cache_total()
+        self.cache.invalidate_write(None, tables=["count_user"])
+        self.assertIsNone(self.cache.get(None, self.key, self.cache.versions(None, ["count_user"])))
+
+    def test_write_during_query(self):
+        """
+            Args:
+        """
+        # 查询总数之前获取版本号,查询期间的写入使这次查询的总数不会命中
+        versions = self.cache.versions(None, ["count_user"])
+        self.cache.invalidate_write(None, "DELETE FROM count_user WHERE id = 1")
+        self.cache.set(None, self.key, versions, (10, False))
+        self.assertIsNone(self.cache.get(None, self.key, self.cache.versions(None, ["count_user"])))
+
+    def test_ttl(self):
+        """
+            Args:
+        """
+        with mock.patch("fessql._count.time.monotonic", return_value=100.0):
+            self._cache_total()
+        versions = self.cache.versions(None, ["count_user"])
+        with mock.patch("fessql._count.time.monotonic", return_value=160.0):
+            self.assertEqual(self.cache.get(None, self.key, versions), (10, False))
+        with mock.patch("fessql._count.time.monotonic", return_value=160.5):
+            self.assertIsNone(self.cache.get(None, self.key, versions))
+        self.assertFalse(CountCache(ttl=0).enabled)
+
+    def test_disabled_invalidate(self):
+        """
+            Args:
+        """
+        for cache in (CountCache(ttl=0), CountCache(ttl=60, invalidate_on_write=False)):
+            cache.invalidate_write(None, "DELETE FROM count_user")
+            self.assertEqual(cache.versions(None, ["count_user"]), (0, 0))
+
+    def test_write_tables(self):
+        """
+            Args:
+        """
+        for sql, tables in (
+                ("INSERT INTO count_user (id) VALUES (1)", ["count_user"]),
+                ("insert ignore into `db`.`count_user` (id) values (1)", ["count_user"]),
+                (" REPLACE LOW_PRIORITY INTO count_user VALUES (1)", ["count_user"]),
+                ("UPDATE IGNORE `count_user` SET status = 1", ["count_user"]),
+                ("DELETE QUICK FROM db.count_user WHERE id = 1", ["count_user"]),
+                ("LOAD DATA LOCAL INFILE '/tmp/it''s.txt' REPLACE INTO TABLE `count_user` FIELDS", ["count_user"]),
+                (b"DELETE FROM count_user", ["count_user"]),
+                (sa.text("UPDATE count_user SET status = :status"), ["count_user"]),
+                ("SELECT * FROM count_user", None),
+                ("CALL fix_users()", None),
+                (None, None)):
+            self.assertEqual(CountCache.write_tables(sql), tables, sql)
+        self.assertEqual(CountCache.write_tables(sa.delete(UserModel.__table__)), ["count_user"])
+
+
+class FakeCursor(object):
+    """
+    返回指定EXPLAIN结果的游标
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def execute(self, sql, args=None):
+        self.connection.executed.append(sql)
+        if self.connection.error is not None:
+            raise self.connection.error
+
+    async def fetchall(self):
+        return self.connection.rows
+
+    async def close(self):
+        pass
+
+
+class FakeEngine(object):
+    """
+    估算总数时使用的连接
+    """
+
+    def __init__(self, rows, error=None):
+        self.connection = self
+        self.rows = rows
+        self.error = error
+        self.executed = []
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def autocommit(self, value):
+        pass
+
+    async def cursor(self, cursor_class):
+        return FakeCursor(self)
+
+
+class TestCountStrategy(unittest.TestCase):
+    """
+    测试估算总数的解析以及estimate、auto策略的选择
+    """
+
+    @staticmethod
+    def _query_total(query, count_strategy, rows, count_threshold=1000, error=None):
+        engine = FakeEngine(rows, error)
+        session = SessionReader(engine, {}, "")
+
+        async def find_count(_):
+            return SimpleNamespace(count=20)
+
+        session.find_count = find_count
+        total = asyncio.get_event_loop().run_until_complete(session._query_total(
+            query.select_query(is_count=True), count_strategy, count_threshold))
+        return total, engine.executed
+
+    def test_parse(self):
+        """
+            Args:
+        """
+        self.assertEqual(parse_explain_rows([{"rows": 1000, "filtered": 10.0}, {"rows": 5, "filtered": 100.0}]), 100)
+        self.assertEqual(parse_explain_rows([{"rows": 1000, "filtered": None}]), 1000)
+        self.assertEqual(parse_explain_rows([{"rows": 3, "filtered": 50.0}]), 2)
+        self.assertIsNone(parse_explain_rows([{"rows": None, "Extra": "Select tables optimized away"}]))
+        self.assertIsNone(parse_explain_rows([]))
+        self.assertEqual(parse_table_rows([{"TABLE_ROWS": 12}]), 12)
+        self.assertIsNone(parse_table_rows([{"TABLE_ROWS": None}]))
+        self.assertIsNone(parse_table_rows([]))
+        self.assertEqual(gen_table_rows_sql(sa.Table("count_other", sa.MetaData(), schema="db"))[1],
+                         {"schema": "db", "table_name": "count_other"})
+        with self.assertRaises(FuncArgsError):
+            verify_count_strategy("fast")
+
+    def test_is_estimable(self):
+        """
+            Args:
+        """
+        table = UserModel.__table__
+        self.assertEqual(is_estimable(sa.select([sa.func.count()]).select_from(table)), (True, table))
+        self.assertEqual(is_estimable(sa.select([sa.func.count()]).where(UserModel.status == 1)), (True, None))
+        self.assertEqual(is_estimable(sa.select([sa.func.count()]).select_from(table).group_by(UserModel.status)),
+                         (False, None))
+        self.assertEqual(is_estimable(sa.select([UserModel.status]).distinct()), (False, None))
+
+    def test_estimate(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(UserModel).where(UserModel.status == 1)
+        self.assertEqual(self._query_total(query, COUNT_ESTIMATE, [{"rows": 50, "filtered": 10.0}]), (
+            (5, True), ["EXPLAIN SELECT count(*) AS count \nFROM count_user \n"
+                        "WHERE count_user.`status` = %(status_1)s"]))
+        # 没有查询条件时使用information_schema中的行数
+        total, executed = self._query_total(mysql_db.query.model(UserModel), COUNT_ESTIMATE, [{"TABLE_ROWS": 7}])
+        self.assertEqual(total, (7, True))
+        self.assertTrue(executed[0].startswith("SELECT TABLE_ROWS FROM information_schema.TABLES"))
+        # 精确统计时不执行EXPLAIN
+        self.assertEqual(self._query_total(query, COUNT_EXACT, [{"rows": 50, "filtered": 10.0}]), ((20, False), []))
+
+    def test_auto_threshold(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(UserModel).where(UserModel.status == 1)
+        # 估算的总数小于阈值时精确统计,否则使用估算的总数
+        self.assertEqual(self._query_total(query, COUNT_AUTO, [{"rows": 999, "filtered": 100.0}])[0], (20, False))
+        self.assertEqual(self._query_total(query, COUNT_AUTO, [{"rows": 1000, "filtered": 100.0}])[0], (1000, True))
+        self.assertEqual(self._query_total(query, COUNT_AUTO, [{"rows": 5000, "filtered": 10.0}])[0], (20, False))
+        self.assertEqual(self._query_total(query, COUNT_AUTO, [{"rows": 5000, "filtered": 10.0}],
+                                           count_threshold=500)[0], (500, True))
+
+    def test_fallback_exact(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(UserModel).where(UserModel.status == 1)
+        # 无法估算时都是精确统计
+        self.assertEqual(self._query_total(query.copy().group_by(UserModel.status), COUNT_ESTIMATE,
+                                           [{"rows": 50, "filtered": 100.0}]), ((20, False), []))
+        self.assertEqual(self._query_total(query, COUNT_ESTIMATE, [{"rows": None}])[0], (20, False))
+        with mock.patch("fessql.aioalchemy.sanic_mysql.aelog.exception") as exception:
+            total, executed = self._query_total(query, COUNT_ESTIMATE, [], error=pymysql.OperationalError(1, "lost"))
+        self.assertEqual((total, len(executed), exception.call_count), ((20, False), 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午7:30
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from fessql._export import EXPORT_NDJSON, ExportWriter
+from fessql._rows import make_compact_rows
+from fessql.err import FuncArgsError
+
+
+class TestExportWriter(unittest.TestCase):
+    """
+    测试导出CSV和NDJSON的编码、表头和统计信息
+    """
+
+    keys = ("id", "name", "amount", "created_time")
+
+    def _rows(self, *rows):
+        return make_compact_rows(self.keys, None, rows)
+
+    def test_csv(self):
+        """
+            Args:
+        """
+        sink = io.StringIO()
+        writer = ExportWriter(sink)
+        writer.write_rows(self._rows((1, "张三", Decimal("1.50"), datetime(2026, 10, 18, 19, 30))))
+        writer.write_rows(self._rows((2, "a,\"b\"", None, date(2026, 10, 18))))
+        stats = writer.close()
+        # 表头只在第一批写入
+        self.assertEqual(sink.getvalue(), 'id,name,amount,created_time\r\n1,张三,1.50,2026-10-18 19:30:00\r\n'
+                                          '2,"a,""b""",,2026-10-18\r\n')
+        self.assertEqual((stats["rows"], stats["bytes"]), (2, len(sink.getvalue().encode())))
+
+        sink = io.BytesIO()
+        writer = ExportWriter(sink, header=False, encoding="gbk", csv_options={"delimiter": "\t"})
+        writer.write_rows(self._rows((1, "张三", Decimal("1.50"), None)))
+        self.assertEqual(sink.getvalue(), "1\t张三\t1.50\t\r\n".encode("gbk"))
+        self.assertEqual(writer.close()["bytes"], len(sink.getvalue()))
+
+    def test_ndjson(self):
+        """
+            Args:
+        """
+        sink = io.BytesIO()
+        writer = ExportWriter(sink, EXPORT_NDJSON)
+        writer.write_rows(self._rows((1, "张三", Decimal("1.50"), datetime(2026, 10, 18, 19, 30, 0, 5)),
+                                     (2, b"\x00\xff", timedelta(seconds=90), time(8, 0))))
+        lines = sink.getvalue().decode().splitlines()
+        # 中文不转义,datetime、Decimal、bytes等json不支持的类型转换为字符串
+        self.assertIn("张三", lines[0])
+        self.assertEqual([json.loads(line) for line in lines], [
+            {"id": 1, "name": "张三", "amount": "1.50", "created_time": "2026-10-18T19:30:00.000005"},
+            {"id": 2, "name": "AP8=", "amount": "0:01:30", "created_time": "08:00:00"}])
+        self.assertEqual(writer.close()["bytes"], len(sink.getvalue()))
+
+        writer = ExportWriter(io.StringIO(), EXPORT_NDJSON)
+        with self.assertRaises(TypeError):
+            writer.write_rows(self._rows((1, object(), None, None)))
+
+    def test_no_rows(self):
+        """
+            Args:
+        """
+        for export_format in ("csv", EXPORT_NDJSON):
+            sink = io.StringIO()
+            progress = []
+            writer = ExportWriter(sink, export_format, progress=progress.append)
+            self.assertIsNone(writer.write_rows([]))
+            stats = writer.close()
+            # 没有数据时不写入表头,也不调用进度回调
+            self.assertEqual((sink.getvalue(), stats["rows"], stats["bytes"], progress), ("", 0, 0, []))
+            self.assertFalse(sink.closed)
+
+    def test_path_sink(self):
+        """
+            Args:
+        """
+        progress = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "users.csv")
+            writer = ExportWriter(path, progress=lambda stats: progress.append(stats["rows"]))
+            writer.write_rows(self._rows((1, "a", None, None)))
+            writer.write_rows(self._rows((2, "b", None, None), (3, "c", None, None)))
+            stats = writer.close()
+            self.assertEqual(writer.close(), stats)
+            with open(path, newline="", encoding="utf-8") as csv_file:
+                self.assertEqual([row[:2] for row in csv.reader(csv_file)],
+                                 [["id", "name"], ["1", "a"], ["2", "b"], ["3", "c"]])
+        self.assertEqual(progress, [1, 3])
+        self.assertEqual(stats["bytes"], len("id,name,amount,created_time\r\n1,a,,\r\n2,b,,\r\n3,c,,\r\n"))
+        for args in ((object(),), (io.StringIO(), "xml")):
+            with self.assertRaises(FuncArgsError):
+                ExportWriter(*args)
+
+
+if __name__ == '__main__':
+    unittest.main()
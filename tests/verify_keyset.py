@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午2:10
+"""
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+
+import sqlalchemy as sa
+# noinspection PyProtectedMember
+from aiomysql.sa.engine import _dialect
+
+from fessql._keyset import KeysetOrder
+from fessql.aioalchemy import SanicMySQL
+from fessql.err import FuncArgsError
+
+mysql_db = SanicMySQL()
+
+
+class OrderModel(mysql_db.Model):  # type:ignore
+    """
+    订单
+    """
+    __tablename__ = "keyset_order"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    amount = sa.Column(sa.Numeric(10, 2), doc='金额')
+    created_time = sa.Column(sa.DateTime, nullable=False, doc='创建时间')
+
+
+class TestKeysetOrder(unittest.TestCase):
+    """
+    测试keyset分页的游标和定位条件
+    """
+
+    @staticmethod
+    def _sql(clause):
+        compiled = clause.compile(dialect=_dialect)
+        return str(compiled), compiled.construct_params()
+
+    def test_cursor(self):
+        """
+            Args:
+        """
+        order = KeysetOrder([OrderModel.created_time.desc(), OrderModel.amount], [OrderModel.id])
+        self.assertEqual(order.names, ["created_time", "amount", "id"])
+        self.assertEqual(order.descs, [True, False, False])
+        row = {order.columns[0]: datetime(2026, 10, 18, 14, 10, 5, 123), order.columns[1]: Decimal("10.50"),
+               order.columns[2]: 7}
+        for backward in (False, True):
+            values, cursor_backward = order.decode_cursor(order.encode_cursor(row, backward))
+            self.assertEqual(values, [datetime(2026, 10, 18, 14, 10, 5, 123), Decimal("10.50"), 7])
+            self.assertIsInstance(values[1], Decimal)
+            self.assertIs(cursor_backward, backward)
+
+        date_order = KeysetOrder([sa.column("day"), sa.column("code"), sa.column("remark")])
+        values = [date(2026, 1, 2), b"\x00\xff", None]
+        self.assertEqual(date_order.decode_cursor(date_order.encode_cursor(values, getter=lambda one_row, column: (
+            one_row[date_order.columns.index(column)])))[0], values)
+
+    def test_cursor_error(self):
+        """
+            Args:
+        """
+        order = KeysetOrder([OrderModel.id])
+        # 排序字段不同的游标
+        cursor = KeysetOrder([OrderModel.amount], [OrderModel.id]).encode_cursor(None, getter=lambda row, column: 1)
+        for one_cursor in (cursor, "not a cursor", ""):
+            with self.assertRaises(FuncArgsError):
+                order.decode_cursor(one_cursor)
+        with self.assertRaises(FuncArgsError):
+            order.encode_cursor(None, getter=lambda row, column: object())
+
+    def test_where(self):
+        """
+            Args:
+        """
+        order = KeysetOrder([OrderModel.amount, OrderModel.id])
+        self.assertEqual(self._sql(order.where([1, 2]))[0],
+                         "(keyset_order.amount, keyset_order.id) > (%(param_1)s, %(param_2)s)")
+        self.assertEqual(self._sql(order.where([1, 2], backward=True))[0],
+                         "(keyset_order.amount, keyset_order.id) < (%(param_1)s, %(param_2)s)")
+
+    def test_where_mixed_direction(self):
+        """
+            Args:
+        """
+        order = KeysetOrder([OrderModel.created_time.desc(), OrderModel.amount], [OrderModel.id])
+        sql, params = self._sql(order.where([datetime(2026, 1, 1), 10, 3]))
+        self.assertEqual(sql, "keyset_order.created_time < %(param_1)s "
+                              "OR keyset_order.created_time = %(param_1)s AND keyset_order.amount > %(param_2)s "
+                              "OR keyset_order.created_time = %(param_1)s AND keyset_order.amount = %(param_2)s "
+                              "AND keyset_order.id > %(param_3)s")
+        self.assertEqual(params, {"param_1": datetime(2026, 1, 1), "param_2": 10, "param_3": 3})
+        # 向前翻页时所有比较方向反转
+        backward_sql, _ = self._sql(order.where([datetime(2026, 1, 1), 10, 3], backward=True))
+        self.assertEqual(backward_sql, sql.replace("<", "#").replace(">", "<").replace("#", ">"))
+        self.assertEqual([str(clause) for clause in order.order_by(backward=True)],
+                         ["keyset_order.created_time ASC", "keyset_order.amount DESC", "keyset_order.id DESC"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午3:00
+"""
+import io
+import unittest
+
+from fessql._loaddata import LoadDataFormat
+from fessql.err import FuncArgsError
+
+
+class TestLoadDataFormat(unittest.TestCase):
+    """
+    测试LOAD DATA文件格式的编码和解析
+    """
+
+    rows = [
+        ["a\tb", "line\nbreak", "back\\slash", None, "N", "\\N", "", True, 12, b"\x00\xffz"],
+        ["x|y", "c\r\nd", "^,,^", None, "", "Nx", "\0", False, 1.5, b""],
+    ]
+
+    @staticmethod
+    def _expected(value):
+        if value is None:
+            return None
+        if isinstance(value, bool):
+            return "1" if value else "0"
+        if isinstance(value, bytes):
+            return value.decode("utf-8", "surrogateescape")
+        return str(value)
+
+    def _assert_round_trip(self, load_format):
+        data = b"".join(load_format.encode_rows(self.rows)).decode("utf-8", "surrogateescape")
+        self.assertEqual(list(load_format.parse(io.StringIO(data))),
+                         [[self._expected(value) for value in row] for row in self.rows])
+
+    def test_round_trip(self):
+        """
+            Args:
+        """
+        self._assert_round_trip(LoadDataFormat())
+        self._assert_round_trip(LoadDataFormat("|", "\r\n"))
+        self._assert_round_trip(LoadDataFormat(",,", "\n", "^"))
+
+    def test_encode(self):
+        """
+            Args:
+        """
+        load_format = LoadDataFormat()
+        self.assertEqual(b"".join(load_format.encode_rows([["a\tb", None, "c\\"], [1]])), b"a\\\tb\t\\N\tc\\\\\n1\n")
+        self.assertEqual(load_format.sql(), "FIELDS TERMINATED BY '\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'")
+
+    def test_format_error(self):
+        """
+            Args:
+        """
+        for args in (("", "\n"), ("\n", "\n"), ("\t", "\n", ""), ("\t", "\n", "\t")):
+            with self.assertRaises(FuncArgsError):
+                LoadDataFormat(*args)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 上午11:40
+"""
+import gc
+import unittest
+
+import sqlalchemy as sa
+# noinspection PyProtectedMember
+from aiomysql.sa.engine import _dialect
+
+from fessql._shard import shard_statement
+from fessql.aioalchemy import SanicMySQL
+from fessql.aioalchemy._compiled import CompiledCache
+
+mysql_db = SanicMySQL()
+
+
+class OrderModel(mysql_db.Model):  # type:ignore
+    """
+    订单
+    """
+    __tablename__ = "cache_shard_order"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    uid = sa.Column(sa.Integer, index=True, doc='用户ID')
+    amount = sa.Column(sa.Integer, doc='金额')
+
+
+class TestModelCache(unittest.TestCase):
+    """
+    测试gen_model生成的分表model的缓存
+    """
+
+    def tearDown(self):
+        """
+            Args:
+        """
+        mysql_db.model_cache.discard(OrderModel)
+        # 淘汰的model回收后才从declarative的模块注册表中删除
+        gc.collect()
+
+    def test_warm_then_gen_model(self):
+        """
+            Args:
+        """
+        warmed = mysql_db.warm_models(OrderModel, ["01", "02"])
+        model = mysql_db.gen_model(OrderModel, table_suffix="01")
+        self.assertIs(model, warmed[0])
+        self.assertIs(mysql_db.gen_model(OrderModel, class_suffix="02", table_suffix="02"), warmed[1])
+        self.assertEqual(model.__tablename__, "cache_shard_order_01")
+        self.assertEqual(mysql_db.model_cache.stats()["size"], 2)
+
+        statement = mysql_db.query.model(OrderModel).where(OrderModel.uid == 1).select_query()._query_obj
+        self.assertIn("cache_shard_order_01.uid", str(shard_statement(statement, OrderModel, model)))
+
+    def test_same_table_variants(self):
+        """
+            Args:
+        """
+        # 字段不同的同一个分表以及原表,都访问实际的表
+        model = mysql_db.gen_model(OrderModel, "01", "01")
+        part_model = mysql_db.gen_model(OrderModel, "01", "01", fields=["id", "uid"])
+        base_model = mysql_db.gen_model(OrderModel)
+        self.assertIsNot(model, part_model)
+        self.assertIs(mysql_db.Model.metadata.tables["cache_shard_order_01"], model.__table__)
+        compiled_cache = CompiledCache(_dialect)
+        for one_model, table_name, columns in ((model, "cache_shard_order_01", "id, uid, amount"),
+                                               (part_model, "cache_shard_order_01", "id, uid"),
+                                               (base_model, "cache_shard_order", "id, uid, amount")):
+            statement = mysql_db.query.model(one_model).where(one_model.uid == 1).select_query()._query_obj
+            columns_sql = ", ".join(f"{table_name}.{column}" for column in columns.split(", "))
+            self.assertEqual(compiled_cache.compile(statement).sql,
+                             f"SELECT {columns_sql} \nFROM {table_name} \nWHERE {table_name}.uid = %(uid_1)s")
+
+    def test_evict(self):
+        """
+            Args:
+        """
+        max_size = mysql_db.model_cache.max_size
+        try:
+            mysql_db.model_cache.resize(1)
+            first_table = mysql_db.gen_model(OrderModel, table_suffix="01").__table__
+            mysql_db.gen_model(OrderModel, table_suffix="02")
+            self.assertNotIn(first_table.name, mysql_db.Model.metadata.tables)
+            gc.collect()
+            self.assertIsNot(mysql_db.gen_model(OrderModel, table_suffix="01").__table__, first_table)
+        finally:
+            mysql_db.model_cache.resize(max_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午5:00
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+import sqlalchemy as sa
+
+from fessql._count import CountCache
+from fessql.aioalchemy import Pagination, SanicMySQL
+from fessql.aioalchemy.query import Query
+from fessql.aioalchemy.sanic_mysql import SessionReader
+
+mysql_db = SanicMySQL()
+
+
+class UserModel(mysql_db.Model):  # type:ignore
+    """
+    用户
+    """
+    __tablename__ = "query_user"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    name = sa.Column(sa.String(32), doc='名称')
+    status = sa.Column(sa.SmallInteger, default=0, doc='状态')
+
+
+class FakeSession(object):
+    """
+    记录翻页时查询的session
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    async def _find_data(self, query):
+        self.queries.append(query)
+        return []
+
+
+class TestQueryCopy(unittest.TestCase):
+    """
+    测试查询默认在当前查询上修改,generative()和copy()之后原查询不变
+    """
+
+    @staticmethod
+    def _state(query):
+        return list(query._whereclause), list(query._order_by), query._limit_clause, query._offset_clause
+
+    def test_in_place(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(UserModel)
+        self.assertIs(query.where(UserModel.status == 1), query)
+        self.assertIs(query.paginate_query(page=2, per_page=10), query)
+        self.assertEqual((len(query._whereclause), len(query._order_by), query._limit_clause, query._offset_clause),
+                         (1, 1, 10, 10))
+
+    def test_generative(self):
+        """
+            Args:
+        """
+        base_query = mysql_db.query.model(UserModel).where(UserModel.status == 1).generative()
+        state = self._state(base_query)
+        page_query = base_query.where(UserModel.name == "a").order_by(UserModel.name).paginate_query(
+            page=3, per_page=10)
+        self.assertIsNot(page_query, base_query)
+        self.assertEqual(self._state(base_query), state)
+        self.assertEqual((len(page_query._whereclause), len(page_query._order_by), page_query._limit_clause,
+                          page_query._offset_clause), (2, 1, 10, 20))
+        # 没有排序时分页追加的主键排序也不影响原查询
+        base_query.paginate_query(page=2, per_page=5)
+        self.assertEqual(self._state(base_query), state)
+        self.assertEqual(base_query._order_by, [])
+
+    def test_copy(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(UserModel).where(UserModel.status == 1).paginate_query(page=1, per_page=10)
+        state = self._state(query)
+        copy_query = query.copy()
+        # copy()之后的拷贝仍然是在拷贝上修改
+        self.assertIs(copy_query.where(UserModel.name == "a").order_by(UserModel.name).paginate_query(
+            page=2, per_page=5), copy_query)
+        self.assertEqual(self._state(query), state)
+        self.assertEqual((len(copy_query._whereclause), len(copy_query._order_by), copy_query._limit_clause,
+                          copy_query._offset_clause), (2, 2, 5, 5))
+        copy_query.select_query()
+        self.assertIsNot(query._query_obj, copy_query._query_obj)
+
+    def test_pagination_pages(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(UserModel).where(UserModel.status == 1).paginate_query(page=2, per_page=10)
+        session = FakeSession()
+        pagination = Pagination(session, query, 100, [])
+        next_page = asyncio.get_event_loop().run_until_complete(pagination.next())
+        prev_page = asyncio.get_event_loop().run_until_complete(pagination.prev())
+        # 翻页在查询的拷贝上执行,当前页的查询不变
+        self.assertEqual((next_page.page, prev_page.page, pagination.page), (3, 1, 2))
+        self.assertEqual((query._page, query._limit_clause, query._offset_clause), (2, 10, 10))
+        self.assertEqual([one_query._offset_clause for one_query in session.queries], [20, 0])
+        self.assertTrue(all(one_query is not query for one_query in session.queries))
+
+
+class TestCountQuery(unittest.TestCase):
+    """
+    测试分页总数的select语句只在需要时生成,条件不变时沿用
+    """
+
+    @staticmethod
+    def _find_many(query, items):
+        session = SessionReader(None, {}, "", count_cache=CountCache(ttl=60))
+
+        async def find_data(_):
+            return items
+
+        async def query_total(*_):
+            return 100, False
+
+        session._find_data, session._query_total = find_data, query_total
+        with mock.patch.object(Query, "_build_select", autospec=True, side_effect=Query._build_select) as build:
+            pagination = asyncio.get_event_loop().run_until_complete(session.find_many(query))
+        return pagination, [call[1]["is_count"] for call in build.call_args_list]
+
+    def test_short_first_page(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(UserModel).where(UserModel.status == 1).paginate_query(page=1, per_page=10)
+        pagination, build_counts = self._find_many(query, [{"id": 1}, {"id": 2}])
+        # 第一页不满一页时总数就是行数,不生成数量查询
+        self.assertEqual((pagination.total, build_counts), (2, []))
+        self.assertIsNone(query._query_count_obj)
+
+        pagination, build_counts = self._find_many(query, [{"id": index} for index in range(10)])
+        self.assertEqual((pagination.total, build_counts), (100, [True]))
+        self.assertIsNotNone(query._query_count_obj)
+        # 条件不变时再次查询沿用已经生成的数量查询
+        pagination, build_counts = self._find_many(query, [{"id": index} for index in range(10)])
+        self.assertEqual((pagination.total, build_counts), (100, []))
+
+    def test_rebuild(self):
+        """
+            Args:
+        """
+        query = mysql_db.query.model(UserModel).where(UserModel.status == 1).paginate_query(page=1, per_page=10)
+        count_obj = query._count_query()
+        self.assertIs(query._count_query(), count_obj)
+        # 翻页只改变limit和offset,沿用数量查询
+        next_query = query.copy().paginate_query(page=2, per_page=10)
+        self.assertIs(next_query._count_query(), count_obj)
+
+        next_query.where(UserModel.name == "a")
+        where_count_obj = next_query._count_query()
+        self.assertIsNot(where_count_obj, count_obj)
+        self.assertIn("query_user.name", str(where_count_obj))
+        self.assertNotIn("query_user.name", str(query._count_query()))
+        self.assertIs(query._count_query(), count_obj)
+        next_query.model(UserModel).group_by(UserModel.status)
+        self.assertIsNot(next_query._count_query(), where_count_obj)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 上午10:20
+"""
+import unittest
+from datetime import date, datetime
+
+import sqlalchemy as sa
+
+from fessql import PARTITION_DAY, PARTITION_MONTH, SHARD_CONSISTENT, ShardRouter, TimePartitionRouter
+from fessql.aioalchemy import SanicMySQL
+
+mysql_db = SanicMySQL()
+
+
+class LogModel(mysql_db.Model):  # type:ignore
+    """
+    日志
+    """
+    __tablename__ = "router_log"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    name = sa.Column(sa.String(32), doc='名称')
+    created_time = sa.Column(sa.DateTime, nullable=False, doc='创建时间')
+
+
+class TestShardRouter(unittest.TestCase):
+    """
+    测试按照分片键分组
+    """
+
+    def test_group(self):
+        """
+            Args:
+        """
+        router = ShardRouter(mysql_db, LogModel, "id", 4, binds=lambda index: f"log_db{index // 2}")
+        groups = router.group([5, 1, 9, 5, 2, 14, 1])
+        # 按照分片下标排序,每组中的值保持原顺序并且去重
+        self.assertEqual([(target.index, target.table_suffix, target.bind, values)
+                          for target, values in groups.items()],
+                         [(1, "01", "log_db0", [5, 1, 9]), (2, "02", "log_db1", [2, 14])])
+        self.assertEqual([target.model.__tablename__ for target in groups], ["router_log_01", "router_log_02"])
+        self.assertEqual(router.group([]), {})
+
+    def test_group_consistent(self):
+        """
+            Args:
+        """
+        router = ShardRouter(mysql_db, LogModel, "name", 8, strategy=SHARD_CONSISTENT)
+        values = [f"name{index}" for index in range(100)]
+        groups = router.group(values + values[:10])
+        self.assertEqual(sorted(value for one_values in groups.values() for value in one_values), sorted(values))
+        self.assertEqual(list(groups), sorted(groups, key=lambda target: target.index))
+        for target, one_values in groups.items():
+            self.assertTrue(all(router.route(value) is target for value in one_values))
+
+
+class TestTimePartitionRouter(unittest.TestCase):
+    """
+    测试按时间分表时从查询条件中获取范围和需要访问的分区
+    """
+
+    def setUp(self):
+        """
+            Args:
+        """
+        self.router = TimePartitionRouter(mysql_db, LogModel, "created_time", PARTITION_MONTH, "%Y%m", table_ttl=0)
+
+    def _suffixes(self, *whereclause, **kwargs):
+        return [target.table_suffix for target in self.router.targets(whereclause, **kwargs)]
+
+    def test_query_range(self):
+        """
+            Args:
+        """
+        created_time = LogModel.created_time
+        lower, upper = self.router.query_range([
+            created_time >= datetime(2026, 1, 10), created_time > datetime(2026, 1, 10),
+            created_time < datetime(2026, 3, 1), LogModel.name == "a"])
+        self.assertEqual(lower, (datetime(2026, 1, 10), False))
+        self.assertEqual(upper, (datetime(2026, 3, 1), False))
+        self.assertEqual(self.router.query_range([sa.or_(created_time > datetime(2026, 1, 10), LogModel.id == 1)]),
+                         (None, None))
+
+    def test_between(self):
+        """
+            Args:
+        """
+        created_time = LogModel.created_time
+        self.assertEqual(self.router.query_range([created_time.between(datetime(2026, 2, 2), datetime(2026, 4, 2))]),
+                         ((datetime(2026, 2, 2), True), (datetime(2026, 4, 2), True)))
+        self.assertEqual(self._suffixes(created_time.between(datetime(2026, 2, 2), datetime(2026, 4, 2))),
+                         ["202602", "202603", "202604"])
+        self.assertEqual(self._suffixes(created_time == datetime(2026, 4, 2)), ["202604"])
+
+    def test_exclusive_upper_period_start(self):
+        """
+            Args:
+        """
+        created_time = LogModel.created_time
+        self.assertEqual(self._suffixes(created_time >= datetime(2026, 1, 10), created_time < datetime(2026, 3, 1)),
+                         ["202601", "202602"])
+        self.assertEqual(self._suffixes(created_time >= datetime(2026, 1, 10), created_time <= datetime(2026, 3, 1)),
+                         ["202601", "202602", "202603"])
+        self.assertEqual(self._suffixes(created_time >= date(2026, 1, 10), created_time < date(2026, 3, 1)),
+                         ["202601", "202602"])
+        self.assertEqual(self._suffixes(created_time > datetime(2026, 5, 2), created_time < datetime(2026, 1, 2)), [])
+
+    def test_mixed_date_datetime(self):
+        """
+            Args:
+        """
+        created_time = LogModel.created_time
+        self.assertEqual(self.router.query_range([created_time >= date(2026, 1, 10),
+                                                  created_time > datetime(2026, 1, 10, 12)]),
+                         ((datetime(2026, 1, 10, 12), False), None))
+        self.assertEqual(self._suffixes(created_time >= date(2026, 1, 10), created_time < datetime(2026, 3, 2),
+                                        end=date(2026, 2, 20)), ["202601", "202602"])
+        self.assertEqual(self._suffixes(created_time >= datetime(2026, 1, 10, 8), start=date(2026, 2, 1),
+                                        end=date(2026, 3, 1)), ["202602", "202603"])
+        day_router = TimePartitionRouter(mysql_db, LogModel, "created_time", PARTITION_DAY, "%Y%m%d", table_ttl=0)
+        self.assertEqual(len(day_router.targets([created_time >= datetime(2026, 1, 30, 8)], end=date(2026, 2, 2))), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午7:00
+"""
+import pickle
+import unittest
+
+import sqlalchemy as sa
+
+from fessql._rows import CompactRow, compact_row_class, fetch_compact, make_compact_rows, verify_row_format
+from fessql.err import FuncArgsError
+
+
+class TestCompactRow(unittest.TestCase):
+    """
+    测试紧凑行的访问方式、保留的名称、重复的字段名和pickle
+    """
+
+    def test_access(self):
+        """
+            Args:
+        """
+        row, = make_compact_rows(("id", "name"), None, [(1, "a")])
+        self.assertIsInstance(row, CompactRow)
+        self.assertIsInstance(row, tuple)
+        self.assertEqual((row[0], row[-1], row[:1]), (1, "a", (1,)))
+        self.assertEqual((row["id"], row[sa.column("name")]), (1, "a"))
+        self.assertEqual((row.id, row.name), (1, "a"))
+        self.assertEqual(dict(row), {"id": 1, "name": "a"})
+        self.assertEqual((list(row), row.values(), list(row.items())), ([1, "a"], (1, "a"), [("id", 1), ("name", "a")]))
+        self.assertEqual((row.get("name"), row.get("other", 0)), ("a", 0))
+        self.assertTrue("id" in row and "other" not in row)
+        self.assertEqual(repr(row), "CompactRow((1, 'a'))")
+        for key in ("other", 5.0):
+            with self.assertRaises(KeyError):
+                row[key]
+        with self.assertRaises(AttributeError):
+            row.other
+        with self.assertRaises(AttributeError):
+            row.id = 2
+
+    def test_reserved_names(self):
+        """
+            Args:
+        """
+        row, = make_compact_rows(("keys", "count", "index", "_id", "get"), None, [(1, 2, 3, 4, 5)])
+        # count、index覆盖tuple的同名方法,keys、get和_开头的只能通过row["name"]访问
+        self.assertEqual((row.count, row.index), (2, 3))
+        self.assertEqual(row.keys(), ("keys", "count", "index", "_id", "get"))
+        self.assertEqual(row.get("get"), 5)
+        self.assertEqual((row["keys"], row["_id"], row["get"]), (1, 4, 5))
+        self.assertFalse(hasattr(row, "_id"))
+        self.assertEqual(dict(row), {"keys": 1, "count": 2, "index": 3, "_id": 4, "get": 5})
+
+    def test_duplicate_names(self):
+        """
+            Args:
+        """
+        row, = make_compact_rows(("id", "name", "id"), None, [(1, "a", 2)])
+        # 字段名重复时和RowProxy一样使用最后一个,按下标仍然可以访问所有的值
+        self.assertEqual((row["id"], row.id, row[0], row[2]), (2, 2, 1, 2))
+        self.assertEqual(len(row), 3)
+        self.assertEqual(list(row.items()), [("id", 1), ("name", "a"), ("id", 2)])
+
+    def test_pickle(self):
+        """
+            Args:
+        """
+        rows = make_compact_rows(("id", "count"), [None, str], [(1, 2), (3, None)])
+        self.assertEqual([row.count for row in rows], ["2", "None"])
+        loaded = pickle.loads(pickle.dumps(rows))
+        self.assertEqual(loaded, rows)
+        # 还原后使用同一个行类,访问方式不变
+        self.assertIs(type(loaded[0]), compact_row_class(("id", "count")))
+        self.assertEqual((loaded[1].id, loaded[1]["count"], loaded[1].count), (3, "None", "None"))
+        self.assertIs(compact_row_class(["id", "count"]), compact_row_class(("id", "count")))
+        self.assertIsNot(compact_row_class(("count", "id")), compact_row_class(("id", "count")))
+
+    def test_fetch_compact(self):
+        """
+            Args:
+        """
+        engine = sa.create_engine("sqlite://")
+        engine.execute("CREATE TABLE compact_user (id INTEGER, name TEXT)")
+        engine.execute("INSERT INTO compact_user VALUES (1, 'a'), (2, 'b')")
+        rows = fetch_compact(engine.execute("SELECT id, name FROM compact_user ORDER BY id"))
+        self.assertEqual([(row.id, row["name"]) for row in rows], [(1, "a"), (2, "b")])
+        self.assertEqual(len(fetch_compact(engine.execute("SELECT id FROM compact_user ORDER BY id"), size=1)), 1)
+        self.assertEqual(fetch_compact(engine.execute("DELETE FROM compact_user")), [])
+        with self.assertRaises(FuncArgsError):
+            verify_row_format("dict")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 上午11:00
+"""
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+import sqlalchemy as sa
+from sqlalchemy import delete, func
+
+from fessql._count import CountCache
+from fessql._shard import ShardAggregator, ShardMerger
+from fessql.aioalchemy import SanicMySQL
+from fessql.err import FuncArgsError
+
+mysql_db = SanicMySQL()
+
+
+class OrderModel(mysql_db.Model):  # type:ignore
+    """
+    订单
+    """
+    __tablename__ = "shard_order"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    uid = sa.Column(sa.Integer, index=True, doc='用户ID')
+    status = sa.Column(sa.SmallInteger, default=0, doc='状态')
+    amount = sa.Column(sa.Numeric(10, 2), doc='金额')
+    created_time = sa.Column(sa.DateTime, default=datetime(2020, 1, 1), nullable=False, doc='创建时间')
+
+
+class TestShardAggregator(unittest.TestCase):
+    """
+    测试跨分表聚合的部分聚合字段和合并
+    """
+
+    def test_partial_columns(self):
+        """
+            Args:
+        """
+        aggregator = ShardAggregator([OrderModel.status, func.count(OrderModel.id).label("total"),
+                                      func.avg(OrderModel.amount).label("avg_amount")])
+        self.assertEqual(aggregator.names, ["status", "total", "avg_amount"])
+        self.assertEqual(aggregator.group_indexes, [0])
+        self.assertEqual([column.name for column in aggregator.partial_columns[1:]],
+                         ["total", "avg_amount__sum", "avg_amount__count"])
+
+    def test_merge_avg(self):
+        """
+            Args:
+        """
+        aggregator = ShardAggregator([OrderModel.status, func.sum(OrderModel.amount).label("total"),
+                                      func.avg(OrderModel.amount).label("avg_amount")])
+        merged = aggregator.merge([
+            [(1, Decimal("30"), Decimal("30"), 3), (2, Decimal("10"), Decimal("10"), 1)],
+            [(1, Decimal("10"), Decimal("10"), 1)],
+        ])
+        # 按照各分表的SUM和COUNT合并后相除,不是两个分表AVG的平均值
+        self.assertEqual(merged, [(1, Decimal("40"), Decimal("10")), (2, Decimal("10"), Decimal("10"))])
+
+    def test_merge_null(self):
+        """
+            Args:
+        """
+        aggregator = ShardAggregator([
+            OrderModel.uid, func.count(OrderModel.amount).label("total"), func.sum(OrderModel.amount).label("amount"),
+            func.min(OrderModel.amount).label("min_amount"), func.max(OrderModel.amount).label("max_amount"),
+            func.avg(OrderModel.amount).label("avg_amount")])
+        merged = aggregator.merge([
+            [(None, 0, None, None, None, None, 0), (1, 2, 6, 2, 4, 6, 2)],
+            [(None, 1, 5, 5, 5, 5, 1), (1, 0, None, None, None, None, 0), (2, 0, None, None, None, None, 0)],
+        ])
+        self.assertEqual(merged, [(None, 1, 5, 5, 5, 5), (1, 2, 6, 2, 4, 3), (2, 0, None, None, None, None)])
+
+    def test_reject(self):
+        """
+            Args:
+        """
+        for columns in ([OrderModel.status, (func.sum(OrderModel.amount) + 1).label("s3")],
+                        [OrderModel.status, func.sum(OrderModel.amount)],
+                        [func.group_concat(OrderModel.id).label("ids")],
+                        [func.count(OrderModel.uid.distinct()).label("users")],
+                        []):
+            with self.assertRaises(FuncArgsError):
+                ShardAggregator(columns)
+
+
+class TestShardMerger(unittest.TestCase):
+    """
+    测试多个分表结果的归并
+    """
+
+    def test_null_order(self):
+        """
+            Args:
+        """
+        # 和MySQL一样正序时NULL在前,排序值相同时按照分表的顺序
+        merger = ShardMerger([OrderModel.amount, OrderModel.id])
+        results = [[{"amount": None, "id": 2}, {"amount": 1, "id": 1}],
+                   [{"amount": None, "id": 1}, {"amount": 1, "id": 1}, {"amount": 2, "id": 3}]]
+        self.assertEqual([(row["amount"], row["id"]) for row in merger.merge(results)],
+                         [(None, 1), (None, 2), (1, 1), (1, 1), (2, 3)])
+        self.assertEqual([(row["amount"], row["id"]) for row in merger.merge(results[::-1])],
+                         [(None, 1), (None, 2), (1, 1), (1, 1), (2, 3)])
+
+    def test_null_order_desc(self):
+        """
+            Args:
+        """
+        # 倒序时NULL在后
+        merger = ShardMerger([OrderModel.amount.desc(), OrderModel.id], limit=3, offset=1)
+        self.assertEqual(merger.shard_limit, 4)
+        results = [[{"amount": 2, "id": 1}, {"amount": None, "id": 2}],
+                   [{"amount": 3, "id": 1}, {"amount": None, "id": 1}]]
+        self.assertEqual([(row["amount"], row["id"]) for row in merger.merge(results)],
+                         [(2, 1), (None, 1), (None, 2)])
+
+    def test_without_order(self):
+        """
+            Args:
+        """
+        merger = ShardMerger(limit=2)
+        self.assertEqual(merger.merge([[{"id": 3}], [{"id": 1}, {"id": 2}]]), [{"id": 3}, {"id": 1}])
+        with self.assertRaises(FuncArgsError):
+            ShardMerger([OrderModel.id + 1])
+
+
+class TestShardModelCountTables(unittest.TestCase):
+    """
+    测试分页总数缓存按照ShardModel的分表表名失效
+    """
+
+    def test_tables(self):
+        """
+            Args:
+        """
+        shard_order = mysql_db.shard_model(OrderModel, "01")
+        count_query = mysql_db.query.model(shard_order).where(shard_order.uid == 1).select_query(is_count=True)
+        self.assertEqual(CountCache.statement_tables(count_query._query_count_obj), ["shard_order_01"])
+        self.assertEqual(CountCache.write_tables(delete(shard_order).where(shard_order.uid == 1)), ["shard_order_01"])
+        self.assertEqual(CountCache.write_tables(delete(OrderModel)), ["shard_order"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午6:00
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pymysql
+import sqlalchemy as sa
+from sqlalchemy import orm
+from sqlalchemy.pool import QueuePool
+
+from fessql.aioalchemy import SanicMySQL
+from fessql.aioalchemy.sanic_mysql import Session
+from fessql.dbalchemy import FesMgrSession, FesQuery, FesSession
+from fessql.dbalchemy.dbalchemy import DBAlchemy
+from fessql.err import FuncArgsError, HttpError
+
+mysql_db = SanicMySQL()
+sync_db = DBAlchemy()
+
+
+class UserModel(mysql_db.Model):  # type:ignore
+    """
+    用户
+    """
+    __tablename__ = "stream_user"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    name = sa.Column(sa.String(32), doc='名称')
+
+
+class SyncUserModel(sync_db.Model):  # type:ignore
+    """
+    用户
+    """
+    __tablename__ = "stream_sync_user"
+
+    id = sa.Column(sa.Integer, primary_key=True, doc='实例ID')
+    name = sa.Column(sa.String(32), doc='名称')
+
+
+class FakeResult(object):
+    """
+    服务端游标的结果,fail_after行之后读取失败
+    """
+    returns_rows = True
+
+    def __init__(self, rows, fail_after=None):
+        self.rows = rows
+        self.fail_after = fail_after
+        self.position = 0
+        self.closed = False
+
+    async def fetchmany(self, size):
+        if self.fail_after is not None and self.position >= self.fail_after:
+            raise pymysql.OperationalError(2013, "Lost connection to MySQL server during query")
+        rows = self.rows[self.position: self.position + size]
+        self.position += len(rows)
+        return rows
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeCursor(object):
+    """
+    服务端游标
+    """
+
+    async def execute(self, sql, args=None):
+        return 0
+
+
+class FakeConnection(object):
+    """
+    aiomysql的连接
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    async def autocommit(self, value):
+        pass
+
+    async def cursor(self, cursor_class):
+        return FakeCursor()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeEngine(object):
+    """
+    记录连接是否归还连接池
+    """
+
+    def __init__(self):
+        self.connection = FakeConnection()
+        self._dialect = None
+        self.released = False
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.released = True
+
+
+class TestStream(unittest.TestCase):
+    """
+    测试异步流式查询读取完和中途退出时连接的归还和关闭
+    """
+
+    rows = [(index, f"name{index}") for index in range(5)]
+
+    def _stream(self, fail_after=None, **kwargs):
+        engine = FakeEngine()
+        result = FakeResult(self.rows, fail_after)
+
+        async def create_result_proxy(*_):
+            return result
+
+        session = Session(engine, {4: {"zh": "查询数据失败"}}, "zh")
+        patcher = mock.patch("fessql.aioalchemy.sanic_mysql.create_result_proxy", new=create_result_proxy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return session.stream(mysql_db.query.model(UserModel).select_query(), **kwargs), engine, result
+
+    @staticmethod
+    def _run(coroutine):
+        return asyncio.get_event_loop().run_until_complete(coroutine)
+
+    def test_finished(self):
+        """
+            Args:
+        """
+        rows, engine, result = self._stream(batch_size=2)
+
+        async def read_rows():
+            return [row async for row in rows]
+
+        self.assertEqual(self._run(read_rows()), self.rows)
+        self.assertEqual(result.position, 5)
+        # 读取完时关闭结果并归还连接,连接继续使用
+        self.assertTrue(result.closed)
+        self.assertFalse(engine.connection.closed)
+        self.assertTrue(engine.released)
+
+    def test_aclose(self):
+        """
+            Args:
+        """
+        rows, engine, result = self._stream(batch_size=2)
+        self.assertEqual(self._run(rows.__anext__()), self.rows[0])
+        self._run(rows.aclose())
+        # 未读取完时不再读取剩余的数据,直接关闭连接
+        self.assertEqual(result.position, 2)
+        self.assertFalse(result.closed)
+        self.assertTrue(engine.connection.closed)
+        self.assertTrue(engine.released)
+
+        rows, engine, result = self._stream(batch_size=2)
+
+        async def break_rows():
+            async for _ in rows:
+                break
+            await rows.aclose()
+
+        self._run(break_rows())
+        self.assertTrue(engine.connection.closed)
+        self.assertTrue(engine.released)
+
+    def test_error(self):
+        """
+            Args:
+        """
+        rows, engine, result = self._stream(fail_after=2, batch_size=2)
+
+        async def read_rows():
+            return [row async for row in rows]
+
+        with mock.patch("fessql.aioalchemy.sanic_mysql.aelog.exception"):
+            with self.assertRaises(HttpError):
+                self._run(read_rows())
+        self.assertFalse(result.closed)
+        self.assertTrue(engine.connection.closed)
+        self.assertTrue(engine.released)
+
+        rows, engine, _ = self._stream(batch_size=0)
+        with self.assertRaises(FuncArgsError):
+            self._run(rows.__anext__())
+        self.assertFalse(engine.released)
+
+
+class TestSyncStream(unittest.TestCase):
+    """
+    测试同步FesQuery流式查询读取完和中途退出时连接的归还和失效
+    """
+
+    def setUp(self):
+        """
+            Args:
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        engine = sa.create_engine(f"sqlite:///{os.path.join(self.tmp_dir, 'stream.db')}", poolclass=QueuePool)
+        sync_db.Model.metadata.create_all(engine, tables=[SyncUserModel.__table__])
+        engine.execute(SyncUserModel.__table__.insert(), [{"id": index, "name": f"name{index}"} for index in range(5)])
+        self.invalidated = []
+        sa.event.listen(engine, "invalidate", lambda *args: self.invalidated.append(args))
+        self.engine = engine
+        self.scoped_session = orm.scoped_session(orm.sessionmaker(bind=engine, class_=FesSession, query_cls=FesQuery))
+        self.session = FesMgrSession(self.scoped_session)
+
+    def tearDown(self):
+        """
+            Args:
+        """
+        self.scoped_session.remove()
+        self.engine.dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def _stream(self, batch_size=2):
+        return self.session.query(SyncUserModel).order_by(SyncUserModel.id).stream(batch_size)
+
+    def test_finished(self):
+        """
+            Args:
+        """
+        rows = self._stream()
+        self.assertEqual([row.id for row in rows], list(range(5)))
+        # 读取完时关闭session归还连接,连接继续使用
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        self.assertEqual(self.invalidated, [])
+
+    def test_close(self):
+        """
+            Args:
+        """
+        rows = self._stream()
+        self.assertEqual(next(rows).id, 0)
+        self.assertEqual(self.engine.pool.checkedout(), 1)
+        rows.close()
+        # 未读取完时连接失效,连接池丢弃此连接
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        self.assertEqual(len(self.invalidated), 1)
+
+        for _ in self._stream():
+            break
+        self.assertEqual(len(self.invalidated), 2)
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        self.assertEqual([row.id for row in self._stream(3)], list(range(5)))
+        with self.assertRaises(FuncArgsError):
+            next(self._stream(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
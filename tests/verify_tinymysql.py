@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 2026/10/18 下午4:30
+"""
+import unittest
+from unittest import mock
+
+import pymysql
+from pymysql.cursors import SSCursor, SSDictCursor
+
+from fessql import TinyMysql
+from fessql.err import FuncArgsError
+
+
+class FakeCursor(object):
+    """
+    服务端游标,fail_after行之后读取失败
+    """
+
+    def __init__(self, rows, as_dict, fail_after=None):
+        self.rows = [dict(zip(("id", "name"), row)) if as_dict else row for row in rows]
+        self.fail_after = fail_after
+        self.position = 0
+        self.closed = False
+
+    def execute(self, sql, args=None):
+        return 0
+
+    def fetchmany(self, size):
+        if self.fail_after is not None and self.position >= self.fail_after:
+            raise pymysql.OperationalError(2013, "Lost connection to MySQL server during query")
+        rows = self.rows[self.position: self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection(object):
+    """
+    pymysql的连接
+    """
+
+    def __init__(self, rows, fail_after=None):
+        self.rows = rows
+        self.fail_after = fail_after
+        self.cursors = []
+        self.closed = False
+
+    def ping(self):
+        pass
+
+    def cursor(self, cursor_class):
+        cursor = FakeCursor(self.rows, cursor_class is SSDictCursor, self.fail_after)
+        self.cursors.append((cursor_class, cursor))
+        return cursor
+
+    def close(self):
+        self.closed = True
+
+
+class TestIterRows(unittest.TestCase):
+    """
+    测试TinyMysql流式查询的返回格式和连接的关闭
+    """
+
+    rows = [(index, f"name{index}") for index in range(5)]
+
+    def _mysql(self, fail_after=None):
+        mysql = TinyMysql("root", "")
+        mysql._conn = FakeConnection(self.rows, fail_after)
+        return mysql, mysql._conn
+
+    def test_shapes(self):
+        """
+            Args:
+        """
+        mysql, conn = self._mysql()
+        self.assertEqual(list(mysql.iter_rows("SELECT id, name FROM users", batch_size=2)),
+                         [{"id": index, "name": name} for index, name in self.rows])
+        self.assertEqual(list(mysql.iter_rows("SELECT id, name FROM users", batch_size=2, as_tuple=True)), self.rows)
+        self.assertEqual(list(mysql.iter_rows("SELECT id, name FROM users", batch_size=2, as_tuple=True,
+                                              batched=True)), [self.rows[:2], self.rows[2:4], self.rows[4:]])
+        self.assertEqual([len(rows) for rows in mysql.iter_rows("SELECT id, name FROM users", batch_size=3,
+                                                                batched=True)], [3, 2])
+        self.assertEqual([cursor_class for cursor_class, _ in conn.cursors],
+                         [SSDictCursor, SSCursor, SSCursor, SSDictCursor])
+        # 读取完时只关闭游标,连接继续使用
+        self.assertTrue(all(cursor.closed for _, cursor in conn.cursors))
+        self.assertFalse(conn.closed)
+        self.assertIs(mysql._conn, conn)
+        with self.assertRaises(FuncArgsError):
+            next(mysql.iter_rows("SELECT id, name FROM users", batch_size=0))
+
+    def test_early_exit(self):
+        """
+            Args:
+        """
+        mysql, conn = self._mysql()
+        rows = mysql.iter_rows("SELECT id, name FROM users", batch_size=2)
+        self.assertEqual(next(rows), {"id": 0, "name": "name0"})
+        rows.close()
+        # 未读取完的服务端游标不关闭,直接关闭连接,之后的操作重新连接
+        self.assertTrue(conn.closed)
+        self.assertFalse(conn.cursors[0][1].closed)
+        self.assertIsNone(mysql._conn)
+
+        mysql, conn = self._mysql()
+        for _ in mysql.iter_rows("SELECT id, name FROM users", batch_size=2, batched=True):
+            break
+        self.assertTrue(conn.closed)
+
+    def test_error(self):
+        """
+            Args:
+        """
+        mysql, conn = self._mysql(fail_after=2)
+        rows = []
+        with mock.patch("fessql.tinymysql.aelog.exception") as exception:
+            with self.assertRaises(pymysql.OperationalError):
+                for row in mysql.iter_rows("SELECT id, name FROM users", batch_size=2, as_tuple=True):
+                    rows.append(row)
+        self.assertEqual(rows, self.rows[:2])
+        self.assertEqual(exception.call_count, 1)
+        self.assertTrue(conn.closed)
+        self.assertIsNone(mysql._conn)
+
+
+if __name__ == '__main__':
+    unittest.main()